@@ -13,7 +13,8 @@ DROP TABLE IF EXISTS last_change;
 CREATE TABLE last_change (
     run_id INTEGER PRIMARY KEY,
     last_change_isodate TEXT,
-    last_change_unixtime INTEGER
+    last_change_unixtime INTEGER,
+    last_act_id INTEGER         -- highest transaction id ingested so far
 );
 DROP TABLE IF EXISTS log;
 CREATE TABLE log (
@@ -27,6 +28,7 @@ DROP TABLE IF EXISTS operations;
 CREATE TABLE operations (
     ops_id INTEGER PRIMARY KEY,
     act_id INTEGER,
+    op_id INTEGER,              -- position of the operation within its transaction
     rr_id INTEGER,
     op_type TEXT,
     bc_type TEXT,
@@ -35,5 +37,10 @@ CREATE TABLE operations (
     rr_fqdn TEXT,
     rr_type TEXT,
     rr_value TEXT,
-    rr_ttl INTEGER
+    rr_ttl INTEGER,
+    zone TEXT                   -- deepest zone of the View owning rr_fqdn
 );
+CREATE UNIQUE INDEX operations_act_op ON operations (act_id, op_id);
+CREATE INDEX operations_zone_act ON operations (zone, act_id);
+CREATE INDEX operations_fqdn ON operations (rr_fqdn);
+CREATE INDEX transactions_dt ON transactions (trans_dt);
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+asyncio client for the BAM v2 API
+
+The sync helpers in v2api share one requests Session and pay every
+round trip in turn. AsyncClient talks to the same endpoints over a
+pooled aiohttp connector so that many requests are in flight at once,
+bounded by its concurrency limit. It reuses the credentials of a
+v2api session, so scripts log in once with v2api.basic_auth (or
+v2api.login) and then hand the bulk work to the client:
+
+    v2api.basic_auth()
+
+    async def main():
+        async with AsyncClient.from_session(concurrency=16) as bam:
+            acts = await bam.get_rr_transactions(since_id=63000)
+            ops = await bam.get_operations([act["id"] for act in acts])
+
+    asyncio.run(main())
+
+aiohttp is an optional dependency: pip install changed_zones[async]
+"""
+
+import asyncio
+import ssl
+
+from pprint import pprint
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from changed_zones import v2api
+
+Concurrency = 16
+Page_size = 1000
+Timeout = 30
+
+
+class AsyncClient:
+    def __init__(self, base, headers, verify=None, concurrency=Concurrency, timeout=Timeout):
+        if aiohttp is None:
+            raise RuntimeError("AsyncClient needs aiohttp: pip install changed_zones[async]")
+        self.base = f"{v2api.Scheme}://{base}/api/v2"
+        self.headers = dict(headers)
+        self.verify = verify
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limit = None
+        self.session = None
+
+    @classmethod
+    def from_session(cls, concurrency=Concurrency, timeout=Timeout):
+        """a client using the credentials of the current v2api session"""
+        return cls(v2api.Base, v2api.Sess.headers, v2api.Sess.verify, concurrency, timeout)
+
+    async def __aenter__(self):
+        if isinstance(self.verify, str):
+            tls = ssl.create_default_context(cafile=self.verify)
+        elif self.verify is False:
+            tls = False
+        else:
+            tls = ssl.create_default_context()
+        self.limit = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ssl=tls)
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    async def request(self, method, path, params=None, payload=None):
+        """
+        returns the decoded JSON body, True for an empty success reply,
+        or None after reporting an error, like v2api._request
+        """
+        if v2api.Debug:
+            print(f"request: {method} {path} parameters: {params} json payload: {payload}")
+        try:
+            async with self.limit:
+                async with self.session.request(
+                    method, f"{self.base}{path}", params=params, json=payload
+                ) as resp:
+                    if resp.status >= 400:
+                        print(f"request: return code: {resp.status}")
+                        print(f"request: url: {resp.url}")
+                        print(f"request response: {await resp.text()}")
+                        return None
+                    if resp.status == 204:
+                        return True
+                    return await resp.json(content_type=None)
+        except asyncio.TimeoutError as timeout_err:
+            print(f"Timeout error status: {timeout_err}")
+        except aiohttp.ClientError as err:
+            print(f"An error occurred status: {err}")
+
+    async def paginate(self, path, params=None, limit=Page_size):
+        """
+        async generator over every item of a collection, page by page.
+        A page that can not be fetched raises v2api.PageError, as
+        v2api.paginate does, rather than ending the collection early.
+        """
+        params = dict(params or {})
+        offset = 0
+        while True:
+            params.update({"offset": offset, "limit": limit})
+            data = await self.request("GET", path, params=params)
+            if data is None:
+                raise v2api.PageError(f"paginate: GET {path} failed at offset {offset}")
+            for item in data["data"]:
+                yield item
+            if data["count"] < limit:
+                return
+            offset += limit
+
+    async def collect(self, path, params=None, limit=Page_size):
+        return [item async for item in self.paginate(path, params, limit)]
+
+    async def gather(self, coros):
+        """run coros together, results in the order given"""
+        return await asyncio.gather(*coros)
+
+    # configurations and views
+
+    async def get_confs(self):
+        return await self.collect("/configurations", {"fields": "name,id,type"})
+
+    async def get_conf(self, cid, params=None):
+        return await self.request("GET", f"/configurations/{cid}", params)
+
+    async def get_conf_views(self, cid):
+        return await self.collect(f"/configurations/{cid}/views", {"fields": "name,id,type"})
+
+    async def get_views(self, params=None):
+        return await self.collect("/views", params)
+
+    async def get_view(self, vid, params=None):
+        return await self.request("GET", f"/views/{vid}", params)
+
+    # transactions
+
+    async def get_rr_transactions(self, iso_start=None, iso_stop=None, since_id=None):
+        params = {
+            "fields": v2api.Transaction_fields,
+            "orderBy": "asc(id)",
+            "filter": v2api.rr_transactions_filter(iso_start, iso_stop, since_id),
+        }
+        actions = await self.collect("/transactions", params)
+        if v2api.Debug:
+            print("get_rr_transactions: all RR transactions:")
+            pprint(actions)
+        return actions
+
+    async def get_transactions_operations(self, tid):
+        """the operations of transaction tid, raising v2api.PageError if they can not be fetched"""
+        data = await self.request(
+            "GET",
+            f"/transactions/{tid}/operations",
+            params={"fields": "fieldUpdates,operationType,resourceType,resourceId"},
+        )
+        if data is None:
+            raise v2api.PageError(f"get_transactions_operations: GET operations of {tid} failed")
+        return data["data"]
+
+    async def get_operations(self, tids):
+        return await self.gather(self.get_transactions_operations(tid) for tid in tids)
+
+    # blocks, networks and addresses
+
+    async def get_collection_blocks(self, cid, params=None):
+        return await self.collect(f"/configurations/{cid}/blocks", params)
+
+    async def get_ipv4_blocks(self, cid):
+        params = {"fields": "id", "filter": "type:eq('IPv4Block')"}
+        return await self.collect(f"/configurations/{cid}/blocks", params)
+
+    async def get_collection_networks(self, blkid, params=None):
+        return await self.collect(f"/blocks/{blkid}/networks", params)
+
+    async def get_ipv4_networks(self, blkid):
+        params = {"fields": "range,id", "filter": "type:eq('IPv4Network')"}
+        return await self.get_collection_networks(blkid, params)
+
+    async def create_ipv4_network(self, blkid, cidr):
+        data = await self.request(
+            "POST",
+            f"/blocks/{blkid}/networks",
+            payload={
+                "type": "IPv4Network",
+                "range": cidr,
+                "defaultView": {"id": v2api.ViewID, "type": "View", "name": "default"},
+                "comment": v2api.Comment,
+            },
+        )
+        return data and data["id"]
+
+    async def delete_network_by_id(self, netid):
+        return await self.request("DELETE", f"/networks/{netid}")
+
+    async def get_addresses_by_hostname_id(self, hostid):
+        addrs = await self.collect(f"/resourceRecords/{hostid}/addresses", {"fields": "address"})
+        return [addr["address"] for addr in addrs]
+
+    # zones
+
+    async def get_zones(self, params=None):
+        return await self.collect("/zones", params)
+
+    async def get_zone_info(self, zid, params=None):
+        return await self.request("GET", f"/zones/{zid}", params)
+
+    async def get_collection_zones(self, colid, params=None):
+        collection = "views" if colid == v2api.ViewID else "zones"
+        return await self.collect(f"/{collection}/{colid}/zones", params)
+
+    async def get_all_zones(self, cid, vid):
+        params = {
+            "fields": "absoluteName,id",
+            "filter": f"configuration.id:eq({cid}) and view.id:eq({vid}) and type:eq('Zone')",
+        }
+        return {zone["absoluteName"]: zone["id"] for zone in await self.get_zones(params)}
+
+    async def create_subzone(self, pzid, name):
+        """create zone name directly below the zone (or View) pzid"""
+        collection = "views" if pzid == v2api.ViewID else "zones"
+        key = "absoluteName" if pzid == v2api.ViewID else "name"
+        data = await self.request(
+            "POST",
+            f"/{collection}/{pzid}/zones",
+            payload={"type": "Zone", key: name, "comment": v2api.Comment},
+        )
+        return data and data["id"]
+
+    async def delete_zone_by_id(self, zid):
+        return await self.request("DELETE", f"/zones/{zid}")
+
+    # resource records
+
+    async def get_rrs(self, cid):
+        return await self.collect("/resourceRecords", {"filter": f"configuration.id:eq({cid})"})
+
+    async def get_zone_rrs(self, zid, params=None):
+        return await self.collect(f"/zones/{zid}/resourceRecords", params)
+
+    async def create_rr(self, zid, payload):
+        """POST an RR built like v2api.create_rr does, returning its ID"""
+        data = await self.request("POST", f"/zones/{zid}/resourceRecords", payload=payload)
+        return data and data["id"]
+
+    async def update_rr(self, rr):
+        return await self.request("PUT", f'/resourceRecords/{rr["id"]}', payload=rr)
+
+    async def delete_rr_by_id(self, rr_id):
+        return await self.request("DELETE", f"/resourceRecords/{rr_id}")
+
+    async def get_system_version(self):
+        data = await self.request("GET", "/settings", {"filter": "type:eq('SystemSettings')"})
+        return data and data["data"][0]["version"]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""
+Small JSON file cache for data discovered from BAM
+
+Entries live in Cache_dir as <name>-<key>.json together with the time
+they were saved, and are ignored once older than the ttl the reader
+asks for. Files are written atomically and readable by the owner only.
+"""
+
+import json
+import os
+import re
+import time
+
+Cache_dir = os.environ.get(
+    "BAM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "changed_zones")
+)
+
+
+def path(name, key):
+    key = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(key))
+    return os.path.join(Cache_dir, f"{name}-{key}.json")
+
+
+def load(name, key, ttl):
+    """the data saved under name and key, or None if missing or older than ttl seconds"""
+    try:
+        with open(path(name, key)) as fd:
+            entry = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry.get("saved", 0) > ttl:
+        return None
+    return entry.get("data")
+
+
+def save(name, key, data):
+    os.makedirs(Cache_dir, mode=0o700, exist_ok=True)
+    target = path(name, key)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as out:
+        json.dump({"saved": time.time(), "data": data}, out)
+    os.replace(tmp, target)
+
+
+def clear(name, key):
+    try:
+        os.remove(path(name, key))
+    except FileNotFoundError:
+        pass
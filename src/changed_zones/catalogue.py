@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+Catalogue of the zones in a View
+
+Keeps name -> id and id -> name maps for O(1) lookups both ways, and
+a ZoneTree for deepest-suffix matching of names to their owning zone.
+It behaves enough like the {zone name: zone id} dict it replaces in
+v2api (in, [], iteration, len) that existing callers keep working.
+Names are stored in lower case without a trailing dot.
+"""
+
+from changed_zones.zonetree import ZoneTree
+
+Dot = "."
+
+
+def normal(zone):
+    return zone.strip(Dot).lower()
+
+
+class ZoneCatalogue:
+    def __init__(self, zones=None):
+        self.load(zones or dict())
+
+    def load(self, zones):
+        """replace the catalogue with the {name: id} dict zones"""
+        self.by_name = dict()
+        self.by_id = dict()
+        self.tree = ZoneTree()
+        for name, zid in zones.items():
+            self.add(name, zid)
+
+    def add(self, zone, zid):
+        zone = normal(zone)
+        old = self.by_name.get(zone)
+        if old is not None:
+            self.by_id.pop(old, None)
+        self.by_name[zone] = zid
+        self.by_id[zid] = zone
+        self.tree.add(zone, zid)
+
+    def remove(self, zone):
+        zone = normal(zone)
+        zid = self.by_name.pop(zone, None)
+        if zid is None:
+            return False
+        self.by_id.pop(zid, None)
+        self.tree.remove(zone)
+        return True
+
+    def id(self, zone):
+        """the zone's ID, or False if the View has no such zone"""
+        return self.by_name.get(normal(zone), False)
+
+    def name(self, zid):
+        return self.by_id.get(zid)
+
+    def find(self, fqdn):
+        """(zone name, zone id) of the deepest zone owning fqdn, or None"""
+        return self.tree.find(fqdn)
+
+    def to_dict(self):
+        return dict(self.by_name)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def __contains__(self, zone):
+        return normal(zone) in self.by_name
+
+    def __iter__(self):
+        return iter(list(self.by_name))
+
+    def __getitem__(self, zone):
+        return self.by_name[normal(zone)]
+
+    def __setitem__(self, zone, zid):
+        self.add(zone, zid)
+
+    def __delitem__(self, zone):
+        if not self.remove(zone):
+            raise KeyError(zone)
@@ -2,25 +2,44 @@
 
 """Code to see what BlueCat data has changed"""
 
+import csv
 import json
+import os
 import sys
-import sqlite3
-from click import Choice, Context, argument, group, option, pass_context, echo
+import tempfile
+import time
+from click import Choice, Context, FloatRange, IntRange, argument, group, option, pass_context, echo
+from click import Path as ClickPath
 
-from contextlib import closing
 from datetime import datetime, timezone, timedelta
 from rich import print
 from tqdm import tqdm
 
-from changed_zones import v2api
+from changed_zones import export as csv_export
+from changed_zones import replay, store, v2api
+from changed_zones.mirror import Mirror
+from changed_zones.invalidate import Invalidator
+from changed_zones.standin import Model, StandIn, seed
+from changed_zones.store import ChangeStore
 
-DB = "bc_dns_delta.db"
-Changed_zones = []
+DB = store.DB
+Debug = False
+Concurrency = 8
+Min_interval = 15
+Max_interval = 300
+Zone_refresh = 3600
+Changed_zones = set()
 Transaction_ids = []
 Now = datetime.now(timezone.utc)
 ISO_now = Now.strftime("%Y-%m-%dT%H:%M:%SZ")
 ISO_then = '1970-01-01T00:00:00Z'
 
+# subcommands answered from the local database alone
+Offline_commands = ["report", "bench", "serve"]
+# subcommands that attribute changes to zones, and so load the View's
+# zones afresh rather than trust a saved catalogue up to an hour old
+Zone_commands = ["from-last-change", "migrate", "watch"]
+
 @group()
 @option(
         "--verbose/--no-verbose",
@@ -32,15 +51,70 @@ ISO_then = '1970-01-01T00:00:00Z'
         default=False,
         help="Help runtime code with debugging info",
         )
+@option(
+        "--record",
+        type=ClickPath(file_okay=False),
+        help="Save the transactions and operations seen into this fixture directory",
+        )
+@option(
+        "--replay", "replay_dir",
+        type=ClickPath(exists=True, file_okay=False),
+        help="Answer from this fixture directory instead of BAM",
+        )
+@option(
+        "--latency",
+        default=0.0,
+        type=FloatRange(min=0),
+        help="Seconds of simulated round trip per request when replaying",
+        )
+@option(
+        "--rate",
+        default=0.0,
+        type=FloatRange(min=0),
+        help="Most requests per second to send to BAM, 0 for no limit",
+        )
+@option(
+        "--retries",
+        default=v2api.Retries,
+        type=IntRange(min=0),
+        show_default=True,
+        help="Retries of a request that times out or finds BAM overloaded",
+        )
+@option(
+        "--stats/--no-stats",
+        default=False,
+        help="Print calls, latency and bytes per API endpoint on exit",
+        )
+@option(
+        "--prom-file",
+        type=ClickPath(dir_okay=False, writable=True),
+        help="Write the per endpoint metrics to this Prometheus textfile (node_exporter)",
+        )
 @pass_context
-def run(ctx: Context, verbose, debug):
+def run(ctx: Context, verbose, debug, record, replay_dir, latency, rate, retries, stats, prom_file):
+    global Debug
     ctx.obj = dict()
     ctx.obj["DEBUG"] = debug
     ctx.obj["VERBOSE"] = verbose
+    Debug = debug
     v2api.Debug = debug
+    v2api.Retries = retries
+    v2api.set_rate_limit(rate)
+    v2api.Stats_report = stats
+    v2api.Stats_file = prom_file
     if debug:
         echo(f"action: {ctx.invoked_subcommand}")
-    v2api.basic_auth()
+    if replay_dir:
+        replay.replay(replay_dir, latency=latency)
+        v2api.Sess = v2api.Session()
+        v2api.Zone_cache_ttl = 0
+        v2api.load_zone_catalogue()
+    elif ctx.invoked_subcommand not in Offline_commands:
+        if record:
+            recorder = replay.Recorder(record)
+            replay.install(recorder)
+            ctx.call_on_close(recorder.save)
+        v2api.basic_auth(refresh_zones=ctx.invoked_subcommand in Zone_commands)
 
 @run.command()
 @pass_context
@@ -103,55 +177,389 @@ def offset(ctx, secs, mins, hrs, days, wks, mths, yrs):
     print(ISO_now, ISO_then)
 
 
+concurrency_option = option(
+    "-c", "--concurrency",
+    default=Concurrency,
+    type=IntRange(min=1),
+    show_default=True,
+    help="Number of transactions to fetch operations for at once when they can not be embedded",
+)
+
+batch_size_option = option(
+    "-b", "--batch-size",
+    default=store.Batch_size,
+    type=IntRange(min=0),
+    show_default=True,
+    help="Transactions to write per database commit, 0 for one commit per run",
+)
+
+
 @run.command()
 @pass_context
 @option(
     "--write",
     is_flag=True
 )
-def from_last_change(ctx, write):
+@concurrency_option
+@batch_size_option
+def from_last_change(ctx, write, concurrency, batch_size):
     """ lets go! """
     if ctx.obj["DEBUG"]:
         print("Running from the last time a change was made")
     v2api.get_system_version()
-    then = fetch_last_change()
+    with ChangeStore(DB, batch_size=batch_size) as db:
+        poll(db, concurrency)
+        if Changed_zones:
+            print(sorted(Changed_zones))
+        update_log(db)
+
+
+@run.command()
+@pass_context
+@concurrency_option
+@batch_size_option
+@option(
+    "--min-interval",
+    default=Min_interval,
+    type=IntRange(min=1),
+    show_default=True,
+    help="Seconds between polls while changes keep arriving",
+)
+@option(
+    "--max-interval",
+    default=Max_interval,
+    type=IntRange(min=1),
+    show_default=True,
+    help="Longest wait between polls once things have gone quiet",
+)
+@option(
+    "--zone-refresh",
+    default=Zone_refresh,
+    type=IntRange(min=0),
+    show_default=True,
+    help="Seconds between full reloads of the View's zones, 0 to never reload",
+)
+def watch(ctx, concurrency, batch_size, min_interval, max_interval, zone_refresh):
+    """
+    Keep polling for changes, printing changed zones as they appear.
+    The session and discovered IDs are reused for every poll, and
+    zones other users add or delete are followed in the feed.
+    """
+    interval = min_interval
+    loaded = time.monotonic()
+    invalidator = Invalidator(concurrency=concurrency)
+    with ChangeStore(DB, batch_size=batch_size) as db:
+        while True:
+            try:
+                if zone_refresh and time.monotonic() - loaded > zone_refresh:
+                    v2api.load_zone_catalogue(refresh=True)
+                    loaded = time.monotonic()
+                invalidator.poll()
+                count = poll(db, concurrency)
+            except Exception as err:
+                echo(f"watch: poll failed, logging in again: {err}", err=True)
+                db.discard()
+                count = 0
+                try:
+                    v2api.relogin()
+                except Exception as err:
+                    echo(f"watch: login failed: {err}", err=True)
+            if count:
+                update_log(db)
+                for zone in sorted(Changed_zones):
+                    echo(zone)
+            v2api.write_stats()
+            interval = next_interval(interval, count, min_interval, max_interval)
+            if Debug:
+                print(f"watch: {count} transactions, next poll in {interval}s")
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+
+
+@run.command()
+@pass_context
+def migrate(ctx):
+    """
+    Bring the database up to the current schema and fill in the
+    zone of operations recorded before it was tracked.
+    """
+    with ChangeStore(DB) as db:
+        count = db.backfill_zones(owning_zone)
+    echo(f"migrate: resolved the zone of {count} names")
+
+
+@run.command()
+@pass_context
+@option("-z", "--zone", help="Only changes within this zone")
+@option("-s", "--since", help="Only changes made at or after this ISO 8601 time")
+@option("-u", "--user", help="Only changes made by this user")
+def report(ctx, zone, since, user):
+    """Changes recorded in the local database, oldest first"""
+    with ChangeStore(DB) as db:
+        rows = db.report(zone=zone, since=since, user=user)
+    for row in rows:
+        echo("\t".join("" if col is None else str(col) for col in row))
+
+
+@run.command()
+@pass_context
+@option("--db", type=ClickPath(dir_okay=False, writable=True),
+        help="Mirror file, by default one per endpoint and View in the cache directory")
+@option("--reload/--no-reload", default=False, help="Copy the whole View again rather than sync")
+def mirror(ctx, db, reload):
+    """
+    Bring the local SQLite mirror of the View up to date: a full copy the
+    first time (or with --reload), then only the changes in /transactions.
+    """
+    start = time.perf_counter()
+    view_mirror = Mirror(db)
+    try:
+        if reload or not view_mirror.loaded:
+            view_mirror.load()
+            done = "loaded"
+        else:
+            done = f"synced {view_mirror.sync()} transactions into"
+        counts = view_mirror.counts()
+        echo(
+            f"mirror: {done} {view_mirror.db} in {time.perf_counter() - start:.1f}s: "
+            + ", ".join(f"{num} {table}" for table, num in counts.items())
+            + f", up to transaction {view_mirror.state('last_id')}"
+        )
+    finally:
+        view_mirror.close()
+
+
+@run.command()
+@pass_context
+@argument("changes", type=ClickPath(exists=True, dir_okay=False))
+@concurrency_option
+@option("--all/--no-all", "show_all", default=False,
+        help="List no-op lines too, not only those that would write or need a look")
+def plan(ctx, changes, concurrency, show_all):
+    """
+    Dry run of a bulk change file (action, fqdn, ttl, type, value lines):
+    what each line would do and the write calls it would take. Zones and
+    their RRs are read, one batch per zone, but nothing is written.
+    """
+    lines = v2api.read_changes(changes)
+    (results, cost) = v2api.plan_changes(
+        [change for _, change in lines], concurrency=concurrency, labels=[line for line, _ in lines]
+    )
+    for (line, change), result in zip(lines, results):
+        if result["status"] == "no-op" and not show_all:
+            continue
+        (action, fqdn, rr_type, value, ttl) = change
+        row = [line, result["status"], action, fqdn, rr_type, value, result["note"]]
+        echo("\t".join("" if col is None else str(col) for col in row))
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    echo(f"plan: {len(results)} lines: " + ", ".join(f"{num} {status}" for status, num in counts.items()), err=True)
+    kinds = ("POST", "PUT", "DELETE", "zones", "networks", "external hosts")
+    echo(
+        f"plan: {cost['writes']} write calls ("
+        + ", ".join(f"{kind}: {cost[kind]}" for kind in kinds if cost[kind])
+        + f"), {cost['reads']} zone reads made",
+        err=True,
+    )
+
+
+@run.command()
+@pass_context
+@argument("kind", type=Choice(["rrs", "zones", "transactions"]))
+@option("-o", "--output", type=ClickPath(dir_okay=False, writable=True),
+        help="Write to this file rather than standard output")
+@option("--format", "fmt", type=Choice(["jsonl", "csv"]), default="jsonl", show_default=True,
+        help="One JSON object per line, or CSV")
+@option("--since-id", type=IntRange(min=0), default=0, show_default=True,
+        help="Only transactions after this id")
+def export(ctx, kind, output, fmt, since_id):
+    """
+    Dump every RR of the Configuration, zone of the View or transaction,
+    streamed from BAM as text/csv so memory use stays flat.
+    """
+    if kind == "rrs":
+        rows = csv_export.rrs()
+    elif kind == "zones":
+        rows = csv_export.zones()
+    else:
+        rows = csv_export.transactions(since_id=since_id)
+    out = open(output, "w", newline="") if output else sys.stdout
+    try:
+        count = 0
+        writer = None
+        for row in rows:
+            if fmt == "jsonl":
+                out.write(json.dumps(row) + "\n")
+            else:
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(row), extrasaction="ignore")
+                    writer.writeheader()
+                writer.writerow(
+                    {key: json.dumps(val) if isinstance(val, (dict, list)) else val for key, val in row.items()}
+                )
+            count += 1
+    finally:
+        if output:
+            out.close()
+    if Debug or output:
+        echo(f"export: {count} {kind}", err=True)
+
+
+@run.command()
+@pass_context
+@concurrency_option
+@batch_size_option
+@option("-n", "--transactions", default=10000, type=IntRange(min=1), show_default=True,
+        help="Size of the synthetic transaction backlog")
+@option("--ops-per", default=1, type=IntRange(min=1), show_default=True,
+        help="Operations in each transaction")
+@option("--zones", default=100, type=IntRange(min=1), show_default=True,
+        help="Leaf zones the records are spread over")
+@option("--latency", default=0.02, type=FloatRange(min=0), show_default=True,
+        help="Seconds of simulated round trip per request")
+@option("--jitter", default=0.0, type=FloatRange(min=0), show_default=True,
+        help="Up to this many extra seconds per request")
+@option("--embed/--no-embed", default=True, show_default=True,
+        help="Whether the simulated server accepts fields=embed(operations)")
+def bench(ctx, concurrency, batch_size, transactions, ops_per, zones, latency, jitter, embed):
+    """
+    Time a catch-up poll of a synthetic backlog served through the
+    replay transport into a scratch database.
+    """
+    (acts, ops, zone_ids) = replay.synthesize(transactions, ops_per, zones)
+    replayer = replay.Replayer(acts, ops, zone_ids, latency=latency, jitter=jitter, embed=embed)
+    previous = replay.install(replayer)
+    v2api.Sess = v2api.Session()
+    v2api.Embed_operations = True
+    v2api.Zone_cache_ttl = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            with ChangeStore(os.path.join(tmp, "bench.db"), batch_size=batch_size) as db:
+                update_last_change(db, 0)
+                db.db_time = 0.0
+                start = time.perf_counter()
+                v2api.load_zone_catalogue()
+                count = poll(db, concurrency)
+                db.flush()
+                elapsed = time.perf_counter() - start
+    finally:
+        replay.install(previous)
+    echo(f"transactions:   {count}")
+    echo(f"changed zones:  {len(Changed_zones)}")
+    echo(f"elapsed:        {elapsed:.3f}s")
+    echo(f"throughput:     {count / elapsed:.1f} transactions/s")
+    echo(f"db time:        {db.db_time:.3f}s")
+    echo(f"api calls:      {sum(replayer.calls.values())}")
+    for call, num in sorted(replayer.calls.items()):
+        echo(f"    {num:8d}  {call}")
+
+
+@run.command()
+@pass_context
+@option("--host", default="localhost", show_default=True, help="Address to listen on")
+@option("--port", default=8080, type=IntRange(min=0, max=65535), show_default=True,
+        help="Port to listen on")
+@option("--records", default=100000, type=IntRange(min=0), show_default=True,
+        help="RRs to seed the View with")
+@option("--zones", default=100, type=IntRange(min=1), show_default=True,
+        help="Zones to spread the seeded RRs over")
+@option("--history/--no-history", default=False,
+        help="Log the seeded zones and RRs as transactions too")
+@option("--latency", default=0.02, type=FloatRange(min=0), show_default=True,
+        help="Seconds added to every reply")
+@option("--jitter", default=0.0, type=FloatRange(min=0), show_default=True,
+        help="Up to this many random seconds more per reply")
+@option("--per-item", default=0.0, type=FloatRange(min=0), show_default=True,
+        help="Seconds added per item in a listing")
+@option("--error-rate", default=0.0, type=FloatRange(min=0, max=1), show_default=True,
+        help="Share of requests answered 503")
+@option("--throttle-rate", default=0.0, type=FloatRange(min=0, max=1), show_default=True,
+        help="Share of requests answered 429")
+@option("--token-ttl", default=3600, type=IntRange(min=1), show_default=True,
+        help="Seconds a session token stays valid")
+def serve(ctx, host, port, records, zones, history, latency, jitter, per_item, error_rate,
+          throttle_rate, token_ttl):
+    """
+    Serve a seeded in-memory stand-in for the BAM v2 API over plain HTTP,
+    for load and regression testing away from the shared BAM.
+    """
+    start = time.perf_counter()
+    model = seed(Model(), records=records, zones=zones, history=history)
+    server = StandIn(
+        model,
+        latency=latency,
+        jitter=jitter,
+        per_item=per_item,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+        token_ttl=token_ttl,
+    )
+    httpd = server.serve(host, port)
+    echo(f"serve: {len(model.objects)} objects seeded in {time.perf_counter() - start:.1f}s", err=True)
+    echo(f"serve: BAM_SCHEME=http BAM_ENDPOINT={server.address}", err=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def next_interval(interval, count, min_interval, max_interval):
+    """
+    Poll at the shortest interval while transactions are arriving
+    and double the wait after every quiet poll.
+    """
+    if count:
+        return min_interval
+    return min(interval * 2, max_interval)
+
+
+def poll(db, concurrency=Concurrency):
+    """
+    Ingest every transaction past the stored watermark and return how
+    many there were. Changed_zones and Transaction_ids only hold what
+    this poll found.
+    """
+    Changed_zones.clear()
+    Transaction_ids.clear()
+    (then, last_id) = fetch_last_change(db)
     now = get_isodate_now()
     # all_acts = v2api.get_all_transactions(then, now)
     # if Debug:
     #     print(all_acts)
-    tactions = v2api.get_rr_transactions(then, now)
-    for action in tqdm(tactions, leave=False):
+    tactions = v2api.get_rr_transactions_with_operations(
+        then, now, concurrency, since_id=last_id
+    )
+    for action, ops in tqdm(tactions, leave=False, disable=not tactions):
         if Debug:
             print(action)
-        update_transactions(action)
-        ops = v2api.get_transactions_operations(action["id"])
+        update_transactions(db, action)
         if Debug:
             print(f'action id: {action["id"]}')
             print("operations:")
             print(ops)
-        update_operations(action["id"], ops)
-    if Changed_zones:
-        update_last_change()
-        print(Changed_zones)
-    update_log()
+        update_operations(db, action["id"], ops)
+    if tactions:
+        update_last_change(db, tactions[-1][0]["id"])
+    return len(tactions)
+
 
-def update_last_change():
-    """ update last change to be now """
-    idx = 1
+def update_last_change(db, act_id):
+    """
+    update last change to be now and move the watermark
+    up to act_id, the last transaction ingested
+    """
     dt = datetime.now(timezone.utc)
     unixtime = int(dt.timestamp())
     isodate = dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-    with closing(sqlite3.connect(DB)) as con:
-        with closing(con.cursor()) as cur:
-            sql = """
-            INSERT into last_change (run_id, last_change_isodate, last_change_unixtime) VALUES (?, ?, ?)
-            ON CONFLICT(run_id) DO UPDATE SET last_change_isodate = excluded.last_change_isodate, last_change_unixtime = excluded.last_change_unixtime;
-            """
-            cur.execute(sql, (idx, isodate, unixtime))
-            con.commit()
+    db.update_last_change(isodate, unixtime, act_id)
 
 
-def update_log():
+def update_log(db):
     """update the log table with all the new entries for future ref."""
     dt = datetime.now(timezone.utc)
     unixtime = int(dt.timestamp())
@@ -161,17 +569,11 @@ def update_log():
     if Transaction_ids:
         tids = json.dumps(Transaction_ids)
     if Changed_zones:
-        zones = json.dumps(Changed_zones)
-    with closing(sqlite3.connect(DB)) as con:
-        with closing(con.cursor()) as cur:
-            sql = """
-                INSERT into log (log_isodate,log_unixtime,log_transaction_ids,log_changed_zones) VALUES (?,?,?,?);
-            """
-            cur.execute(sql, (isodate, unixtime, tids, zones))
-            con.commit()
+        zones = json.dumps(sorted(Changed_zones))
+    db.update_log(isodate, unixtime, tids, zones)
 
 
-def update_transactions(act):
+def update_transactions(db, act):
     """
      Update all the new transactions.
      Transaction data structure:
@@ -190,26 +592,18 @@ def update_transactions(act):
                'type': 'User'}
      }
     """
-    with closing(sqlite3.connect(DB)) as con:
-        with closing(con.cursor()) as cur:
-            sql = """
-            INSERT OR IGNORE INTO transactions (act_id, trans_dt, trans_desc, trans_op, trans_user)
-            VALUES (?, ?, ?, ?, ?)
-            """
-            cur.execute(
-                sql,
-                (
-                    act["id"],
-                    act["creationDateTime"],
-                    act["description"],
-                    act["operation"],
-                    act["user"]["name"],
-                ),
-            )
-            con.commit()
-
-
-def update_operations(act_id, ops):
+    db.add_transaction(
+        (
+            act["id"],
+            act["creationDateTime"],
+            act["description"],
+            act["operation"],
+            act["user"]["name"],
+        )
+    )
+
+
+def update_operations(db, act_id, ops):
     """ Update the operations table with all new actions.
     Operations data structure:
     [
@@ -235,7 +629,7 @@ def update_operations(act_id, ops):
 
     Transaction_ids.append(act_id)
     op_inserts = []
-    for op in ops:
+    for op_id, op in enumerate(ops):
         if Debug:
             print(op)
         fupdates = op["fieldUpdates"]
@@ -266,8 +660,10 @@ def update_operations(act_id, ops):
                 if nm == "linkedRecord":
                     rr_value = field[key]
                 rr_type = "CNAME"
+        zone = owning_zone(rr_fqdn)
         data = (
             act_id,
+            op_id,
             rr_id,
             op_type,
             bc_type,
@@ -277,39 +673,39 @@ def update_operations(act_id, ops):
             rr_type,
             rr_value,
             rr_ttl,
+            zone,
         )
         op_inserts.append(data)
-        toks = rr_fqdn.split(".")
-        zone = ".".join(toks[-2:])
-        if zone not in Changed_zones:
-            Changed_zones.append(zone)
-    with closing(sqlite3.connect(DB)) as con:
-        with closing(con.cursor()) as cur:
-            #           (act_id,rr_id,op_type,bc_type,rr_comment,rr_hname,rr_fqdn,rr_type,rr_value,rr_ttl)
-            sql = """
-            INSERT INTO operations
-            (act_id,rr_id,op_type,bc_type,rr_comment,rr_hname,rr_fqdn,rr_type,rr_value,rr_ttl)
-            VALUES (?,?,?,?,?,?,?,?,?,?) 
-            """
-            if Debug:
-                print(f"update_operations: sql query: {sql}")
-                print(op_inserts)
-            cur.executemany(sql, op_inserts)
-        con.commit()
+        Changed_zones.add(zone)
+    if Debug:
+        print("update_operations:")
+        print(op_inserts)
+    db.add_operations(op_inserts, act_id)
 
 
-def fetch_last_change():
+def owning_zone(fqdn):
+    """
+    the deepest zone of the View that fqdn lives in. Names outside
+    every known zone fall back to their last two labels.
+    """
+    found = v2api.find_zone(fqdn)
+    if found is not None:
+        return found[0]
+    toks = fqdn.strip(".").lower().split(".")
+    return ".".join(toks[-2:])
+
+
+def fetch_last_change(db):
+    """
+    gets the last time stamp and transaction id watermark from the last run.
+    Without a watermark the time stamp is used to bootstrap the first scan.
+    """
     Tau0 = '2024-12-17T12:00:00Z'
-    """gets the last time stamp from the last run."""
-    with closing(sqlite3.connect(DB)) as con:
-        with closing(con.cursor()) as cur:
-            sql = "SELECT last_change_isodate from last_change WHERE run_id = 1"
-            row = cur.execute(sql).fetchone()
-            con.commit()
+    row = db.fetch_last_change()
     if row is not None:
-        return row[0]
+        return (row[0], row[1])
     else:
-        return Tau0
+        return (Tau0, None)
 
 
 def get_isodate_now():
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Stream large listings out of BAM as text/csv
+
+The JSON helpers in v2api decode each page in full. Here the same
+collections are requested as text/csv, one Page_size page at a time,
+and read row by row off the response stream. A dump of every RR in a
+Configuration therefore holds only a row at a time, however large it
+gets. Each row comes back as a dict with typed values:
+
+    empty                   None
+    id, ttl, ...            int
+    true / false            bool, except in free text columns
+    {...} / [...]           the decoded JSON of nested objects
+
+    for rr in export.rrs():
+        print(rr["absoluteName"], rr["ttl"])
+"""
+
+import csv
+import io
+import json
+
+from changed_zones import v2api
+
+Media_type = "text/csv"
+# rows per request; larger than v2api.Page_size since pages are not held
+Page_size = 10000
+
+Fields = {
+    "rrs": "id,type,name,absoluteName,ttl,recordType,rdata,text,comment",
+    "zones": "id,type,name,absoluteName",
+    "transactions": v2api.Transaction_fields,
+}
+
+Int_columns = ("id", "ttl", "count", "port", "priority", "weight")
+Text_columns = ("absoluteName", "comment", "description", "name", "rdata", "text")
+
+
+def typed(row):
+    out = dict()
+    for key, val in row.items():
+        if val is None or val == "":
+            val = None
+        elif key in Int_columns or key.endswith(".id"):
+            try:
+                val = int(val)
+            except ValueError:
+                pass
+        elif key in Text_columns:
+            pass
+        elif val in ("true", "false"):
+            val = val == "true"
+        elif val[0] in "{[":
+            try:
+                val = json.loads(val)
+            except ValueError:
+                pass
+        out[key] = val
+    return out
+
+
+def _reader(resp):
+    """a text stream over the body of resp, decoded as it arrives"""
+    raw = getattr(resp, "raw", None)
+    if raw is None:
+        return io.StringIO(resp.text)
+    raw.decode_content = True
+    # TextIOWrapper reads once more after the end, so leave closing to _done
+    raw.auto_close = False
+    return io.TextIOWrapper(raw, encoding=resp.encoding or "utf-8", newline="")
+
+
+"""
+Every row of the collection at path as a typed dict. A page that can
+not be fetched raises v2api.PageError, as v2api.paginate does.
+"""
+
+
+def rows(path, params=None, fields=None, filter=None, limit=Page_size):
+    params = dict(params or {})
+    if fields is not None:
+        params["fields"] = fields
+    if filter is not None:
+        params["filter"] = filter
+    offset = 0
+    while True:
+        page = dict(params, offset=offset, limit=limit)
+        resp = v2api._request("GET", path, params=page, accept=Media_type, stream=True)
+        if resp is None:
+            raise v2api.PageError(f"export: GET {path} failed at offset {offset}")
+        count = 0
+        # held until _done, as dropping the wrapper closes the stream under it
+        text = _reader(resp)
+        try:
+            for row in csv.DictReader(text):
+                count += 1
+                yield typed(row)
+        finally:
+            _done(path, resp)
+        if count < limit:
+            return
+        offset += limit
+
+
+def _done(path, resp):
+    raw = getattr(resp, "raw", None)
+    received = raw.tell() if raw is not None else len(resp.text)
+    v2api.Stats.add_bytes("GET", v2api.template(path), received)
+    if hasattr(resp, "close"):
+        resp.close()
+
+
+def rrs(cid=None, fields=Fields["rrs"]):
+    """every RR of the Configuration cid (ConfID by default)"""
+    if cid is None:
+        cid = v2api.ConfID
+    return rows("/resourceRecords", fields=fields, filter=f"configuration.id:eq({cid})")
+
+
+def zones(cid=None, vid=None, fields=Fields["zones"]):
+    """every zone of the View vid (ViewID by default) in Configuration cid"""
+    if cid is None:
+        cid = v2api.ConfID
+    if vid is None:
+        vid = v2api.ViewID
+    filt = f"configuration.id:eq({cid}) and view.id:eq({vid}) and type:eq('Zone')"
+    return rows("/zones", params={"orderBy": "asc(id)"}, fields=fields, filter=filt)
+
+
+def transactions(since_id=None, iso_start=None, iso_stop=None, fields=Fields["transactions"]):
+    """every transaction by anyone after since_id, or between iso_start and iso_stop"""
+    if since_id is None and iso_start is None:
+        since_id = 0
+    filt = v2api.rr_transactions_filter(iso_start, iso_stop, since_id, everyone=True)
+    return rows("/transactions", params={"orderBy": "asc(id)"}, fields=fields, filter=filt)
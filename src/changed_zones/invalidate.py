@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+Keep the v2api caches in step with changes anyone makes in BAM
+
+An Invalidator reads the /transactions feed on from the last id it saw.
+It reads every user's changes of every kind, not only the RR changes
+that rr_transactions_filter normally picks out. It acts on each
+operation according to the type of resource changed:
+
+    Zone                 deleted zones leave ViewZones along with their
+                         cached RR lists; added zones of the View join it
+    ExternalHostRecord   a deleted host leaves ExHosts; any other change
+                         makes ExHosts download again on next use
+    IPv4Network          a deleted network leaves Networks; any other
+                         change makes Networks download again on next use
+    any other ...Record  the cached RR lists of the record's zone are
+                         dropped
+
+The zone of a record is taken from RR_zone when get_zone_rrs has seen
+the record. Otherwise it is the View zone owning the absoluteName in
+its fieldUpdates. Nothing else is evicted, so a long running process
+can call poll() every few seconds and keep its caches both warm and
+correct.
+"""
+
+from collections import Counter
+
+from changed_zones import v2api
+
+
+def absolute_name(op):
+    """the absoluteName an operation set or cleared, or None"""
+    for update in op.get("fieldUpdates") or []:
+        if update.get("name") == "absoluteName":
+            return update.get("value") or update.get("previousValue")
+    return None
+
+
+class Invalidator:
+    def __init__(self, last_id=None, concurrency=8):
+        self.last_id = last_id
+        self.concurrency = concurrency
+        self.evicted = Counter()
+
+    def poll(self):
+        """
+        apply the transactions after last_id, returning how many there
+        were. Without a last_id the feed is only read up to now.
+        """
+        if self.last_id is None:
+            self.last_id = v2api.get_last_transaction_id()
+            return 0
+        tactions = v2api.get_rr_transactions_with_operations(
+            concurrency=self.concurrency, since_id=self.last_id, everyone=True
+        )
+        for act, ops in tactions:
+            for op in ops or []:
+                self.apply(op)
+            self.last_id = act["id"]
+        if v2api.Debug and tactions:
+            print(f"Invalidator.poll: {len(tactions)} transactions, evicted {dict(self.evicted)}")
+        return len(tactions)
+
+    def apply(self, op):
+        rtype = op.get("resourceType") or ""
+        rid = op.get("resourceId")
+        kind = op.get("operationType")
+        if rtype == "Zone":
+            self.zone(kind, rid)
+        elif rtype == "ExternalHostRecord":
+            self.ex_host(kind, rid)
+        elif rtype == "IPv4Network":
+            self.network(kind, rid)
+        elif rtype.endswith("Record"):
+            self.record(rid, absolute_name(op))
+
+    def zone(self, kind, zid):
+        zones = v2api.ViewZones
+        name = zones.name(zid)
+        if kind == "ADD" and name is not None:
+            return
+        if name is not None:
+            zones.remove(name)
+            v2api.forget_zone_rrs(zid)
+            v2api.Zones_changed = True
+            self.evicted["zones"] += 1
+        if kind != "DELETE":
+            name = v2api.get_view_zone_name(zid)
+            if name is not None:
+                zones.add(name, zid)
+                v2api.Zones_changed = True
+
+    def ex_host(self, kind, hid):
+        hosts = v2api.ExHosts
+        if kind == "DELETE" and hosts is not None:
+            for name in [name for name, known in hosts.items() if known == hid]:
+                del hosts[name]
+                v2api.ExHosts_changed = True
+            v2api.forget_zone_rrs(v2api.ExHostZoneID)
+        elif hosts is None or kind != "ADD" or hid not in hosts.values():
+            v2api.forget_ex_hosts()
+        self.evicted["external hosts"] += 1
+
+    def network(self, kind, netid):
+        if v2api.Networks is None:
+            return
+        if kind == "DELETE":
+            v2api.Networks.remove_id(netid)
+        else:
+            v2api.forget_networks()
+        self.evicted["networks"] += 1
+
+    def record(self, rid, name):
+        zid = v2api.RR_zone.get(rid)
+        if zid is None and name:
+            found = v2api.find_zone(name)
+            zid = found and found[1]
+        if zid is None:
+            if v2api.ZoneRRs:
+                self.evicted["zone rrs"] += len(v2api.ZoneRRs)
+                v2api.ZoneRRs.clear()
+        elif v2api.forget_zone_rrs(zid):
+            self.evicted["zone rrs"] += 1
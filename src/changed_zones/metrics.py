@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+Per endpoint request metrics
+
+v2api._request reports every attempt it makes to a Metrics object,
+keyed by method and path template (IDs replaced by {id}):
+
+    count and status codes, or timeout / connection / error when
+    no reply came back
+    latency, as a histogram over Buckets plus the total
+    bytes received
+
+summary() gives a table to print at the end of a run, sorted by total
+time spent, which is where the N+1 lookups show up. write_textfile()
+writes the same numbers in the Prometheus text format for the
+node_exporter textfile collector.
+"""
+
+import bisect
+import os
+import threading
+
+from collections import Counter
+
+# upper bounds in seconds of the latency histogram buckets
+Buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+Prefix = "bam_api"
+
+
+class Endpoint:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.received = 0
+        self.buckets = [0] * (len(Buckets) + 1)
+        self.statuses = Counter()
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile, None past the last"""
+        rank = q * self.count
+        seen = 0
+        for idx, num in enumerate(self.buckets):
+            seen += num
+            if seen >= rank and num:
+                return Buckets[idx] if idx < len(Buckets) else None
+        return None
+
+
+class Metrics:
+    def __init__(self):
+        self.endpoints = dict()
+        self.lock = threading.Lock()
+
+    def _get(self, method, template):
+        key = (method, template)
+        if key not in self.endpoints:
+            self.endpoints[key] = Endpoint()
+        return self.endpoints[key]
+
+    def observe(self, method, template, status, seconds, received=0):
+        with self.lock:
+            point = self._get(method, template)
+            point.count += 1
+            point.seconds += seconds
+            point.received += received
+            point.buckets[bisect.bisect_left(Buckets, seconds)] += 1
+            point.statuses[str(status)] += 1
+
+    def add_bytes(self, method, template, received):
+        with self.lock:
+            self._get(method, template).received += received
+
+    def clear(self):
+        with self.lock:
+            self.endpoints = dict()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def summary(self):
+        """a table of the endpoints, those taking the longest first"""
+        with self.lock:
+            points = sorted(self.endpoints.items(), key=lambda item: -item[1].seconds)
+        lines = [
+            f'{"calls":>7} {"total s":>9} {"mean ms":>8} {"p95 ms":>7} {"KiB":>9}  endpoint  statuses'
+        ]
+        for (method, template), point in points:
+            mean = 1000 * point.seconds / point.count if point.count else 0.0
+            p95 = point.quantile(0.95)
+            p95 = f"{1000 * p95:.0f}" if p95 is not None else f">{1000 * Buckets[-1]:.0f}"
+            statuses = " ".join(f"{code}:{num}" for code, num in sorted(point.statuses.items()))
+            lines.append(
+                f"{point.count:>7} {point.seconds:>9.3f} {mean:>8.1f} {p95:>7} "
+                f"{point.received / 1024:>9.1f}  {method} {template}  {statuses}"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        with self.lock:
+            points = sorted(self.endpoints.items())
+        out = [
+            f"# HELP {Prefix}_requests_total Requests sent to BAM by reply status.",
+            f"# TYPE {Prefix}_requests_total counter",
+        ]
+        for (method, template), point in points:
+            for status, num in sorted(point.statuses.items()):
+                out.append(f"{Prefix}_requests_total{_labels(method, template, status=status)} {num}")
+        out += [
+            f"# HELP {Prefix}_request_duration_seconds Time taken by requests to BAM.",
+            f"# TYPE {Prefix}_request_duration_seconds histogram",
+        ]
+        for (method, template), point in points:
+            seen = 0
+            for bound, num in zip(Buckets + ("+Inf",), point.buckets):
+                seen += num
+                labels = _labels(method, template, le=bound)
+                out.append(f"{Prefix}_request_duration_seconds_bucket{labels} {seen}")
+            labels = _labels(method, template)
+            out.append(f"{Prefix}_request_duration_seconds_sum{labels} {point.seconds}")
+            out.append(f"{Prefix}_request_duration_seconds_count{labels} {point.count}")
+        out += [
+            f"# HELP {Prefix}_response_bytes_total Bytes received from BAM.",
+            f"# TYPE {Prefix}_response_bytes_total counter",
+        ]
+        for (method, template), point in points:
+            out.append(f"{Prefix}_response_bytes_total{_labels(method, template)} {point.received}")
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path):
+        """write prometheus() to path atomically, as the textfile collector needs"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as out:
+            out.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+def _labels(method, template, **extra):
+    pairs = [("method", method), ("path", template)] + list(extra.items())
+    quoted = ",".join(f'{name}="{_escape(val)}"' for name, val in pairs)
+    return "{" + quoted + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+"""
+Local SQLite mirror of the View
+
+load() copies the zones of ViewID, the RRs in them (external hosts
+included) and the networks of BlockID into an indexed SQLite file,
+noting the newest transaction beforehand. sync() then reads
+/transactions from there on and brings the copy up to date:
+
+    Zone                 re-read by id, or dropped with its RRs
+    ...Record            re-read in batches by id, dropped when gone
+    IPv4Network          the same, within BlockID
+
+Only the objects the operations name are fetched, so a sync costs a
+few requests however large the View is. Once attached to v2api the
+is_* helpers, get_generic_rrs and get_hostname_addresses answer from
+the mirror with an indexed lookup instead of downloading a zone, after
+a sync when the mirror is older than Mirror_max_age seconds or
+writes through v2api have made it stale:
+
+    mirror.attach(max_age=60)
+    v2api.is_A_rr("www.example.com", "10.0.0.1")
+"""
+
+import ipaddress
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from changed_zones import cache, v2api
+
+# ids per id:in(...) filter when re-reading changed objects
+Batch_size = 100
+
+Schema = """
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS zones (
+    id INTEGER PRIMARY KEY,
+    absolute_name TEXT
+);
+CREATE TABLE IF NOT EXISTS rrs (
+    id INTEGER PRIMARY KEY,
+    zone_id INTEGER,
+    absolute_name TEXT,
+    type TEXT,
+    value TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS networks (
+    id INTEGER PRIMARY KEY,
+    range TEXT,
+    start INTEGER,
+    end INTEGER
+);
+CREATE INDEX IF NOT EXISTS zones_name ON zones (absolute_name);
+CREATE INDEX IF NOT EXISTS rrs_name ON rrs (absolute_name, type);
+CREATE INDEX IF NOT EXISTS rrs_zone ON rrs (zone_id);
+CREATE INDEX IF NOT EXISTS networks_start ON networks (start);
+"""
+
+Rr_sql = "INSERT OR REPLACE INTO rrs (id, zone_id, absolute_name, type, value, data) VALUES (?,?,?,?,?,?)"
+Network_sql = "INSERT OR REPLACE INTO networks (id, range, start, end) VALUES (?,?,?,?)"
+
+
+def default_path(cid=None, vid=None):
+    """the mirror file of the View under cache.Cache_dir"""
+    key = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{v2api.Base}-{cid or v2api.ConfID}-{vid or v2api.ViewID}")
+    return os.path.join(cache.Cache_dir, f"mirror-{key}.db")
+
+
+def rr_row(rr):
+    (_, rr_type) = v2api.rr_key(rr)
+    data = {key: val for key, val in rr.items() if not key.startswith("_")}
+    return (
+        rr["id"],
+        (rr.get("zone") or {}).get("id"),
+        (rr.get("absoluteName") or "").lower(),
+        rr_type,
+        v2api.rr_value(rr),
+        json.dumps(data),
+    )
+
+
+def network_row(net):
+    ipnet = ipaddress.ip_network(net["range"], strict=False)
+    return (net["id"], str(ipnet), int(ipnet.network_address), int(ipnet.broadcast_address))
+
+
+class Mirror:
+    def __init__(self, db=None, cid=None, vid=None):
+        self.cid = cid or v2api.ConfID
+        self.vid = vid or v2api.ViewID
+        self.db = db or default_path(self.cid, self.vid)
+        if self.db != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db)), mode=0o700, exist_ok=True)
+        self.con = sqlite3.connect(self.db, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        with self.con:
+            self.con.executescript(Schema)
+        self.lock = threading.RLock()
+        # set by v2api writes so the next lookup syncs whatever the age
+        self.stale = False
+
+    def close(self):
+        self.con.close()
+
+    def state(self, name, default=None):
+        row = self.con.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, **values):
+        self.con.executemany(
+            "INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)",
+            [(name, json.dumps(val)) for name, val in values.items()],
+        )
+
+    @property
+    def loaded(self):
+        return self.state("view") == [v2api.Base, self.cid, self.vid]
+
+    @property
+    def age(self):
+        """seconds since the mirror last caught up with BAM"""
+        return time.time() - self.state("synced", 0)
+
+    def counts(self):
+        return {
+            table: self.con.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+            for table in ("zones", "rrs", "networks")
+        }
+
+    """
+    Copy the whole View. The newest transaction id is read first so
+    that changes made during the load are applied again by sync().
+    """
+
+    def load(self):
+        with self.lock:
+            start = time.perf_counter()
+            last_id = v2api.get_last_transaction_id()
+            if last_id is None:
+                raise v2api.PageError("mirror: the transaction feed can not be read")
+            zones = v2api.get_all_zones(self.cid, self.vid)
+            zone_ids = set(zones.values()) | {v2api.ExHostZoneID}
+            with self.con:
+                for table in ("zones", "rrs", "networks", "state"):
+                    self.con.execute(f"DELETE FROM {table}")
+                self.con.executemany(
+                    "INSERT INTO zones (id, absolute_name) VALUES (?, ?)",
+                    [(zid, name.lower()) for name, zid in zones.items()],
+                )
+                rows = list()
+                for rr in v2api.paginate("/resourceRecords", filter=f"configuration.id:eq({self.cid})"):
+                    if (rr.get("zone") or {}).get("id") in zone_ids:
+                        rows.append(rr_row(rr))
+                    if len(rows) >= 5000:
+                        self.con.executemany(Rr_sql, rows)
+                        rows = list()
+                self.con.executemany(Rr_sql, rows)
+                networks = v2api.get_collection_networks(v2api.BlockID) if v2api.BlockID else []
+                self.con.executemany(Network_sql, [network_row(net) for net in networks])
+                self.set_state(
+                    view=[v2api.Base, self.cid, self.vid], last_id=last_id, synced=time.time()
+                )
+            self.stale = False
+            if v2api.Debug:
+                print(f"Mirror.load: {self.counts()} in {time.perf_counter() - start:.1f}s")
+            return self.counts()
+
+    """
+    Apply the transactions after the last one seen, returning how many
+    there were. Only the latest operation on each object counts, and
+    the objects still there are re-read as they are now.
+    """
+
+    def sync(self):
+        with self.lock:
+            last_id = self.state("last_id", 0)
+            acts = v2api.get_rr_transactions_with_operations(since_id=last_id, everyone=True)
+            changed = {"zones": dict(), "rrs": dict(), "networks": dict()}
+            for act, ops in acts:
+                for op in ops or []:
+                    rtype = op.get("resourceType") or ""
+                    if rtype == "Zone":
+                        table = "zones"
+                    elif rtype == "IPv4Network":
+                        table = "networks"
+                    elif rtype.endswith("Record"):
+                        table = "rrs"
+                    else:
+                        continue
+                    changed[table][op.get("resourceId")] = op.get("operationType")
+            with self.con:
+                self.sync_zones(changed["zones"])
+                self.sync_rrs(changed["rrs"])
+                self.sync_networks(changed["networks"])
+                if acts:
+                    last_id = acts[-1][0]["id"]
+                self.set_state(last_id=last_id, synced=time.time())
+            self.stale = False
+            if v2api.Debug and acts:
+                sizes = {table: len(ids) for table, ids in changed.items()}
+                print(f"Mirror.sync: {len(acts)} transactions to {last_id}, changed {sizes}")
+            return len(acts)
+
+    def sync_zones(self, changed):
+        for zid, kind in changed.items():
+            name = None if kind == "DELETE" else v2api.get_view_zone_name(zid)
+            if name is None:
+                self.con.execute("DELETE FROM zones WHERE id = ?", (zid,))
+                self.con.execute("DELETE FROM rrs WHERE zone_id = ?", (zid,))
+            else:
+                self.con.execute(
+                    "INSERT OR REPLACE INTO zones (id, absolute_name) VALUES (?, ?)", (zid, name.lower())
+                )
+
+    def sync_rrs(self, changed):
+        zone_ids = {row[0] for row in self.con.execute("SELECT id FROM zones")}
+        zone_ids.add(v2api.ExHostZoneID)
+        found = dict()
+        for rr in self.fetch("/resourceRecords", changed):
+            if (rr.get("zone") or {}).get("id") in zone_ids:
+                found[rr["id"]] = rr
+        self.con.executemany(Rr_sql, [rr_row(rr) for rr in found.values()])
+        gone = [(rid,) for rid in changed if rid not in found]
+        self.con.executemany("DELETE FROM rrs WHERE id = ?", gone)
+
+    def sync_networks(self, changed):
+        if not v2api.BlockID:
+            return
+        found = {net["id"]: net for net in self.fetch(f"/blocks/{v2api.BlockID}/networks", changed)}
+        self.con.executemany(Network_sql, [network_row(net) for net in found.values()])
+        self.con.executemany("DELETE FROM networks WHERE id = ?", [(nid,) for nid in changed if nid not in found])
+
+    @staticmethod
+    def fetch(path, changed):
+        """the objects at path among those changed and not deleted, Batch_size at a time"""
+        ids = [oid for oid, kind in changed.items() if kind != "DELETE"]
+        for idx in range(0, len(ids), Batch_size):
+            batch = ",".join(str(oid) for oid in ids[idx:idx + Batch_size])
+            yield from v2api.paginate(path, filter=f"id:in({batch})")
+
+    def refresh(self, max_age=None):
+        """
+        load the View if the mirror has never held it, else sync when
+        stale or older than max_age seconds. A sync that fails leaves
+        the mirror answering as it is.
+        """
+        with self.lock:
+            if not self.loaded:
+                return self.load()
+            if self.stale or (max_age is not None and self.age > max_age):
+                try:
+                    return self.sync()
+                except v2api.PageError as err:
+                    print(f"Mirror.refresh: sync failed, answering from {self.age:.0f}s old data: {err}")
+            return None
+
+    """
+    Lookups
+    """
+
+    def query(self, sql, args):
+        with self.lock:
+            return self.con.execute(sql, args).fetchall()
+
+    def zone_id(self, zone):
+        rows = self.query("SELECT id FROM zones WHERE absolute_name = ?", (zone.strip(".").lower(),))
+        return rows[0][0] if rows else False
+
+    def rrs(self, fqdn, rr_type, value=None):
+        """the RRs named fqdn of rr_type (A, TXTRecord, ...), and of value if given"""
+        sql = "SELECT data FROM rrs WHERE absolute_name = ? AND type = ?"
+        args = [fqdn.strip(".").lower(), rr_type]
+        if value is not None:
+            sql += " AND value = ?"
+            args.append(value)
+        return [json.loads(row[0]) for row in self.query(sql, args)]
+
+    def rr_id(self, fqdn, rr_type, value=None):
+        rrs = self.rrs(fqdn, rr_type, value)
+        return rrs[0]["id"] if rrs else False
+
+    def network_id(self, cidr):
+        """the id of the network cidr, or False"""
+        cidr = str(ipaddress.ip_network(cidr, strict=False))
+        rows = self.query("SELECT id FROM networks WHERE range = ?", (cidr,))
+        return rows[0][0] if rows else False
+
+    def network_of(self, addr):
+        """(CIDR, id) of the network holding addr, or None"""
+        num = int(ipaddress.ip_address(addr))
+        rows = self.query(
+            "SELECT range, id, end FROM networks WHERE start <= ? ORDER BY start DESC LIMIT 1", (num,)
+        )
+        if not rows or rows[0][2] < num:
+            return None
+        return (rows[0][0], rows[0][1])
+
+
+"""
+Open (loading if need be) the mirror of the View in db and have the
+v2api lookups answer from it, syncing when older than max_age seconds
+(None to leave syncing to the caller). Returns the Mirror.
+"""
+
+
+def attach(db=None, max_age=60):
+    mirror = Mirror(db)
+    mirror.refresh()
+    v2api.View_mirror = mirror
+    v2api.Mirror_max_age = max_age
+    return mirror
+
+
+def detach():
+    if v2api.View_mirror is not None:
+        v2api.View_mirror.close()
+    v2api.View_mirror = None
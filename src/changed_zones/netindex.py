@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Index of the IPv4 networks in a Block
+
+Networks in a Block never overlap, so they are kept as integer
+[start, end] ranges sorted by start. Finding the network containing an
+address is a bisect on the starts plus one comparison, for networks of
+any prefix length. Exact CIDR and ID lookups are plain dicts.
+"""
+
+import bisect
+import ipaddress
+
+
+class NetworkIndex:
+    def __init__(self, networks=None):
+        self.starts = []
+        self.ranges = []
+        self.by_cidr = dict()
+        self.by_id = dict()
+        for net in networks or []:
+            self.add(net["range"], net["id"])
+
+    def __len__(self):
+        return len(self.by_cidr)
+
+    def add(self, cidr, netid):
+        net = ipaddress.ip_network(cidr, strict=False)
+        cidr = str(net)
+        if cidr in self.by_cidr:
+            self.remove(cidr)
+        start = int(net.network_address)
+        end = int(net.broadcast_address)
+        idx = bisect.bisect_left(self.starts, start)
+        self.starts.insert(idx, start)
+        self.ranges.insert(idx, (start, end, cidr, netid))
+        self.by_cidr[cidr] = netid
+        self.by_id[netid] = cidr
+
+    def remove(self, cidr):
+        net = ipaddress.ip_network(cidr, strict=False)
+        cidr = str(net)
+        netid = self.by_cidr.pop(cidr, None)
+        if netid is None:
+            return False
+        self.by_id.pop(netid, None)
+        start = bisect.bisect_left(self.starts, int(net.network_address))
+        for idx in range(start, len(self.starts)):
+            if self.ranges[idx][2] == cidr:
+                del self.starts[idx]
+                del self.ranges[idx]
+                break
+        return True
+
+    def remove_id(self, netid):
+        cidr = self.by_id.get(netid)
+        if cidr is None:
+            return False
+        return self.remove(cidr)
+
+    def id(self, cidr):
+        """ID of the network with exactly this CIDR, or False"""
+        return self.by_cidr.get(str(ipaddress.ip_network(cidr, strict=False)), False)
+
+    def containing(self, addr):
+        """(cidr, id) of the network holding the address addr, or None"""
+        num = int(ipaddress.ip_address(addr))
+        idx = bisect.bisect_right(self.starts, num) - 1
+        if idx >= 0:
+            (start, end, cidr, netid) = self.ranges[idx]
+            if num <= end:
+                return (cidr, netid)
+        return None
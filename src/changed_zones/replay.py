@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+"""
+Record and replay the BAM responses the change poller depends on
+
+A Recorder is installed as v2api.Transport against a live BAM and
+keeps every transaction and operation list it sees. save() writes
+them to a fixture directory:
+
+    transactions.json   list of transactions, in id order
+    operations.json     {transaction id: [operations]}
+    zones.json          {absoluteName: zone id}
+
+A Replayer serves such a fixture (or a synthetic one from synthesize)
+back through v2api._request, answering the /transactions queries
+(id:gt, creationDateTime:ge/le, offset, limit, embed(operations)) the
+way BAM does, after sleeping for a simulated round trip.
+"""
+
+import csv
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from collections import Counter
+from requests import exceptions
+
+from changed_zones import export, v2api
+
+Transactions_file = "transactions.json"
+Operations_file = "operations.json"
+Zones_file = "zones.json"
+
+Ops_path = re.compile(r"^/transactions/(\d+)/operations$")
+Gt_filter = re.compile(r"id:gt\((\d+)\)")
+Ge_filter = re.compile(r"creationDateTime:ge\('([^']*)'\)")
+Le_filter = re.compile(r"creationDateTime:le\('([^']*)'\)")
+
+Version = "9.5.3-replay"
+
+
+class Response:
+    """just enough of requests.Response for v2api"""
+
+    def __init__(self, method, path, status_code=200, data=None, headers=None, text=None):
+        self.status_code = status_code
+        self.headers = headers or dict()
+        self.ok = status_code < 400
+        self.url = path
+        self.text = json.dumps(data) if text is None else text
+        self.content = self.text.encode()
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise exceptions.HTTPError(f"{self.status_code} for {self.url}", response=self)
+
+
+class Recorder:
+    """
+    v2api.Transport that passes requests on to Sess (or the session
+    login hands it) and keeps a copy of the transactions, operations
+    and zones in the responses, JSON or text/csv
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.transactions = dict()
+        self.operations = dict()
+        self.zones = dict()
+        self.lock = threading.Lock()
+
+    def __call__(self, method, path, params=None, json=None, accept=None, session=None, stream=False):
+        url = f"{v2api.Scheme}://{v2api.Base}/api/v2{path}"
+        headers = {"Accept": accept} if accept is not None else None
+        resp = (session or v2api.Sess).request(
+            method, url, params=params, json=json, headers=headers, stream=stream, timeout=(5, 10)
+        )
+        if stream:
+            # read the body here to keep it, and hand it on to be read again off .raw
+            resp.raw = io.BytesIO(resp.content)
+        if method == "GET" and resp.ok and accept is None:
+            self.keep(path, resp.json())
+        elif method == "GET" and resp.ok and accept == export.Media_type:
+            self.keep(path, {"data": [export.typed(row) for row in csv.DictReader(io.StringIO(resp.text))]})
+        return resp
+
+    def keep(self, path, data):
+        with self.lock:
+            if path == "/transactions":
+                for act in data["data"]:
+                    act = dict(act)
+                    embedded = act.pop("_embedded", None) or {}
+                    if "operations" in embedded:
+                        self.operations[act["id"]] = embedded["operations"]
+                    self.transactions[act["id"]] = act
+            elif match := Ops_path.match(path):
+                self.operations[int(match.group(1))] = data["data"]
+            elif path == "/zones":
+                for zone in data["data"]:
+                    if "absoluteName" in zone:
+                        self.zones[zone["absoluteName"]] = zone["id"]
+
+    def save(self):
+        transactions = [self.transactions[tid] for tid in sorted(self.transactions)]
+        save_fixture(self.directory, transactions, self.operations, self.zones)
+
+
+def save_fixture(directory, transactions, operations, zones):
+    os.makedirs(directory, exist_ok=True)
+    for name, data in (
+        (Transactions_file, transactions),
+        (Operations_file, {str(tid): ops for tid, ops in operations.items()}),
+        (Zones_file, zones),
+    ):
+        with open(os.path.join(directory, name), "w") as fd:
+            json.dump(data, fd)
+
+
+def load_fixture(directory):
+    with open(os.path.join(directory, Transactions_file)) as fd:
+        transactions = json.load(fd)
+    with open(os.path.join(directory, Operations_file)) as fd:
+        operations = {int(tid): ops for tid, ops in json.load(fd).items()}
+    zones = dict()
+    zones_path = os.path.join(directory, Zones_file)
+    if os.path.exists(zones_path):
+        with open(zones_path) as fd:
+            zones = json.load(fd)
+    return (transactions, operations, zones)
+
+
+"""
+Build a fixture of count transactions with ops_per operations each,
+spread over zones leaf zones laid out like the Azure private link
+ones: NNN.privatelink.openai.azure.com
+"""
+
+
+def synthesize(count, ops_per=1, zones=100, user="replay", first_id=1):
+    parent = "privatelink.openai.azure.com"
+    leaves = [f"{num:03d}.{parent}" for num in range(zones)]
+    zone_ids = {zone: 1000 + idx for idx, zone in enumerate([parent] + leaves)}
+    transactions = []
+    operations = dict()
+    rr_id = 500000
+    start = 1735689600  # 2025-01-01T00:00:00Z
+    for idx in range(count):
+        tid = first_id + idx
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + idx))
+        transactions.append(
+            {
+                "comment": None,
+                "creationDateTime": stamp,
+                "description": "Generic Record was added",
+                "id": tid,
+                "operation": "ADD_GENERIC_RECORD",
+                "transactionType": "ADD",
+                "type": "Transaction",
+                "user": {"id": 1, "name": user, "type": "User"},
+            }
+        )
+        ops = []
+        for num in range(ops_per):
+            rr_id += 1
+            hname = f"q{tid}-{num}"
+            zone = leaves[(idx + num) % zones]
+            ops.append(
+                {
+                    "fieldUpdates": [
+                        {"name": "name", "previousValue": None, "value": hname},
+                        {"name": "comments", "previousValue": None, "value": None},
+                        {"name": "recordType", "previousValue": None, "value": "A"},
+                        {"name": "rdata", "previousValue": None, "value": f"10.141.{idx % 256}.{num % 256}"},
+                        {"name": "ttl", "previousValue": None, "value": 3600},
+                        {"name": "absoluteName", "previousValue": None, "value": f"{hname}.{zone}"},
+                        {"name": "dynamic", "previousValue": None, "value": "No"},
+                    ],
+                    "operationType": "ADD",
+                    "resourceId": rr_id,
+                    "resourceType": "GenericRecord",
+                }
+            )
+        operations[tid] = ops
+    return (transactions, operations, zone_ids)
+
+
+class Replayer:
+    """
+    v2api.Transport serving a fixture. Every call sleeps latency
+    seconds plus up to jitter more. With embed False the server
+    refuses fields=embed(operations) like an older BAM would.
+    calls counts requests per method and path template.
+    """
+
+    def __init__(self, transactions, operations, zones=None, latency=0.0, jitter=0.0, embed=True):
+        self.transactions = sorted(transactions, key=lambda act: act["id"])
+        self.operations = operations
+        self.zones = zones or dict()
+        self.latency = latency
+        self.jitter = jitter
+        self.embed = embed
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, method, path, params=None, json=None, accept=None, session=None, stream=False):
+        resp = self.answer(method, path, params or dict())
+        if accept == "text/csv" and resp.ok:
+            return Response(method, path, text=to_csv(resp.json()["data"]))
+        return resp
+
+    def answer(self, method, path, params):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if match := Ops_path.match(path):
+            self.count(method, "/transactions/{id}/operations")
+            ops = self.operations.get(int(match.group(1)), [])
+            return Response(method, path, data={"count": len(ops), "data": ops})
+        self.count(method, path)
+        if method == "GET" and path == "/transactions":
+            return self.get_transactions(method, path, params)
+        if method == "GET" and path == "/zones":
+            data = [{"absoluteName": name, "id": zid} for name, zid in self.zones.items()]
+            return self.page(method, path, data, params)
+        if method == "GET" and path == "/settings":
+            data = [{"id": 1, "type": "SystemSettings", "hostname": "replay", "version": Version}]
+            return Response(method, path, data={"count": 1, "data": data})
+        return Response(method, path, status_code=404, data={"message": f"{path} is not replayed"})
+
+    def count(self, method, template):
+        with self.lock:
+            self.calls[f"{method} {template}"] += 1
+
+    def get_transactions(self, method, path, params):
+        fields = params.get("fields", "")
+        if "embed(operations)" in fields and not self.embed:
+            return Response(method, path, status_code=400, data={"message": "embed is not supported"})
+        filt = params.get("filter", "")
+        acts = self.transactions
+        if match := Gt_filter.search(filt):
+            since = int(match.group(1))
+            acts = [act for act in acts if act["id"] > since]
+        if match := Ge_filter.search(filt):
+            acts = [act for act in acts if act["creationDateTime"] >= match.group(1)]
+        if match := Le_filter.search(filt):
+            acts = [act for act in acts if act["creationDateTime"] <= match.group(1)]
+        if params.get("orderBy") == "desc(id)":
+            acts = acts[::-1]
+        if "embed(operations)" in fields:
+            acts = [
+                dict(act, _embedded={"operations": self.operations.get(act["id"], [])})
+                for act in acts
+            ]
+        return self.page(method, path, acts, params)
+
+    def page(self, method, path, data, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 1000))
+        chunk = data[offset:offset + limit]
+        return Response(method, path, data={"count": len(chunk), "data": chunk})
+
+
+def to_csv(items):
+    """items as BAM would send them as text/csv, nested objects as JSON"""
+    columns = list()
+    for item in items:
+        columns.extend(key for key in item if key not in columns)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    for item in items:
+        writer.writerow(
+            {key: json.dumps(val) if isinstance(val, (dict, list, bool)) else val for key, val in item.items()}
+        )
+    return out.getvalue()
+
+
+def install(transport):
+    """route v2api._request through transport, returning the one it replaces"""
+    previous = v2api.Transport
+    v2api.Transport = transport
+    return previous
+
+
+def replay(directory, latency=0.0, jitter=0.0, embed=True):
+    """serve the fixture in directory through v2api without a live BAM"""
+    (transactions, operations, zones) = load_fixture(directory)
+    replayer = Replayer(transactions, operations, zones, latency, jitter, embed)
+    install(replayer)
+    return replayer
@@ -0,0 +1,794 @@
+#!/usr/bin/env python
+
+"""
+A local stand-in for the BAM v2 REST API
+
+Model keeps Configurations, Views, zones, RRs, blocks, networks and the
+transactions their changes leave in memory. StandIn serves it over
+plain HTTP with the endpoints v2api uses:
+
+    POST   /sessions
+    GET    /settings
+    GET    /configurations[/{id}], /configurations/{id}/views|blocks
+    GET    /views[/{id}], /views/{id}/zones, /zones/{id}/zones (+ POST)
+    GET    /zones[/{id}] (+ DELETE), /zones/{id}/resourceRecords (+ POST)
+    GET    /resourceRecords[/{id}] (+ PUT, DELETE), /resourceRecords/{id}/addresses
+    GET    /blocks[/{id}], /blocks/{id}/networks (+ POST), /networks/{id} (+ DELETE)
+    GET    /transactions, /transactions/{id}/operations
+
+Listings take filter (eq, ne, gt, ge, lt, le, in, contains, startsWith
+and endsWith joined by and / or), fields with embed(operations) or
+embed(addresses), orderBy, offset and limit, and answer text/csv when
+asked. Every write is logged as a transaction with its operations,
+so the poller and Invalidator see them as they would in BAM.
+
+Each reply is held back latency seconds plus up to jitter more, and
+per_item seconds for every item listed. A share error_rate of requests
+is answered 503 and throttle_rate 429 with a Retry-After, before
+anything is done, and script() queues exact statuses for the next
+requests, for tests. Tokens expire after token_ttl seconds. seed() fills
+a Model with a View of any number of records. To point v2api at it:
+
+    BAM_SCHEME=http BAM_ENDPOINT=localhost:8080 changed_zones serve ...
+
+or in process:
+
+    server = StandIn(seed(Model(), records=100000), latency=0.02)
+    server.start()
+    standin.connect(server)
+"""
+
+import base64
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from changed_zones import v2api
+from changed_zones.replay import to_csv
+
+Version = "9.5.3-standin"
+Prefix = "/api/v2"
+Page_size = 1000
+Time_format = "%Y-%m-%dT%H:%M:%SZ"
+
+# the collection each type of object is listed in
+Collections = {
+    "Configuration": "configurations",
+    "View": "views",
+    "Zone": "zones",
+    "ExternalHostsZone": "zones",
+    "IPv4Block": "blocks",
+    "IPv4Network": "networks",
+}
+Listed = ("configurations", "views", "zones", "resourceRecords", "blocks", "networks")
+Record_types = (
+    "GenericRecord",
+    "HostRecord",
+    "AliasRecord",
+    "TXTRecord",
+    "MXRecord",
+    "HINFORecord",
+    "ExternalHostRecord",
+)
+# fields set by the server that clients can not change
+Fixed_fields = ("id", "type", "absoluteName", "configuration", "view", "zone", "_links")
+
+Past = {"ADD": "added", "UPDATE": "updated", "DELETE": "deleted"}
+
+Object_path = re.compile(r"^/(\w+)/(\d+)$")
+Child_path = re.compile(r"^/(\w+)/(\d+)/(\w+)$")
+Filter_token = re.compile(
+    r"\s*(?:(\()|(\))|(and|or)\b|([\w.]+):(\w+)\(((?:'[^']*'|[^)'])*)\))"
+)
+Filter_arg = re.compile(r"\s*(?:'([^']*)'|([^,\s]+))\s*(?:,|$)")
+Embed_field = re.compile(r"embed\((\w+)\)")
+Order = re.compile(r"^(asc|desc)\(([\w.]+)\)$")
+
+
+class Error(Exception):
+    """a request BAM would refuse, with its status code"""
+
+    def __init__(self, status, message, code=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code or {400: "InvalidRequest", 404: "ObjectNotFound", 409: "DuplicateObject"}.get(
+            status, "Error"
+        )
+
+
+def stamp(when=None):
+    return (when or datetime.now(timezone.utc)).strftime(Time_format)
+
+
+def ref(obj):
+    """the short form of obj nested in other objects"""
+    short = {"id": obj["id"], "type": obj["type"]}
+    for key in ("name", "absoluteName"):
+        if obj.get(key) is not None:
+            short[key] = obj[key]
+    return short
+
+
+def upper_snake(name):
+    """HostRecord as HOST_RECORD, TXTRecord as TXT_RECORD and IPv4Network as IPV4_NETWORK"""
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z]{2})", "_", name).upper()
+
+
+def logged(key, val):
+    """a field as the transaction feed gives it, a linked RR by its name"""
+    if key == "linkedRecord" and isinstance(val, dict):
+        return val.get("absoluteName")
+    return val
+
+
+"""
+Filters
+
+compile_filter turns a BAM filter expression into a predicate on
+objects. Fields may be dotted (view.id, user.name) and values quoted
+strings, numbers, true, false or null.
+"""
+
+
+def compile_filter(text):
+    tokens = list()
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = Filter_token.match(text, pos)
+        if match is None or match.end() == pos:
+            raise Error(400, f"Invalid filter near: {text[pos:pos + 30]}")
+        tokens.append(match.groups())
+        pos = match.end()
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    (test, rest) = _or_expr(tokens)
+    if rest:
+        raise Error(400, f"Invalid filter: {text}")
+    return test
+
+
+def _or_expr(tokens):
+    (test, tokens) = _and_expr(tokens)
+    while tokens and tokens[0][2] == "or":
+        (other, tokens) = _and_expr(tokens[1:])
+        test = (lambda one, two: lambda obj: one(obj) or two(obj))(test, other)
+    return (test, tokens)
+
+
+def _and_expr(tokens):
+    (test, tokens) = _atom(tokens)
+    while tokens and tokens[0][2] == "and":
+        (other, tokens) = _atom(tokens[1:])
+        test = (lambda one, two: lambda obj: one(obj) and two(obj))(test, other)
+    return (test, tokens)
+
+
+def _atom(tokens):
+    if not tokens:
+        raise Error(400, "Invalid filter: ends early")
+    (opening, _, _, field, op, args) = tokens[0]
+    if opening:
+        (test, rest) = _or_expr(tokens[1:])
+        if not rest or not rest[0][1]:
+            raise Error(400, "Invalid filter: unbalanced parentheses")
+        return (test, rest[1:])
+    if field is None:
+        raise Error(400, "Invalid filter")
+    return (_clause(field, op, _args(args)), tokens[1:])
+
+
+def _args(text):
+    args = list()
+    for quoted, bare in Filter_arg.findall(text):
+        if quoted or not bare:
+            args.append(quoted)
+        elif bare in ("true", "false"):
+            args.append(bare == "true")
+        elif bare == "null":
+            args.append(None)
+        else:
+            try:
+                args.append(int(bare))
+            except ValueError:
+                args.append(bare)
+    return args
+
+
+def field_value(obj, field):
+    for part in field.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(part)
+    return obj
+
+
+def _clause(field, op, args):
+    want = args[0] if args else None
+
+    def ordered(compare):
+        def test(val):
+            try:
+                return val is not None and compare(val, want)
+            except TypeError:
+                return False
+
+        return test
+
+    tests = {
+        "eq": lambda val: val == want,
+        "ne": lambda val: val != want,
+        "gt": ordered(lambda val, want: val > want),
+        "ge": ordered(lambda val, want: val >= want),
+        "lt": ordered(lambda val, want: val < want),
+        "le": ordered(lambda val, want: val <= want),
+        "in": lambda val: val in args,
+        "contains": lambda val: val is not None and str(want) in str(val),
+        "startsWith": lambda val: val is not None and str(val).startswith(str(want)),
+        "endsWith": lambda val: val is not None and str(val).endswith(str(want)),
+    }
+    if op not in tests:
+        raise Error(400, f"Unsupported filter operation: {op}")
+    test = tests[op]
+    return lambda obj: test(field_value(obj, field))
+
+
+class Model:
+    """
+    Every object by id and by collection, the children of each object
+    by collection, and the transaction log. Callers hold lock.
+    """
+
+    def __init__(self, user="standin"):
+        self.lock = threading.RLock()
+        self.next_id = 100000
+        self.objects = dict()
+        self.collections = dict()
+        self.children = dict()
+        self.parent = dict()
+        # {absoluteName: {id: RR}} for the duplicate checks of record()
+        self.names = dict()
+        self.transactions = list()
+        self.operations = dict()
+        self.user = {"id": 1, "type": "User", "name": user}
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def get(self, oid, collection=None):
+        obj = self.objects.get(oid)
+        if obj is None or (collection and self.collection_of(obj) != collection):
+            raise Error(404, f"{collection or 'Object'} {oid} was not found")
+        return obj
+
+    @staticmethod
+    def collection_of(obj):
+        if obj["type"] in Record_types:
+            return "resourceRecords"
+        return Collections.get(obj["type"], "objects")
+
+    def add(self, obj, parent=None, log=True):
+        obj["id"] = self.new_id()
+        collection = self.collection_of(obj)
+        self.objects[obj["id"]] = obj
+        self.collections.setdefault(collection, dict())[obj["id"]] = obj
+        if parent is not None:
+            self.children.setdefault((parent["id"], collection), dict())[obj["id"]] = obj
+            self.parent[obj["id"]] = (parent["id"], collection)
+        if collection == "resourceRecords":
+            self.names.setdefault(obj["absoluteName"], dict())[obj["id"]] = obj
+        if log:
+            self.log("ADD", obj, {key: (None, val) for key, val in self.loggable(obj).items()})
+        return obj
+
+    def update(self, obj, fields, log=True):
+        changes = dict()
+        for key, val in fields.items():
+            if key == "linkedRecord" and val:
+                val = ref(self.get(val.get("id"), "resourceRecords"))
+            if key in Fixed_fields or key.startswith("_") or obj.get(key) == val:
+                continue
+            changes[key] = (logged(key, obj.get(key)), logged(key, val))
+            obj[key] = val
+        if "name" in changes and "zone" in obj and obj["type"] != "ExternalHostRecord":
+            zone = self.get(obj["zone"]["id"])
+            absolute = f"{obj['name']}.{zone['absoluteName']}" if obj["name"] else zone["absoluteName"]
+            self.names.get(obj["absoluteName"], dict()).pop(obj["id"], None)
+            changes["absoluteName"] = (obj["absoluteName"], absolute)
+            obj["absoluteName"] = absolute
+            self.names.setdefault(absolute, dict())[obj["id"]] = obj
+        if log and changes:
+            self.log("UPDATE", obj, changes)
+        return obj
+
+    def delete(self, obj, log=True):
+        for (pid, collection) in [key for key in self.children if key[0] == obj["id"]]:
+            for child in list(self.children[(pid, collection)].values()):
+                self.delete(child, log)
+            del self.children[(pid, collection)]
+        self.objects.pop(obj["id"], None)
+        self.collections[self.collection_of(obj)].pop(obj["id"], None)
+        owner = self.parent.pop(obj["id"], None)
+        if owner is not None:
+            self.children.get(owner, dict()).pop(obj["id"], None)
+        self.names.get(obj.get("absoluteName"), dict()).pop(obj["id"], None)
+        if log:
+            self.log("DELETE", obj, {key: (val, None) for key, val in self.loggable(obj).items()})
+
+    def listing(self, collection, parent=None):
+        if parent is None:
+            return list(self.collections.get(collection, dict()).values())
+        return list(self.children.get((parent["id"], collection), dict()).values())
+
+    @staticmethod
+    def loggable(obj):
+        return {
+            key: logged(key, val)
+            for key, val in obj.items()
+            if key not in ("id", "type", "configuration", "view", "zone")
+            and (key == "linkedRecord" or not isinstance(val, dict))
+        }
+
+    def log(self, kind, obj, changes):
+        tid = len(self.transactions) + 1
+        what = upper_snake(obj["type"])
+        self.transactions.append(
+            {
+                "id": tid,
+                "type": "Transaction",
+                "creationDateTime": stamp(),
+                "description": f"{obj['type']} was {Past[kind]}",
+                "operation": f"{kind}_{what}",
+                "transactionType": kind,
+                "comment": None,
+                "user": self.user,
+            }
+        )
+        self.operations[tid] = [
+            {
+                "type": "Operation",
+                "operationType": kind,
+                "resourceId": obj["id"],
+                "resourceType": obj["type"],
+                "fieldUpdates": [
+                    {"name": name, "previousValue": old, "value": new}
+                    for name, (old, new) in changes.items()
+                ],
+            }
+        ]
+
+    """
+    Creating the objects themselves, with the fields BAM fills in
+    """
+
+    def configuration(self, name, log=True):
+        return self.add({"type": "Configuration", "name": name}, log=log)
+
+    def view(self, conf, name, log=True):
+        return self.add({"type": "View", "name": name, "configuration": ref(conf)}, conf, log)
+
+    def zone(self, parent, name, kind="Zone", log=True):
+        view = parent if parent["type"] == "View" else self.get(parent["view"]["id"])
+        absolute = name if parent["type"] == "View" else f"{name}.{parent['absoluteName']}"
+        for zone in self.listing("zones", parent):
+            if zone.get("absoluteName") == absolute or (kind != "Zone" and zone["type"] == kind):
+                raise Error(409, f"Zone {absolute} already exists")
+        obj = {
+            "type": kind,
+            "name": name,
+            "absoluteName": absolute if kind == "Zone" else None,
+            "deployable": True,
+            "configuration": view["configuration"],
+            "view": ref(view),
+        }
+        return self.add(obj, parent, log)
+
+    def zone_path(self, view, absolute, log=True):
+        """the zone absolute of view, created along with any missing parents"""
+        parent = view
+        for label in reversed(absolute.strip(".").lower().split(".")):
+            here = label if parent is view else f"{label}.{parent['absoluteName']}"
+            found = [zone for zone in self.listing("zones", parent) if zone.get("absoluteName") == here]
+            parent = found[0] if found else self.zone(parent, label, log=log)
+        return parent
+
+    def record(self, zone, fields, log=True):
+        kind = fields.get("type")
+        if kind not in Record_types:
+            raise Error(400, f"Unsupported resource record type: {kind}")
+        name = (fields.get("name") or "").lower()
+        if kind == "ExternalHostRecord":
+            absolute = name
+        else:
+            absolute = f"{name}.{zone['absoluteName']}" if name else zone["absoluteName"]
+        obj = {key: val for key, val in fields.items() if key not in Fixed_fields}
+        obj.update(
+            {
+                "type": kind,
+                "name": name,
+                "absoluteName": absolute,
+                "ttl": fields.get("ttl"),
+                "comment": fields.get("comment"),
+                "configuration": zone["configuration"],
+                "zone": ref(zone),
+            }
+        )
+        if kind == "HostRecord":
+            obj["addresses"] = [
+                {"id": self.new_id(), "type": "IPv4Address", "address": addr["address"]}
+                for addr in fields.get("addresses") or []
+            ]
+        if "linkedRecord" in fields:
+            obj["linkedRecord"] = ref(self.get((fields["linkedRecord"] or {}).get("id"), "resourceRecords"))
+        for other in self.names.get(absolute, dict()).values():
+            if (other["type"] == "AliasRecord") != (kind == "AliasRecord"):
+                raise Error(409, f"{absolute} can not have a CNAME and other records")
+            if other["type"] == kind and _value(other) == _value(obj):
+                raise Error(409, f"Duplicate {kind} {absolute}")
+        return self.add(obj, zone, log)
+
+
+def _value(rr):
+    if rr["type"] == "HostRecord":
+        return [addr["address"] for addr in rr.get("addresses") or []]
+    if "linkedRecord" in rr:
+        return rr["linkedRecord"]["id"]
+    return (rr.get("recordType"), rr.get("rdata"), rr.get("text"))
+
+
+"""
+Fill model with a Configuration conf holding View view, an external
+hosts zone, a 10.0.0.0/8 block, and records RRs spread over zones
+zones under parent: seven in ten A GenericRecords, then TXTRecords,
+HostRecords (with their /24 networks) and AliasRecords to one of
+a hundred external hosts. With history the records are logged as
+transactions too.
+"""
+
+
+def seed(model, records=100000, zones=100, conf=None, view=None, parent="privatelink.example.com", history=False):
+    with model.lock:
+        conf_obj = model.configuration(conf or v2api.Conf or "Test", log=False)
+        view_obj = model.view(conf_obj, view or v2api.View or "Default", log=False)
+        ex_zone = model.zone(view_obj, "ExternalHosts", kind="ExternalHostsZone", log=False)
+        block = model.add(
+            {"type": "IPv4Block", "name": "standin", "range": "10.0.0.0/8", "configuration": ref(conf_obj)},
+            conf_obj,
+            log=False,
+        )
+        top = model.zone_path(view_obj, parent, log=False)
+        leaves = [model.zone(top, f"{num:03d}", log=history) for num in range(zones)]
+        ex_hosts = [
+            model.record(ex_zone, {"type": "ExternalHostRecord", "name": f"svc{num}.example.net"}, log=False)
+            for num in range(min(100, records))
+        ]
+        networks = set()
+        for idx in range(records):
+            zone = leaves[idx // 10 % zones]
+            name = f"r{idx}"
+            address = f"10.{idx >> 16 & 255}.{idx >> 8 & 255}.{idx & 255}"
+            kind = idx % 10
+            if kind < 7:
+                fields = {"type": "GenericRecord", "recordType": "A", "rdata": address}
+            elif kind == 7:
+                fields = {"type": "TXTRecord", "text": f"standin record {idx}"}
+            elif kind == 8:
+                fields = {"type": "HostRecord", "addresses": [{"address": address}]}
+                cidr = address.rsplit(".", 1)[0] + ".0/24"
+                if cidr not in networks:
+                    networks.add(cidr)
+                    model.add({"type": "IPv4Network", "name": None, "range": cidr}, block, log=False)
+            else:
+                host = ex_hosts[idx % len(ex_hosts)]
+                fields = {"type": "AliasRecord", "linkedRecord": {"id": host["id"]}}
+            fields.update(name=name, ttl=3600, comment=None)
+            model.record(zone, fields, log=history)
+    return model
+
+
+class StandIn:
+    def __init__(
+        self,
+        model,
+        latency=0.0,
+        jitter=0.0,
+        per_item=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        token_ttl=3600,
+        embed=True,
+    ):
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.per_item = per_item
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.token_ttl = token_ttl
+        # False to refuse every embed(...) like an older BAM
+        self.embed = embed
+        self.tokens = dict()
+        self.scripted = deque()
+        self.httpd = None
+
+    def script(self, *statuses):
+        """answer the next len(statuses) requests with these statuses in order, None as usual"""
+        with self.model.lock:
+            self.scripted.extend(statuses)
+
+    """
+    Answer one request as (status, headers, body bytes). Everything
+    except the simulated round trip happens under the model lock.
+    """
+
+    def handle(self, method, path, params, body, headers):
+        items = 0
+        roll = random.random()
+        with self.model.lock:
+            forced = self.scripted.popleft() if self.scripted else None
+        if forced is not None:
+            (status, data) = (forced, _error(forced, HTTPStatus(forced).phrase, None))
+        elif roll < self.error_rate:
+            (status, data) = (503, _error(503, "Service Unavailable", "ServiceUnavailable"))
+        elif roll < self.error_rate + self.throttle_rate:
+            (status, data) = (429, _error(429, "Too Many Requests", "TooManyRequests"))
+        elif path != "/sessions" and not self.authorized(headers.get("Authorization")):
+            (status, data) = (401, _error(401, "Authentication is required", "Unauthorized"))
+        else:
+            try:
+                with self.model.lock:
+                    (status, data) = self.route(method, path, params, body)
+            except Error as err:
+                (status, data) = (err.status, _error(err.status, str(err), err.code))
+            if isinstance(data, dict) and "data" in data:
+                items = len(data["data"])
+        delay = self.latency + random.uniform(0, self.jitter) + self.per_item * items
+        if delay:
+            time.sleep(delay)
+        reply_headers = {}
+        if status == 429:
+            reply_headers["Retry-After"] = str(self.retry_after)
+        if data is None:
+            return (status, reply_headers, b"")
+        if "text/csv" in (headers.get("Accept") or "") and status == 200 and "data" in data:
+            reply_headers["Content-Type"] = "text/csv"
+            return (status, reply_headers, to_csv(data["data"]).encode())
+        reply_headers["Content-Type"] = "application/hal+json"
+        return (status, reply_headers, json.dumps(data).encode())
+
+    def authorized(self, header):
+        if not header or not header.startswith("Basic "):
+            return False
+        expires = self.tokens.get(header[len("Basic "):])
+        return expires is not None and expires > time.time()
+
+    def session(self, body):
+        user = (body or {}).get("username") or "standin"
+        token = secrets.token_hex(16)
+        credentials = base64.b64encode(f"{user}:{token}".encode()).decode()
+        self.tokens[credentials] = time.time() + self.token_ttl
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.token_ttl)
+        return {
+            "type": "UserSession",
+            "apiToken": token,
+            "apiTokenExpirationDateTime": stamp(expires),
+            "basicAuthenticationCredentials": credentials,
+        }
+
+    def route(self, method, path, params, body):
+        model = self.model
+        if not self.embed and Embed_field.search(params.get("fields") or ""):
+            raise Error(400, f"Unsupported field(s): {params['fields']}")
+        if path == "/sessions" and method == "POST":
+            return (201, self.session(body))
+        if path == "/settings" and method == "GET":
+            data = [{"id": 1, "type": "SystemSettings", "hostname": "standin", "version": Version}]
+            return (200, listing(data, params))
+        if path == "/transactions" and method == "GET":
+            acts = model.transactions
+            if "embed(operations)" in params.get("fields", ""):
+                acts = [
+                    dict(act, _embedded={"operations": model.operations.get(act["id"], [])})
+                    for act in acts
+                ]
+            return (200, listing(acts, params, embeds=("operations",)))
+        if match := Child_path.match(path):
+            (collection, oid, children) = (match.group(1), int(match.group(2)), match.group(3))
+            if collection == "transactions" and children == "operations":
+                if oid > len(model.transactions) or oid < 1:
+                    raise Error(404, f"Transaction {oid} was not found")
+                return (200, listing(model.operations.get(oid, []), params))
+            owner = model.get(oid, collection)
+            if children == "addresses" and owner["type"] == "HostRecord":
+                return (200, listing(owner.get("addresses") or [], params))
+            if method == "GET":
+                return (200, listing(model.listing(children, owner), params, embeds=("addresses",)))
+            if method == "POST":
+                return (201, self.create(owner, children, body or {}))
+        elif match := Object_path.match(path):
+            obj = model.get(int(match.group(2)), match.group(1))
+            if method == "GET":
+                return (200, project(obj, params.get("fields")))
+            if method == "PUT":
+                return (200, model.update(obj, body or {}))
+            if method == "DELETE":
+                model.delete(obj)
+                return (204, None)
+        elif method == "GET" and path[1:] in Listed:
+            return (200, listing(model.listing(path[1:]), params, embeds=("addresses",)))
+        raise Error(404, f"{method} {path} is not served here")
+
+    def create(self, owner, children, body):
+        model = self.model
+        if children == "zones" and owner["type"] == "View" and body.get("absoluteName"):
+            absolute = body["absoluteName"].strip(".").lower()
+            for zone in model.listing("zones"):
+                if zone.get("absoluteName") == absolute and zone["view"]["id"] == owner["id"]:
+                    raise Error(409, f"Zone {absolute} already exists")
+            return model.zone_path(owner, absolute)
+        if children == "zones":
+            name = body.get("name") or body.get("absoluteName")
+            if not name:
+                raise Error(400, "A zone needs a name")
+            return model.zone(owner, name.lower(), body.get("type") or "Zone")
+        if children == "resourceRecords" and owner["type"] in ("Zone", "ExternalHostsZone"):
+            return model.record(owner, body)
+        if children == "networks" and owner["type"] == "IPv4Block":
+            rng = body.get("range")
+            if any(net["range"] == rng for net in model.listing("networks", owner)):
+                raise Error(409, f"Network {rng} already exists")
+            return model.add({"type": "IPv4Network", "name": body.get("name"), "range": rng}, owner)
+        if children == "blocks" and owner["type"] == "Configuration":
+            obj = {"type": "IPv4Block", "name": body.get("name"), "range": body.get("range")}
+            return model.add(dict(obj, configuration=ref(owner)), owner)
+        raise Error(400, f"Can not create {children} in a {owner['type']}")
+
+    """
+    Serving over HTTP
+    """
+
+    def serve(self, host="localhost", port=8080):
+        """a ThreadingHTTPServer for self on host and port (0 for any free one)"""
+        handler = type("Handler", (Handler,), {"standin": self})
+        self.httpd = Server((host, port), handler)
+        return self.httpd
+
+    def start(self, host="localhost", port=0):
+        """serve from a background thread, returning host:port"""
+        httpd = self.serve(host, port)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return self.address
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    @property
+    def address(self):
+        (host, port) = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+
+def _error(status, message, code):
+    code = code or HTTPStatus(status).phrase.title().replace(" ", "")
+    return {"status": status, "reason": code, "code": code, "message": message}
+
+
+def project(obj, fields=None):
+    """obj as BAM would show it for fields=..., or whole with its _links"""
+    if not fields:
+        out = dict(obj)
+        out["_links"] = {"self": {"href": f"{Prefix}/{Model.collection_of(obj)}/{obj['id']}"}}
+        return out
+    names = [name.strip().split(".")[0] for name in Embed_field.sub("", fields).split(",")]
+    return {name: obj[name] for name in names if name in obj}
+
+
+def listing(items, params, embeds=()):
+    """one page of items, filtered, ordered and projected as params say"""
+    fields = params.get("fields") or ""
+    for embed in Embed_field.findall(fields):
+        if embed not in embeds:
+            raise Error(400, f"embed({embed}) is not supported here")
+    if params.get("filter"):
+        test = compile_filter(params["filter"])
+        items = [item for item in items if test(item)]
+    order = Order.match(params.get("orderBy") or "asc(id)")
+    if order is None:
+        raise Error(400, f"Invalid orderBy: {params['orderBy']}")
+    key = order.group(2)
+    # listings are kept in id order already
+    if key != "id":
+        items = sorted(items, key=lambda item: (field_value(item, key) is None, field_value(item, key) or 0))
+    if order.group(1) == "desc":
+        items = items[::-1]
+    try:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", Page_size))
+    except ValueError:
+        raise Error(400, "offset and limit must be numbers")
+    page = list()
+    for item in items[offset:offset + limit]:
+        out = project(item, fields) if "id" in item else dict(item)
+        if "addresses" in Embed_field.findall(fields) and item.get("type") == "HostRecord":
+            out["_embedded"] = {"addresses": item.get("addresses") or []}
+        elif "_embedded" in item:
+            out["_embedded"] = item["_embedded"]
+        page.append(out)
+    return {"count": len(page), "data": page}
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """clients dropping the connection mid reply are no news"""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = f"BAM-standin/{Version}"
+    # headers and body go out in separate writes
+    disable_nagle_algorithm = True
+    standin = None
+
+    def log_message(self, format, *args):
+        if v2api.Debug:
+            super().log_message(format, *args)
+
+    def answer(self):
+        url = urlsplit(self.path)
+        path = url.path[len(Prefix):] if url.path.startswith(Prefix) else url.path
+        params = dict(parse_qsl(url.query))
+        size = int(self.headers.get("Content-Length") or 0)
+        body = None
+        if size:
+            try:
+                body = json.loads(self.rfile.read(size))
+            except ValueError:
+                body = None
+        (status, headers, data) = self.standin.handle(self.command, path.rstrip("/"), params, body, self.headers)
+        self.send_response(status)
+        for name, val in headers.items():
+            self.send_header(name, val)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = answer
+
+
+"""
+Point v2api at server for this process and log in: its Base, an http
+Scheme, and the Configuration and View seed() made
+"""
+
+
+def connect(server, conf=None, view=None):
+    with server.model.lock:
+        confs = server.model.listing("configurations")
+        views = server.model.listing("views")
+    v2api.Scheme = "http"
+    v2api.Base = server.address
+    v2api.Conf = conf or confs[0]["name"]
+    v2api.View = view or views[0]["name"]
+    v2api.Session_cache = False
+    v2api.Zone_cache_ttl = 0
+    v2api.basic_auth()
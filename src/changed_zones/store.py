@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""
+Writer for the SQLite change store (see new_schema.sql)
+
+One connection is kept open for the whole run. Rows are queued and
+written with executemany, and a commit is issued once per batch
+rather than once per row. Each commit also moves the last_act_id
+watermark up to the last transaction whose operations it holds, so a
+run that dies part way resumes after what it wrote, and operations
+are keyed by (act_id, op_id) so none is stored twice.
+"""
+
+import sqlite3
+import time
+
+from contextlib import closing
+
+DB = "bc_dns_delta.db"
+
+# rows to queue before writing them out; 0 means once per run
+Batch_size = 500
+
+# the tables of new_schema.sql, created when missing so that a new
+# database file works without loading the schema by hand
+Schema = """
+CREATE TABLE IF NOT EXISTS transactions (
+    trans_id INTEGER PRIMARY KEY,
+    act_id INTEGER UNIQUE,
+    trans_dt TEXT,
+    trans_cmt TEXT,
+    trans_desc TEXT,
+    trans_op TEXT,
+    trans_type TEXT,
+    trans_user TEXT
+);
+CREATE TABLE IF NOT EXISTS last_change (
+    run_id INTEGER PRIMARY KEY,
+    last_change_isodate TEXT,
+    last_change_unixtime INTEGER,
+    last_act_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS log (
+    log_id INTEGER PRIMARY KEY,
+    log_isodate TEXT NOT NULL,
+    log_unixtime INTEGER,
+    log_transaction_ids TEXT,
+    log_changed_zones TEXT
+);
+CREATE TABLE IF NOT EXISTS operations (
+    ops_id INTEGER PRIMARY KEY,
+    act_id INTEGER,
+    op_id INTEGER,
+    rr_id INTEGER,
+    op_type TEXT,
+    bc_type TEXT,
+    rr_comment TEXT,
+    rr_hname TEXT,
+    rr_fqdn TEXT,
+    rr_type TEXT,
+    rr_value TEXT,
+    rr_ttl INTEGER,
+    zone TEXT
+);
+"""
+
+Transaction_sql = """
+    INSERT OR IGNORE INTO transactions (act_id, trans_dt, trans_desc, trans_op, trans_user)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+Operation_sql = """
+    INSERT OR IGNORE INTO operations
+    (act_id,op_id,rr_id,op_type,bc_type,rr_comment,rr_hname,rr_fqdn,rr_type,rr_value,rr_ttl,zone)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+Last_change_sql = """
+    INSERT into last_change (run_id, last_change_isodate, last_change_unixtime, last_act_id) VALUES (?, ?, ?, ?)
+    ON CONFLICT(run_id) DO UPDATE SET last_change_isodate = excluded.last_change_isodate, last_change_unixtime = excluded.last_change_unixtime,
+    last_act_id = excluded.last_act_id;
+"""
+
+Watermark_sql = """
+    INSERT into last_change (run_id, last_act_id) VALUES (?, ?)
+    ON CONFLICT(run_id) DO UPDATE SET last_act_id = excluded.last_act_id;
+"""
+
+Indexes = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS operations_act_op ON operations (act_id, op_id)",
+    "CREATE INDEX IF NOT EXISTS operations_zone_act ON operations (zone, act_id)",
+    "CREATE INDEX IF NOT EXISTS operations_fqdn ON operations (rr_fqdn)",
+    "CREATE INDEX IF NOT EXISTS transactions_dt ON transactions (trans_dt)",
+]
+
+Report_sql = """
+    SELECT o.act_id, t.trans_dt, t.trans_user, o.op_type, o.rr_type, o.rr_fqdn, o.rr_value, o.zone
+    FROM operations o JOIN transactions t ON t.act_id = o.act_id
+"""
+
+Log_sql = """
+    INSERT into log (log_isodate,log_unixtime,log_transaction_ids,log_changed_zones) VALUES (?,?,?,?);
+"""
+
+
+class ChangeStore:
+    """
+    Batched writer for the transactions, operations, log
+    and last_change tables.
+
+    synchronous is the SQLite PRAGMA value; with WAL journaling
+    NORMAL only syncs at checkpoints and is still crash safe.
+    db_time adds up the seconds spent writing.
+    """
+
+    def __init__(self, db=DB, batch_size=Batch_size, synchronous="NORMAL"):
+        self.batch_size = batch_size
+        self.con = sqlite3.connect(db)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute(f"PRAGMA synchronous={synchronous}")
+        self.transactions = []
+        self.operations = []
+        # the last transaction whose rows are all queued, written with them
+        self.act_id = None
+        self.db_time = 0.0
+        self.migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        self.con.close()
+
+    def columns(self, table):
+        return [row[1] for row in self.con.execute(f"PRAGMA table_info({table})")]
+
+    def migrate(self):
+        """bring a database created from an older new_schema.sql up to date"""
+        with self.con:
+            self.con.executescript(Schema)
+        with self.con:
+            if "last_act_id" not in self.columns("last_change"):
+                self.con.execute("ALTER TABLE last_change ADD COLUMN last_act_id INTEGER")
+            if "zone" not in self.columns("operations"):
+                self.con.execute("ALTER TABLE operations ADD COLUMN zone TEXT")
+            if "op_id" not in self.columns("operations"):
+                # rows from before are left NULL, which the unique index lets be
+                self.con.execute("ALTER TABLE operations ADD COLUMN op_id INTEGER")
+            for sql in Indexes:
+                self.con.execute(sql)
+
+    def backfill_zones(self, resolve):
+        """
+        fill in the zone of operations recorded before the column existed,
+        resolve maps an rr_fqdn to its zone. Returns the number of names resolved.
+        """
+        self.flush()
+        sql = "SELECT DISTINCT rr_fqdn FROM operations WHERE zone IS NULL AND rr_fqdn IS NOT NULL"
+        fqdns = [row[0] for row in self.con.execute(sql)]
+        with self.con:
+            self.con.executemany(
+                "UPDATE operations SET zone = ? WHERE zone IS NULL AND rr_fqdn = ?",
+                [(resolve(fqdn), fqdn) for fqdn in fqdns],
+            )
+        return len(fqdns)
+
+    def report(self, zone=None, since=None, user=None):
+        """
+        operations joined with their transactions in act_id order,
+        optionally limited to a zone, a start time (ISO 8601) and a user
+        """
+        clauses = []
+        args = []
+        if zone is not None:
+            clauses.append("o.zone = ?")
+            args.append(zone.strip(".").lower())
+        if since is not None:
+            clauses.append("t.trans_dt >= ?")
+            args.append(since)
+        if user is not None:
+            clauses.append("t.trans_user = ?")
+            args.append(user)
+        sql = Report_sql
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY o.act_id"
+        return self.con.execute(sql, args).fetchall()
+
+    def add_transaction(self, row):
+        self.transactions.append(row)
+
+    def add_operations(self, rows, act_id=None):
+        """queue rows, the operations of transaction act_id, which is then complete"""
+        self.operations.extend(rows)
+        if act_id is not None:
+            self.act_id = act_id
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if self.batch_size and len(self.transactions) >= self.batch_size:
+            self.flush()
+
+    def flush(self, idx=1):
+        """write out all queued rows and the watermark in a single transaction"""
+        if not (self.transactions or self.operations or self.act_id is not None):
+            return
+        start = time.perf_counter()
+        with self.con:
+            self.con.executemany(Transaction_sql, self.transactions)
+            self.con.executemany(Operation_sql, self.operations)
+            if self.act_id is not None:
+                self.con.execute(Watermark_sql, (idx, self.act_id))
+        self.db_time += time.perf_counter() - start
+        self.transactions = []
+        self.operations = []
+        self.act_id = None
+
+    def discard(self):
+        """drop queued rows that have not been written yet"""
+        self.transactions = []
+        self.operations = []
+        self.act_id = None
+
+    def update_last_change(self, isodate, unixtime, act_id, idx=1):
+        self.flush()
+        start = time.perf_counter()
+        with self.con:
+            self.con.execute(Last_change_sql, (idx, isodate, unixtime, act_id))
+        self.db_time += time.perf_counter() - start
+
+    def update_log(self, isodate, unixtime, tids, zones):
+        self.flush()
+        start = time.perf_counter()
+        with self.con:
+            self.con.execute(Log_sql, (isodate, unixtime, tids, zones))
+        self.db_time += time.perf_counter() - start
+
+    def fetch_last_change(self, idx=1):
+        with closing(self.con.cursor()) as cur:
+            sql = "SELECT last_change_isodate, last_act_id from last_change WHERE run_id = ?"
+            row = cur.execute(sql, (idx,)).fetchone()
+        return row
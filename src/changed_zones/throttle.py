@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Client side limits on the requests sent to BAM
+
+TokenBucket spaces requests out to at most rate per second with room
+for bursts of burst requests. When BAM answers 429 the rate is halved,
+then crept back up to the configured one as requests succeed again.
+CircuitBreaker fails requests fast once BAM has failed threshold
+times in a row. After cooldown seconds it lets one trial request
+through, and that request decides whether to close it again. A reply
+that says nothing either way (429, 401) releases the trial instead, so
+the next request becomes the trial.
+Both are safe to share between threads.
+"""
+
+import threading
+import time
+
+# the slowest a TokenBucket backs off to, as a fraction of its rate
+Floor = 0.05
+
+
+class TokenBucket:
+    def __init__(self, rate=0, burst=None):
+        self.lock = threading.Lock()
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        """allow rate requests per second, 0 for no limit"""
+        with self.lock:
+            self.ceiling = rate
+            self.rate = rate
+            self.burst = burst or max(1, rate)
+            self.tokens = self.burst
+            self.stamp = time.monotonic()
+
+    def take(self):
+        """wait until one more request may be sent, returning the seconds waited"""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def slow_down(self):
+        with self.lock:
+            if self.ceiling:
+                self.rate = max(self.ceiling * Floor, self.rate / 2)
+
+    def speed_up(self):
+        with self.lock:
+            if self.rate < self.ceiling:
+                self.rate = min(self.ceiling, self.rate + self.ceiling * Floor)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """False while the circuit is open and no trial request is due"""
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.monotonic() - self.opened < self.cooldown:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def release(self):
+        """give up a trial without a verdict, leaving the circuit as it is"""
+        with self.lock:
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.threshold and self.failures >= self.threshold:
+                self.opened = time.monotonic()
+
+    @property
+    def open(self):
+        return self.opened is not None
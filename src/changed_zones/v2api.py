@@ -1,15 +1,33 @@
 #!/usr/bin/env python
 
+import atexit
+import csv
 import getopt
+import ipaddress
+import json
 import os
 import sys
 
+import random
 import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from requests import Session, exceptions
+from requests.adapters import HTTPAdapter
 
 from dotenv import load_dotenv
 from pprint import pprint
 
+from changed_zones import cache
+from changed_zones.catalogue import ZoneCatalogue, normal
+from changed_zones.metrics import Metrics
+from changed_zones.netindex import NetworkIndex
+from changed_zones.throttle import CircuitBreaker, TokenBucket
+
 
 """
 Library to use the BAM v2 API, which commenced with BAM v9.5
@@ -70,6 +88,8 @@ elif Target == 'Prod':
     Conf = os.environ.get("BAM_CONF_AZ")
     View = os.environ.get("BAM_VIEW_AZ")
 Ca_bundle = os.environ.get("BAM_CERT")
+# http only for a local stand-in (see standin.py)
+Scheme = os.environ.get("BAM_SCHEME", "https")
 
 
 Dot = "."
@@ -81,7 +101,46 @@ BlockID = 0
 
 Comment = "Modifications by v2API"
 
-ViewZones = dict()
+Token = None
+Token_expires = None
+# reuse a saved session between invocations (see resume_session)
+Session_cache = True
+# seconds before its expiry a saved token is no longer reused
+Session_margin = 60
+# upper bound on the age of a saved session whatever its token expiry
+Session_cache_ttl = 86400
+# held while Sess and Token are replaced, and by relogin around login
+Auth_lock = threading.RLock()
+
+# every zone of the View, filled in by basic_auth (see load_zone_catalogue)
+ViewZones = ZoneCatalogue()
+# seconds a saved copy of the zone catalogue is trusted, 0 to always refetch
+Zone_cache_ttl = 3600
+# set when zones are created or deleted so the saved copy is rewritten at exit
+Zones_changed = False
+
+# {external host name: id} of the ExternalHostsZone, loaded on first use
+ExHosts = None
+# seconds a saved copy of ExHosts is trusted, 0 to keep it in memory only
+ExHost_cache_ttl = 0
+ExHosts_changed = False
+
+# NetworkIndex of the IPv4 networks under BlockID, loaded on first use
+Networks = None
+
+# With Zone_rrs_cache set, get_zone_rrs keeps what it fetched in
+# ZoneRRs as {zone id: {params: RRs}} until a write through this module
+# or an Invalidator says the zone changed. RR_zone maps the id of every
+# RR seen that way to the ID of its zone.
+Zone_rrs_cache = False
+ZoneRRs = dict()
+RR_zone = dict()
+
+# a mirror.Mirror of the View the is_* lookups answer from when set
+# (see mirror.attach). It is synced first when older than Mirror_max_age
+# seconds, or with None only once writes here have made it stale.
+View_mirror = None
+Mirror_max_age = 60
 
 RR_Types = [
     "AliasRecord",
@@ -114,6 +173,71 @@ Network_Types = [
 
 TTL = 3600
 
+# connections kept open per host so that worker threads sharing Sess
+# are not forced to open a fresh TLS connection for every request
+Pool_size = 32
+
+# items asked for per request when paginate walks a collection
+Page_size = 1000
+
+# Times _request tries again after a timeout, a failed connection or a
+# Retry_statuses reply. Only Idempotent methods are retried, apart from
+# 429, which BAM answers before doing anything. The waits double from
+# Backoff up to Backoff_max seconds with full jitter, unless the reply
+# says how long to wait in Retry-After.
+Retries = 4
+Backoff = 0.5
+Backoff_max = 30
+Retry_statuses = (429, 502, 503, 504)
+Idempotent = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+# shared by every thread: the rate limit (off until set_rate_limit) and
+# the breaker that stops sending after repeated timeouts or 5xx replies
+Bucket = TokenBucket()
+Breaker = CircuitBreaker(threshold=5, cooldown=30)
+
+# when set, _request calls Transport(method, path, params=, json=) in
+# place of Sess.request, e.g. to record or replay responses (see replay.py).
+# Requests for a media type other than JSON also pass accept=, streamed
+# ones stream=True, and login passes the session= it logs in on in
+# place of Sess.
+Transport = None
+
+Transaction_fields = "comment,creationDateTime,description,id,operation,transactionType,type,user"
+# cleared once the server refuses fields=embed(operations) with a 400
+# (see embed_refused); failures that may pass leave it set
+Embed_operations = True
+# the same for fields=embed(addresses)
+Embed_addresses = True
+# what a 400 refusing a projection says
+Refused_embed = re.compile(r"embed|field", re.IGNORECASE)
+# lookups in flight when host record addresses are fetched one by one
+Address_concurrency = 8
+
+# Lean payloads: listings that do not name their fields ask for the
+# projection of their kind in Fields, which BAM also answers without
+# the HAL _links blocks, and _request drops any _links left in a reply.
+# Listings of RRs that are PUT back whole still fetch full objects.
+Lean = True
+Fields = {
+    "Block": "id,type,name,range",
+    "Network": "id,type,name,range",
+    "View": "id,type,name",
+    "Zone": "id,type,name,absoluteName",
+    "RR": "id,type,name,absoluteName,ttl,recordType,rdata,text,linkedRecord,addresses",
+    "GenericRecord": "id,type,name,absoluteName,ttl,recordType,rdata",
+    "AliasRecord": "id,type,name,absoluteName,ttl,linkedRecord",
+    "HostRecord": "id,type,name,absoluteName,ttl,addresses",
+    "TXTRecord": "id,type,name,absoluteName,ttl,text",
+}
+# every attempt _request makes, by method and path template. The table
+# is printed at exit with --debug or when Stats_report is set, and
+# written in the Prometheus text format to Stats_file if there is one
+Stats = Metrics()
+Stats_report = False
+Stats_file = None
+Path_ids = re.compile(r"/\d+")
+
 
 Db = "bc_dns_delta.db"
 Changed_zones = list()
@@ -155,17 +279,51 @@ Response:
 """
 
 
-def basic_auth():
-    global Sess, Header_Printed
+def basic_auth(refresh_zones=False):
     global ConfID, ViewID, ExHostZoneID, BlockID
-    global Auth_header, Header, ViewZones
 
     if Debug:
         print(f"basic_auth: {Base} {Conf} {View}")
 
-    mime_type = "application/json"
-    Sess = Session()
-    Sess.headers.update({"Content-Type": mime_type})
+    if resume_session():
+        load_zone_catalogue(refresh=refresh_zones)
+        if Debug:
+            print(f"basic_auth: resumed session, ConfID: {ConfID}, ViewID: {ViewID} BlockID: {BlockID}")
+        return
+    login()
+    ConfID = get_conf_id(Conf)
+    ViewID = get_view_id(View, ConfID)
+    ExHostZoneID = get_exhost_zone_id(ViewID)
+    blocks = get_ipv4_blocks(ConfID)
+    if len(blocks):
+        BlockID = blocks[0]["id"]
+    else:
+        BlockID = create_block(ConfID, CIDRBlock)
+    save_session()
+    load_zone_catalogue(refresh=refresh_zones)
+    if Debug:
+        print(f"basic_auth: ConfID: {ConfID}, ViewID: {ViewID} BlockID: {BlockID}")
+        print(f"basic_auth: {len(ViewZones)} zones in the catalogue")
+
+
+"""
+Open a new API session and (re)build Sess around its credentials.
+Used on its own to replace an expired session in long running
+processes without repeating the discovery done by basic_auth.
+The POST goes out on a session of its own, so Sess is only ever
+swapped for one that is already logged in and other threads never
+send through a half built one. Raises LoginError if BAM does not
+hand out a token.
+"""
+
+
+class LoginError(exceptions.RequestException):
+    pass
+
+
+def login():
+    global Token, Token_expires
+
     resp = _request(
         "POST",
         "/sessions",
@@ -173,30 +331,116 @@ def basic_auth():
             "username": Uname,
             "password": Pw,
         },
+        reauth=False,
+        session=_new_session(),
     )
+    if resp is None:
+        raise LoginError(f"login: {Uname} could not log in to {Base}")
     data = resp.json()
     if Debug:
-        print("basic_auth: response:")
+        print("login: response:")
         pprint(data)
-    token = data["basicAuthenticationCredentials"]
-    Header_Printed = False
+    with Auth_lock:
+        Token = data["basicAuthenticationCredentials"]
+        Token_expires = data["apiTokenExpirationDateTime"]
+        _use_session(_new_session(Token))
+    return data
 
-    Sess.headers.update({"Authorization": f"Basic {token}"})
-    Sess.headers.update({"Accept": mime_type})
-    Sess.headers.update({"User-Agent": "Generic BC Integrity API v2 Python Library"})
-    Sess.headers.update({"x-bcn-change-control-comment": f"{Comment}"})
-    Sess.verify = Ca_bundle
 
-    ConfID = get_conf_id(Conf)
-    ViewID = get_view_id(View, ConfID)
-    ExHostZoneID = get_exhost_zone_id(ViewID)
-    blocks = get_ipv4_blocks(ConfID)
-    if len(blocks):
-        BlockID = blocks[0]["id"]
-    else:
-        BlockID = create_block(ConfID, CIDRBlock)
-    if Debug:
-        print(f"basic_auth: ConfID: {ConfID}, ViewID: {ViewID} BlockID: {BlockID}")
+def _new_session(token=None):
+    """a Session, carrying the credentials token if given"""
+    mime_type = "application/json"
+    sess = Session()
+    sess.mount(f"{Scheme}://", HTTPAdapter(pool_connections=1, pool_maxsize=Pool_size))
+    sess.headers.update({"Content-Type": mime_type})
+    sess.verify = Ca_bundle
+    if token is None:
+        return sess
+
+    sess.headers.update({"Authorization": f"Basic {token}"})
+    sess.headers.update({"Accept": mime_type})
+    sess.headers.update({"User-Agent": "Generic BC Integrity API v2 Python Library"})
+    sess.headers.update({"x-bcn-change-control-comment": f"{Comment}"})
+    return sess
+
+
+def _use_session(sess):
+    global Sess, Header_Printed
+
+    with Auth_lock:
+        Sess = sess
+        Header_Printed = False
+
+
+"""
+Session reuse across invocations
+
+The API token, its expiry and the IDs found by basic_auth are saved
+(readable by the owner only, see cache.py) under the endpoint, user,
+configuration and view. basic_auth picks them up again until the
+token is within Session_margin seconds of expiring, and _request logs
+in again by itself if BAM answers 401 to a reused token.
+"""
+
+
+def _session_key():
+    return f"{Base}-{Uname}-{Conf}-{View}"
+
+
+def save_session():
+    if not Session_cache:
+        return
+    cache.save(
+        "session",
+        _session_key(),
+        {
+            "token": Token,
+            "expires": Token_expires,
+            "ConfID": ConfID,
+            "ViewID": ViewID,
+            "ExHostZoneID": ExHostZoneID,
+            "BlockID": BlockID,
+        },
+    )
+
+
+def resume_session():
+    global Token, Token_expires, ConfID, ViewID, ExHostZoneID, BlockID
+
+    if not Session_cache:
+        return False
+    saved = cache.load("session", _session_key(), Session_cache_ttl)
+    if saved is None:
+        return False
+    expires = datetime.strptime(saved["expires"], "%Y-%m-%dT%H:%M:%SZ")
+    expires = expires.replace(tzinfo=timezone.utc)
+    if expires - timedelta(seconds=Session_margin) <= datetime.now(timezone.utc):
+        return False
+    Token = saved["token"]
+    Token_expires = saved["expires"]
+    ConfID = saved["ConfID"]
+    ViewID = saved["ViewID"]
+    ExHostZoneID = saved["ExHostZoneID"]
+    BlockID = saved["BlockID"]
+    _use_session(_new_session(Token))
+    return True
+
+
+"""
+Replace a session BAM no longer accepts. Only the first of several
+threads that saw the same token rejected logs in, the others just
+pick up the new one. Raises LoginError when logging in fails.
+"""
+
+
+def relogin(rejected=None):
+    with Auth_lock:
+        if rejected is not None and Sess.headers.get("Authorization") != rejected:
+            return
+        if Debug:
+            print("relogin: the session token was refused, logging in again")
+        login()
+        save_session()
 
 
 """
@@ -276,9 +520,7 @@ As is returns a list of configurations
 
 
 def get_confs():
-    resp = _request("GET", "/configurations", params={"fields": "name,id,type"})
-    data = resp.json()
-    return data["data"]
+    return list(paginate("/configurations", fields="name,id,type"))
 
 
 """
@@ -407,15 +649,9 @@ data is the list of Views
 
 
 def get_conf_views(cid):
-    resp = _request(
-        "GET",
-        path=f"/configurations/{cid}/views",
-        params={"fields": "name,id,type"},
-    )
-    data = resp.json()
+    views = list(paginate(f"/configurations/{cid}/views", fields="name,id,type"))
     if Debug:
         print("get_conf_views: data:")
-    views = data["data"]
     return views
 
 
@@ -525,9 +761,7 @@ With params: fields -> 'configuration,id,name,type'
 
 
 def get_views(params={}):
-    resp = _request("GET", "/views", params=params)
-    data = resp.json()
-    return data["data"]
+    return list(paginate("/views", project(params, "View")))
 
 
 """
@@ -684,9 +918,7 @@ long data form:
 
 
 def get_collection_blocks(cid, params={}):
-    resp = _request("GET", f"/configurations/{cid}/blocks", params=params)
-    data = resp.json()
-    return data["data"]
+    return list(paginate(f"/configurations/{cid}/blocks", project(params, "Block")))
 
 
 """
@@ -719,7 +951,7 @@ def get_all_transactions(iso_start, iso_stop):
         "GET",
         "/transactions",
         params={
-            "fields": "comment,creationDateTime,description,id,operation,transactionType,type,user",
+            "fields": Transaction_fields,
             "filter": f"(creationDateTime:ge('{iso_start}') and creationDateTime:le('{iso_stop}'))",
         },
     )
@@ -733,7 +965,25 @@ def get_all_transactions(iso_start, iso_stop):
 #        'filter': f"creationDateTime:ge('{iso_start}') and creationDateTime:le('{iso_stop}') and (description:contains('Generic') or description:contains('Alias'))",
 
 
-def get_rr_transactions(iso_start, iso_stop):
+def rr_transactions_filter(iso_start=None, iso_stop=None, since_id=None, everyone=False):
+    if since_id is not None:
+        window = f"id:gt({since_id})"
+    else:
+        window = f"creationDateTime:ge('{iso_start}') and creationDateTime:le('{iso_stop}')"
+    if everyone:
+        return window
+    # (description:contains('Generic') or description:contains('Alias'))",
+    return f"\
+        user.name:eq('{Uname}') and \
+        {window} and \
+        operation:in('ADD_GENERIC_RECORD', 'DELETE_GENERIC_RECORD', 'UPDATE_GENERIC_RECORD', \
+        'ADD_ALIAS_RECORD', 'DELETE_ALIAS_RECORD', 'UPDATE_ALIAS_RECORD') \
+        "
+
+
+def get_rr_transactions(
+    iso_start=None, iso_stop=None, embed_operations=False, since_id=None, everyone=False
+):
     """
     Transaction data structure:
         {
@@ -751,43 +1001,132 @@ def get_rr_transactions(iso_start, iso_stop):
          }
      Note that operation is an enumeration, whereas description,
      So operation can not use the contains operation
+
+     With embed_operations each transaction also carries its operations
+     under '_embedded'. Returns None if the server rejects the projection;
+     any other failure raises PageError.
+
+     With since_id only transactions with a higher id are returned,
+     otherwise those created between iso_start and iso_stop.
+     everyone drops the restriction to RR changes made by Uname.
     """
 
-    actions = []
-    limit = 1000
-    offset = 0
-    while True:
-        resp = _request(
-            "GET",
-            "/transactions",
-            # (description:contains('Generic') or description:contains('Alias'))",
-            params = {
-                "offset": offset,
-                "limit": limit,
-                "fields": "comment,creationDateTime,description,id,operation,transactionType,type,user",
-                "filter": f"\
-                    user.name:eq('{Uname}') and \
-                    creationDateTime:ge('{iso_start}') and \
-                    creationDateTime:le('{iso_stop}') and \
-                    operation:in('ADD_GENERIC_RECORD', 'DELETE_GENERIC_RECORD', 'UPDATE_GENERIC_RECORD', \
-                    'ADD_ALIAS_RECORD', 'DELETE_ALIAS_RECORD', 'UPDATE_ALIAS_RECORD') \
-                    ",
-            },
+    fields = Transaction_fields
+    if embed_operations:
+        fields = f"{fields},embed(operations)"
+    try:
+        actions = list(
+            paginate(
+                "/transactions",
+                params={"orderBy": "asc(id)"},
+                fields=fields,
+                filter=rr_transactions_filter(iso_start, iso_stop, since_id, everyone),
+            )
         )
-        data = resp.json()
-        cnt = data["count"]
-        if cnt > 0:
-            actions.extend(data["data"])
-        if cnt < limit:
-            break
-        else:
-            offset += limit
+    except PageError:
+        if embed_operations and embed_refused("/transactions", fields):
+            return None
+        raise
     if Debug:
         print("get_rr_transactions: all RR transactions:")
         pprint(actions)
     return actions
 
 
+"""
+Transactions together with their operations as a list of (transaction, operations)
+pairs in transaction id order.
+
+The operations are asked for in the same paginated stream via the
+embed(operations) projection, which saves one /operations call per
+transaction. Servers that refuse the projection, or transactions that
+come back without an embedded list, fall back to get_transactions_operations
+with up to concurrency lookups in flight.
+since_id selects transactions above that id rather than the time window,
+everyone every kind of change by any user rather than Uname's RR changes.
+"""
+
+
+def get_rr_transactions_with_operations(
+    iso_start=None, iso_stop=None, concurrency=8, since_id=None, everyone=False
+):
+    global Embed_operations
+
+    actions = None
+    if Embed_operations:
+        actions = get_rr_transactions(
+            iso_start, iso_stop, embed_operations=True, since_id=since_id, everyone=everyone
+        )
+        if actions is None:
+            if Debug:
+                print("get_rr_transactions_with_operations: embed(operations) refused")
+            Embed_operations = False
+    if actions is None:
+        actions = get_rr_transactions(iso_start, iso_stop, since_id=since_id, everyone=everyone)
+    actions.sort(key=lambda act: act["id"])
+    ops = [_embedded_operations(act) for act in actions]
+    missing = [idx for idx, op in enumerate(ops) if op is None]
+    if missing:
+        tids = [actions[idx]["id"] for idx in missing]
+        for idx, op in zip(missing, get_operations(tids, concurrency)):
+            ops[idx] = op
+    return list(zip(actions, ops))
+
+
+"""
+ID of the newest transaction in BAM, 0 when there are none or None
+if the feed can not be read
+"""
+
+
+def get_last_transaction_id():
+    resp = _request(
+        "GET",
+        "/transactions",
+        params={"fields": "id", "orderBy": "desc(id)", "limit": 1},
+    )
+    if resp is None:
+        return None
+    data = resp.json()["data"]
+    return data[0]["id"] if data else 0
+
+
+"""
+Whether BAM refuses the projection fields on path outright: a 400
+whose message names the embed or field. A timeout, 5xx, throttling or
+an open breaker says nothing about support and gives False, so callers
+keep embedding and pass the failure on instead.
+"""
+
+
+def embed_refused(path, fields):
+    if Breaker.open:
+        return False
+    url = f"{Scheme}://{Base}/api/v2{path}"
+    try:
+        resp = _send("GET", path, url, {"fields": fields, "limit": 1}, None, None, False)
+    except exceptions.RequestException:
+        return False
+    if resp.status_code != 400:
+        return False
+    return Refused_embed.search(getattr(resp, "text", "") or "") is not None
+
+
+def _embedded_operations(act):
+    return _embedded(act.pop("_embedded", None), "operations")
+
+
+def _embedded(embedded, name):
+    """the list embedded under name in a HAL _embedded object, or None"""
+    embedded = embedded or {}
+    if name in embedded:
+        items = embedded[name]
+        if isinstance(items, dict):
+            items = items.get("data", [])
+        return items
+    return None
+
+
 """
 
 {'_links': {'collection': {'href': '/api/v2/transactions/62991/operations'},
@@ -818,6 +1157,8 @@ def get_transactions_operations(tid):
         f"/transactions/{tid}/operations",
         params={"fields": "fieldUpdates,operationType,resourceType,resourceId"},
     )
+    if resp is None:
+        raise PageError(f"get_transactions_operations: GET /transactions/{tid}/operations failed")
     data = resp.json()
     ops = data["data"]
     if Debug:
@@ -826,6 +1167,20 @@ def get_transactions_operations(tid):
     return ops
 
 
+"""
+Operations for many transactions, returned in the order of tids
+while up to concurrency lookups are in flight at once. A lookup that
+fails raises PageError, as paginate does.
+"""
+
+
+def get_operations(tids, concurrency=8):
+    if concurrency <= 1:
+        return [get_transactions_operations(tid) for tid in tids]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(get_transactions_operations, tids))
+
+
 """
 Create a CIDR Block for a given Configuration and return its ID
 full data: {
@@ -895,14 +1250,8 @@ Get the main Block IDs associated with a Configuration
 
 
 def get_ipv4_blocks(cid):
-    resp = _request(
-        "GET",
-        path=f"/configurations/{cid}/blocks",
-        params={"fields": "id", "filter": "type:eq('IPv4Block')"},
-    )
-    data = resp.json()
-    blocks = data["data"]
-    return blocks
+    params = {"fields": "id", "filter": "type:eq('IPv4Block')"}
+    return get_collection_blocks(cid, params)
 
 
 def get_ipv4_block_id(cid):
@@ -926,13 +1275,7 @@ def delete_block(blkid):
 
 
 def get_collection_networks(cid, params={}):
-    resp = _request(
-        "GET",
-        f"/blocks/{cid}/networks",
-        params=params,
-    )
-    data = resp.json()
-    return data["data"]
+    return list(paginate(f"/blocks/{cid}/networks", project(params, "Network")))
 
 
 """
@@ -970,6 +1313,9 @@ def create_ipv4_network(blkid, cidr):
         },
     )
     data = resp.json()
+    if blkid == BlockID and Networks is not None:
+        Networks.add(cidr, data["id"])
+    mirror_stale()
     return data["id"]
 
 
@@ -980,6 +1326,12 @@ def delete_network_by_id(netid):
         "DELETE",
         f"/networks/{netid}",
     )
+    if resp is None or not resp.ok:
+        print(f"There was an error deleting network id: {netid}")
+        return False
+    if Networks is not None:
+        Networks.remove_id(netid)
+    mirror_stale()
     return resp.text
 
 
@@ -1007,11 +1359,49 @@ def add_ipv4_network(cidr):
 
 
 def is_ipv4_network(cidr):
-    nets = get_ipv4_networks(BlockID)
-    for net in nets:
-        if net["range"] == cidr:
-            return net["id"]
-    return False
+    if (mirror := _mirror()) is not None:
+        return mirror.network_id(cidr)
+    return get_network_index().id(cidr)
+
+
+"""
+The NetworkIndex of the IPv4 networks under BlockID. The network list
+is downloaded page by page on first use, or again with refresh, and is
+kept up to date by create_ipv4_network and delete_network_by_id.
+"""
+
+
+def get_network_index(refresh=False):
+    global Networks
+    if Networks is not None and not refresh:
+        return Networks
+    Networks = NetworkIndex(
+        paginate(
+            f"/blocks/{BlockID}/networks",
+            fields="range,id",
+            filter="type:eq('IPv4Network')",
+        )
+    )
+    if Debug:
+        print(f"get_network_index: {len(Networks)} networks in block {BlockID}")
+    return Networks
+
+
+def forget_networks():
+    global Networks
+    Networks = None
+
+
+"""
+The network of any size under BlockID holding the address addr
+as (cidr, id), or None
+"""
+
+
+def get_ipv4_network_of(addr):
+    if (mirror := _mirror()) is not None:
+        return mirror.network_of(addr)
+    return get_network_index().containing(addr)
 
 
 """
@@ -1022,13 +1412,7 @@ returns a list of them
 
 def get_addresses_by_hostname_id(hostid):
     addrs = list()
-    resp = _request(
-        "GET",
-        f"/resourceRecords/{hostid}/addresses",
-        params={"fields": "address"},
-    )
-    data = resp.json()
-    for add_dict in data["data"]:
+    for add_dict in paginate(f"/resourceRecords/{hostid}/addresses", fields="address"):
         addrs.append(add_dict["address"])
     return addrs
 
@@ -1107,12 +1491,10 @@ Zone from Zone list
 
 
 def get_zones(params={}):
-    resp = _request("GET", "/zones", params=params)
-    data = resp.json()
+    zones = list(paginate("/zones", project(params, "Zone")))
     if Debug:
-        if "totalCount" in data:
-            print(f'totalCount: {data["totalCount"]}')
-    return data["data"]
+        print(f"get_zones: {len(zones)} zones")
+    return zones
 
 
 """
@@ -1197,25 +1579,22 @@ def get_collection_zones(colid, params={}):
         collection = "views"
     else:
         collection = "zones"
-    resp = _request(
-        "GET",
-        f"/{collection}/{colid}/zones",
-        params=params,
-    )
-    data = resp.json()
+    zones = list(paginate(f"/{collection}/{colid}/zones", project(params, "Zone")))
     if Debug:
         print("get_collection_zones: data:")
-        pprint(data)
-    return data["data"]
+        pprint(zones)
+    return zones
 
 
 """
 Create a Zone from the root (View ID)
-towards the leaf end point
+towards the leaf end point. A zone BAM already has is looked up
+instead, so its ID is returned; False when neither works
 """
 
 
 def create_zone(zone):
+    global Zones_changed
     pzid = ViewID
     community = "views"
     resp = _request(
@@ -1227,49 +1606,105 @@ def create_zone(zone):
             "comment": Comment,
         },
     )
-    if resp.ok:
-        data = resp.json()
-        return data["id"]
+    if resp is not None and resp.ok:
+        zid = resp.json()["id"]
     else:
-        return False
+        # BAM may have it already, the catalogue being an older copy
+        zid = _view_zone_id(zone)
+    if zid:
+        ViewZones.add(zone, zid)
+        Zones_changed = True
+    return zid
 
 
 """
-Creates a Zone using recursion
-Checking first to see if it exists
-Needs to change at the root to use views rather than zones as the collection
+Creates a Zone together with any of its parents that are missing,
+returning its ID or False
 """
 
 
 def create_zone_recursively(zone):
-    global ViewZones
-    zid = is_zone(zone)
-    if zid:
-        return zid
+    return ensure_zones([zone]).get(normal(zone), False)
+
+
+"""
+Create zone name directly below the zone (or View) pzid and return its
+ID, or False
+"""
+
+
+def create_subzone(pzid, name):
+    if pzid == ViewID:
+        (collection, key) = ("views", "absoluteName")
     else:
-        (zname, subzone, subzid) = decouple(zone)
-        pzid = create_zone_recursively(subzone)
-        community = "zones"
-        resp = _request(
-            "POST",
-            f"/{community}/{pzid}/zones",
-            json={
-                "type": "Zone",
-                "name": zname,
-                "comment": Comment,
-            },
-        )
-        if resp.ok:
-            data = resp.json()
-            zid = data["id"]
-            if Debug:
-                print(f"new zone: {zone} with ID {zid} has been created")
-                pprint(data)
-            ViewZones[zone] = zid
-            return zid
-        else:
-            print(f"There was a problem creating subzone: {zone}")
-            return False
+        (collection, key) = ("zones", "name")
+    resp = _request(
+        "POST",
+        f"/{collection}/{pzid}/zones",
+        json={"type": "Zone", key: name, "comment": Comment},
+    )
+    if resp is not None and resp.ok:
+        return resp.json()["id"]
+    return False
+
+
+def _view_zone_id(zone):
+    """ID of the View's zone named zone according to BAM, or False"""
+    filt = f"absoluteName:eq('{zone}') and view.id:eq({ViewID}) and type:eq('Zone')"
+    resp = _request("GET", "/zones", params={"fields": "id", "filter": filt})
+    data = resp.json()["data"] if resp is not None else []
+    return data[0]["id"] if data else False
+
+
+"""
+Make sure every zone in fqdns exists, with all of its parents, and
+return {zone: ID or False}. The zones missing from ViewZones are worked
+out for all of fqdns at once and created a level at a time, TLDs first,
+with up to concurrency siblings in flight. Each zone joins ViewZones as
+soon as BAM confirms it. A zone that BAM already had (e.g. made by
+someone else since the catalogue was loaded) is looked up instead, and
+the zones below a parent that could not be made are not attempted.
+"""
+
+
+def ensure_zones(fqdns, concurrency=8):
+    global Zones_changed
+
+    if not len(ViewZones):
+        load_zone_catalogue()
+    wanted = [normal(fqdn) for fqdn in fqdns]
+    levels = dict()
+    for zone in wanted:
+        labels = zone.split(Dot)
+        for depth in range(1, len(labels) + 1):
+            name = Dot.join(labels[-depth:])
+            if name not in ViewZones:
+                levels.setdefault(depth, set()).add(name)
+
+    failed = set()
+
+    def create(zone):
+        (label, parent) = (zone.split(Dot, 1) + [""])[:2]
+        if not parent:
+            return (zone, create_subzone(ViewID, zone) or _view_zone_id(zone))
+        if parent in failed or parent not in ViewZones:
+            return (zone, False)
+        return (zone, create_subzone(ViewZones[parent], label) or _view_zone_id(zone))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for depth in sorted(levels):
+            futures = [pool.submit(create, zone) for zone in sorted(levels[depth])]
+            for future in as_completed(futures):
+                (zone, zid) = future.result()
+                if zid:
+                    ViewZones.add(zone, zid)
+                    Zones_changed = True
+                    if Debug:
+                        print(f"ensure_zones: new zone: {zone} with ID {zid} has been created")
+                else:
+                    print(f"There was a problem creating subzone: {zone}")
+                    failed.add(zone)
+    return {zone: ViewZones.id(zone) for zone in wanted}
 
 
 """
@@ -1280,22 +1715,22 @@ Deletes a Zone if it exists
 
 
 def delete_zone(zone):
-    global ViewZones
+    global Zones_changed
     zid = is_zone(zone)
     if zid:
         resp = _request(
             "DELETE",
             f"/zones/{zid}",
         )
-        if resp.status_code == 204:
+        if resp is not None and resp.status_code == 204:
             if Debug:
                 print(f"delete_zone: Zone: {zone} has been deleted")
-            del ViewZones[zone]
+            ViewZones.remove(zone)
+            forget_zone_rrs(zid)
+            Zones_changed = True
             return True
         else:
-            data = resp.json()
             print(f"delete_zone: There was a problem deleting Zone: {zone}")
-            pprint(data)
             return False
     else:
         print(f"delete_zone: Zone: {zone} does not exist")
@@ -1332,16 +1767,15 @@ Returns a list of ALL RRs under all Configurations
 """
 
 
-def get_rrs(cid=ConfID):
-    resp = _request(
-        "GET",
-        "/resourceRecords",
-        params={
-            "filter": f"configuration.id:eq({cid})",
-        },
-    )
-    rrs = resp.json()
-    return rrs
+def get_rrs(cid=None, params={}):
+    if cid is None:
+        cid = ConfID
+    return list(iter_rrs(cid, params))
+
+
+def iter_rrs(cid, params={}):
+    params = project(params, "RR")
+    return paginate("/resourceRecords", params, filter=f"configuration.id:eq({cid})")
 
 
 """
@@ -1351,14 +1785,52 @@ Get _all_ Resource Records for a specific zone iD
 """
 
 
-def get_zone_rrs(zid, params={}):
-    resp = _request(
-        "GET",
-        f"/zones/{zid}/resourceRecords",
-        params=params,
-    )
-    data = resp.json()
-    return data["data"]
+def get_zone_rrs(zid, params={}, full=False):
+    if not full:
+        params = project(params, "RR")
+    if not Zone_rrs_cache:
+        return list(iter_zone_rrs(zid, params))
+    key = tuple(sorted(params.items()))
+    cached = ZoneRRs.get(zid, dict())
+    if key not in cached:
+        rrs = list(iter_zone_rrs(zid, params))
+        for rr in rrs:
+            if "id" in rr:
+                RR_zone[rr["id"]] = zid
+        ZoneRRs.setdefault(zid, dict())[key] = rrs
+        return list(rrs)
+    return list(cached[key])
+
+
+def forget_zone_rrs(zid):
+    """drop the cached RR lists of zone zid"""
+    mirror_stale()
+    return ZoneRRs.pop(zid, None) is not None
+
+
+def mirror_stale():
+    """have View_mirror sync before it next answers"""
+    if View_mirror is not None:
+        View_mirror.stale = True
+
+
+def _mirror():
+    """View_mirror, synced as Mirror_max_age asks, or None"""
+    if View_mirror is None:
+        return None
+    View_mirror.refresh(Mirror_max_age)
+    return View_mirror
+
+
+"""
+The RRs of a zone one at a time as they arrive, for zones too big
+to hold in a list. get_zone_rrs asks for the Fields of an "RR" unless
+params name others, or full is set because the RRs will be PUT back.
+"""
+
+
+def iter_zone_rrs(zid, params={}):
+    return paginate(f"/zones/{zid}/resourceRecords", params)
 
 
 """
@@ -1369,11 +1841,13 @@ Get RRs for specific zone ID and BlueCat RR type
 def get_zone_rrs_by_type(zid, rr_type, params={}):
     if Debug:
         print(f"get_zone_rrs_by_type: RRs for ZoneID {zid} of type {rr_type}")
+    params = dict(params)
     if rr_type in RR_Types:
         params["filter"] = f"type:eq('{rr_type}')"
     elif rr_type in Generic_RR_Types:
         params["filter"] = f"type:eq('GenericRecord') and recordType:eq('{rr_type}')"
-    return get_zone_rrs(zid, params)
+        rr_type = "GenericRecord"
+    return get_zone_rrs(zid, project(params, rr_type))
 
 
 def get_zone_generic_rrs(zid):
@@ -1392,17 +1866,50 @@ def get_zone_cname_rrs(zid):
     return get_zone_rrs_by_type(zid, "AliasRecord")
 
 
+"""
+The HostRecords of a zone, each with the list of its addresses as
+ipaddr. The addresses come in the same pages as the records through
+the embed(addresses) projection. Servers that refuse it, or records
+that come back without them, fall back to get_addresses_by_hostname_id
+with up to Address_concurrency lookups in flight.
+"""
+
+
 def get_zone_hostname_rrs(zid):
+    global Embed_addresses
+
     hname_list = list()
     params = {
-        "fields": "absoluteName,id",
+        "fields": "absoluteName,name,id",
         "filter": "type:eq('HostRecord')",
     }
-    rrs = get_zone_rrs(zid, params=params)
+    rrs = None
+    if Embed_addresses:
+        embed = dict(params, fields=f'{params["fields"]},embed(addresses)')
+        try:
+            rrs = get_zone_rrs(zid, params=embed)
+        except PageError:
+            if not embed_refused(f"/zones/{zid}/resourceRecords", embed["fields"]):
+                raise
+            if Debug:
+                print("get_zone_hostname_rrs: embed(addresses) refused")
+            Embed_addresses = False
+    if rrs is None:
+        rrs = get_zone_rrs(zid, params=params)
+    missing = list()
     for rr in rrs:
-        addrs = get_addresses_by_hostname_id(rr["id"])
-        rr["ipaddr"] = addrs
+        addrs = _embedded(rr.get("_embedded"), "addresses")
+        rr = {key: val for key, val in rr.items() if key != "_embedded"}
+        if addrs is None:
+            missing.append(rr)
+        else:
+            rr["ipaddr"] = [addr["address"] for addr in addrs]
         hname_list.append(rr)
+    if missing:
+        with ThreadPoolExecutor(max_workers=Address_concurrency) as pool:
+            hostids = [rr["id"] for rr in missing]
+            for rr, addrs in zip(missing, pool.map(get_addresses_by_hostname_id, hostids)):
+                rr["ipaddr"] = addrs
     return hname_list
 
 
@@ -1417,12 +1924,16 @@ def get_all_A_rrs(zid):
 
 def get_hostname_addresses(fqdn):
     addrs = []
+    if (mirror := _mirror()) is not None:
+        for rr in mirror.rrs(fqdn, "HostRecord"):
+            addrs = [addr["address"] for addr in rr.get("addresses") or []]
+        return addrs
     (hname, zone, zid) = decouple(fqdn)
     if zid:
         rrs = get_zone_hostname_rrs(zid)
         for rr in rrs:
             if rr["name"] == hname:
-                addrs = get_addresses_by_hostname_id(rr["id"])
+                addrs = rr["ipaddr"]
     return addrs
 
 
@@ -1441,7 +1952,7 @@ def get_collection_rrs(cid, params={}):
 
 def get_conf_rrs(cid, params={}):
     rrs = list()
-    allrrs = get_rrs(params)
+    allrrs = get_rrs(cid, dict({"fields": "id,configuration"}, **params))
     for rr in allrrs:
         rr_conf_id = rr["configuration"]["id"]
         print(rr_conf_id)
@@ -1456,6 +1967,7 @@ External Host are needed to create Alias/CNAME records
 
 
 def create_ex_host(fqdn):
+    global ExHosts_changed
     exid = is_ex_host(fqdn)
     if exid:
         return exid
@@ -1470,6 +1982,9 @@ def create_ex_host(fqdn):
             },
         )
         data = resp.json()
+        forget_zone_rrs(ExHostZoneID)
+        get_ex_hosts()[fqdn] = data["id"]
+        ExHosts_changed = True
         return data["id"]
 
 
@@ -1477,15 +1992,49 @@ def create_ex_host(fqdn):
 
 returns a dictionary of externalhosts and their IDs
 
+The whole ExternalHostsZone is downloaded once, page by page, and kept
+in ExHosts (and on disk when ExHost_cache_ttl is set); create_ex_host
+adds to it. refresh forces a new download.
+
 """
 
 
-def get_ex_hosts():
-    exhosts = dict()
-    rrs = get_zone_rrs(ExHostZoneID)
-    for rr in rrs:
-        exhosts[rr["name"]] = rr["id"]
-    return exhosts
+def get_ex_hosts(refresh=False):
+    global ExHosts, ExHosts_changed
+    if ExHosts is not None and not refresh:
+        return ExHosts
+    key = f"{Base}-{ExHostZoneID}"
+    exhosts = None
+    if ExHost_cache_ttl and not refresh:
+        exhosts = cache.load("exhosts", key, ExHost_cache_ttl)
+    if exhosts is None:
+        exhosts = dict()
+        params = {"fields": "name,id", "filter": "type:eq('ExternalHostRecord')"}
+        for rr in iter_zone_rrs(ExHostZoneID, params):
+            exhosts[rr["name"]] = rr["id"]
+        if ExHost_cache_ttl:
+            cache.save("exhosts", key, exhosts)
+    ExHosts = exhosts
+    ExHosts_changed = False
+    return ExHosts
+
+
+def forget_ex_hosts():
+    """drop ExHosts and its copy on disk so that the next use downloads them again"""
+    global ExHosts, ExHosts_changed
+    ExHosts = None
+    ExHosts_changed = False
+    cache.clear("exhosts", f"{Base}-{ExHostZoneID}")
+    forget_zone_rrs(ExHostZoneID)
+
+
+@atexit.register
+def save_ex_hosts():
+    """write ExHosts back to disk if external hosts were created"""
+    global ExHosts_changed
+    if ExHosts_changed and ExHost_cache_ttl:
+        cache.save("exhosts", f"{Base}-{ExHostZoneID}", ExHosts)
+    ExHosts_changed = False
 
 
 """
@@ -1496,6 +2045,8 @@ If it does return its ID
 
 
 def is_ex_host(fqdn):
+    if (mirror := _mirror()) is not None:
+        return mirror.rr_id(fqdn, "ExternalHostRecord")
     hosts = get_ex_hosts()
     if fqdn in hosts:
         return hosts[fqdn]
@@ -1503,23 +2054,18 @@ def is_ex_host(fqdn):
         return False
 
 
-"""
-
-Creates RRs of all sorts
-based on their respective schemas
-
-"""
-
-
-def create_rr(fqdn, RR_type, value):
-    (name, zone, zid) = decouple(fqdn)
-    if not zid:
-        zid = create_zone(zone)  # this will create the zone if not already there
-
+def rr_payload(name, RR_type, value, ttl=TTL, prereqs=None):
+    """
+    The body of a POST creating RR name of type RR_type. The network of
+    a HostRecord address and the ExternalHostRecord of an AliasRecord or
+    MXRecord are created when missing, unless a prereqs set is given:
+    then they are only added to it as ("network", cidr) or
+    ("external host", fqdn).
+    """
     payload = {
         "name": name,
         "type": RR_type,
-        "ttl": TTL,
+        "ttl": ttl,
         "comment": Comment,
     }
 
@@ -1534,11 +2080,15 @@ def create_rr(fqdn, RR_type, value):
         payload["cpu"] = cpu
 
     elif RR_type == "HostRecord":
-        toks = value.split(Dot)
-        toks[3] = "0"
-        network = Dot.join(toks)
-        cidr = f"{network}/24"
-        add_ipv4_network(cidr)
+        if not get_ipv4_network_of(value):
+            toks = value.split(Dot)
+            toks[3] = "0"
+            network = Dot.join(toks)
+            cidr = f"{network}/24"
+            if prereqs is None:
+                add_ipv4_network(cidr)
+            else:
+                prereqs.add(("network", cidr))
         payload["reverseRecord"] = False
         payload["addresses"] = [{"type": "IPv4Address", "address": value}]
 
@@ -1547,20 +2097,50 @@ def create_rr(fqdn, RR_type, value):
 
     # Indirection cases
     elif RR_type == "AliasRecord":
-        ex_host_id = create_ex_host(value)
+        ex_host_id = _ex_host_id(value, prereqs)
         payload["linkedRecord"] = {
             "id": ex_host_id,
             "type": "ExternalHostRecord",
         }
 
     elif RR_type == "MXRecord":
-        mx_host_id = create_ex_host(value)
+        mx_host_id = _ex_host_id(value, prereqs)
         if mx_host_id := is_Host_rr(value):
             payload["linkedRecord"] = {
                 "id": mx_host_id,
                 "type": "ExternalHostRecord",
             }
 
+    return payload
+
+
+def _ex_host_id(fqdn, prereqs):
+    if prereqs is None:
+        return create_ex_host(fqdn)
+    exid = is_ex_host(fqdn)
+    if not exid:
+        prereqs.add(("external host", fqdn))
+    return exid or None
+
+
+"""
+
+Creates RRs of all sorts
+based on their respective schemas
+
+"""
+
+
+def create_rr(fqdn, RR_type, value):
+    (name, zone, zid) = decouple(fqdn)
+    if not zid:
+        zid = create_zone(zone)  # this will create the zone if not already there
+    if not zid:
+        print(f"There was an error creating RR for {fqdn}: zone {zone} could not be made")
+        return False
+
+    payload = rr_payload(name, RR_type, value)
+
     # Create the RR via https
     resp = _request(
         "POST",
@@ -1568,16 +2148,25 @@ def create_rr(fqdn, RR_type, value):
         json=payload,
     )
 
-    if resp.ok:
+    forget_zone_rrs(zid)
+    if resp is not None and resp.ok:
         data = resp.json()
         print(f"A {RR_type} of value {value} for {fqdn} was created")
         if Debug:
             pprint(data)
         return data["id"]
+    # BAM refuses an RR that is already there; hand back the one it has
+    if RR_type == "GenericRecord":
+        (rr_type, rr_val) = value.split("~", 1)
     else:
-        print(f"There was an error creating RR for {fqdn} of type: {RR_type}")
+        (rr_type, rr_val) = (RR_type, value)
+    if rrid := find_rr(zid, name, rr_type, rr_val):
+        print(f"A {RR_type} of value {value} for {fqdn} already exists")
+        return rrid
+    print(f"There was an error creating RR for {fqdn} of type: {RR_type}")
+    if resp is not None:
         pprint(resp.text)
-        return False
+    return False
 
 
 """
@@ -1672,21 +2261,19 @@ def add_TXT_rr(fqdn, text):
 
 def add_Host_rr(fqdn, value):
     if not is_Host_rr(fqdn):
-        create_hostrecord(fqdn, value)
+        return create_hostrecord(fqdn, value)
     else:
         return False
 
 
 def is_generic_rr(fqdn, RR_type, value):
+    if (mirror := _mirror()) is not None:
+        return mirror.rr_id(fqdn, RR_type, value)
     (hname, zone, zid) = decouple(fqdn)
     if zid:
-        rrs = get_generic_rrs(zid)
+        rrs = get_generic_rrs(fqdn, RR_type) or []
         for rr in rrs:
-            if (
-                rr["hname"] == hname
-                and rr["recordType"] == RR_type
-                and rr["rdata"] == value
-            ):
+            if rr["rdata"] == value:
                 if Debug:
                     print(
                         f"Found a matching RR for {fqdn} of type: {RR_type} with value {value}"
@@ -1704,6 +2291,9 @@ def is_generic_rr(fqdn, RR_type, value):
 
 
 def is_CNAME_rr(fqdn):
+    if (mirror := _mirror()) is not None:
+        rrs = mirror.rrs(fqdn, "AliasRecord")
+        return rrs[0]["linkedRecord"]["absoluteName"] if rrs else False
     (nm, zone, zid) = decouple(fqdn)
     rrs = get_zone_cname_rrs(zid)
     for rr in rrs:
@@ -1715,6 +2305,8 @@ def is_CNAME_rr(fqdn):
 
 
 def is_TXT_rr(fqdn, value):
+    if (mirror := _mirror()) is not None:
+        return mirror.rr_id(fqdn, "TXTRecord", value)
     (hname, zone, zid) = decouple(fqdn)
     if zid:
         rrs = get_zone_rrs_by_type(zid, "TXTRecord")
@@ -1733,9 +2325,11 @@ def is_TXT_rr(fqdn, value):
 
 
 def is_A_rr(fqdn, value):
+    if (mirror := _mirror()) is not None:
+        return mirror.rr_id(fqdn, "A", value)
     (hname, zone, zid) = decouple(fqdn)
     if zid:
-        rrs = get_zone_rrs_by_type("A")
+        rrs = get_zone_rrs_by_type(zid, "A")
         for rr in rrs:
             if rr["name"] == hname and rr["rdata"] == value:
                 return rr["id"]
@@ -1751,6 +2345,8 @@ def is_A_rr(fqdn, value):
 
 
 def is_Host_rr(fqdn, value="10.141.0.0"):
+    if (mirror := _mirror()) is not None:
+        return mirror.rr_id(fqdn, "HostRecord")
     (hname, zone, zid) = decouple(fqdn)
     if zid:
         rrs = get_zone_hostname_rrs(zid)
@@ -1785,6 +2381,7 @@ def delete_rr_by_id(rr_id):
         "DELETE",
         f"/resourceRecords/{rr_id}",
     )
+    forget_zone_rrs(RR_zone.pop(rr_id, None))
     if not resp.ok:
         print(f"Error in deleting: rr with id: {rr_id}")
 
@@ -1850,6 +2447,7 @@ def update_generic_rr(fqdn, RR_type, new_value):
             f'/resourceRecords/{rr["id"]}',
             json=rr,
         )
+        forget_zone_rrs(RR_zone.get(rr["id"]))
         data = resp.json()
         if resp.ok:
             if Debug:
@@ -1876,10 +2474,15 @@ Get all Generic Records matching a fqdn and RR type
 
 
 def get_generic_rrs(fqdn, RR_type):
+    if (mirror := _mirror()) is not None:
+        matched = mirror.rrs(fqdn, RR_type)
+        if not matched:
+            print(f"There are no RRs with name {fqdn} and type {RR_type}")
+        return matched or False
     (name, zone, zid) = decouple(fqdn)
     if zid := is_zone(zone):
         matched = list()
-        rrs = get_zone_rrs(zid)
+        rrs = get_zone_rrs(zid, full=True)
         for rr in rrs:
             if (
                 rr["name"] == name
@@ -1899,6 +2502,408 @@ def get_generic_rrs(fqdn, RR_type):
         return False
 
 
+"""
+Bulk RR changes
+
+apply_changes takes (action, fqdn, type, value, ttl) tuples where
+action is add, update or delete, and type is one of the Generic_RR_Types
+(A, AAAA, ...), CNAME, HINFO, HOST, MX or TXT, or a BAM type such as
+TXTRecord. ttl may be None to keep the current one, or TTL for new RRs.
+
+The changes are grouped by zone (the fqdn less its first label). Each
+zone's RRs are fetched once and every change is compared against them,
+and against the changes before it, to find the writes really needed:
+
+    add       create, unless an RR with that name, type and value exists
+    update    set the value (and ttl) of the first RR of that name and type
+    delete    remove the RRs of that name, type and value, or of that name
+              and type when value is empty
+
+The writes then go out with up to concurrency in flight. Zones are only
+created for adds, as create_rr does. The result is one dict per change:
+{"change": change, "status": status, "id": RR id}, with status one of
+created, updated, deleted, unchanged, missing, failed or invalid. An add
+BAM refuses as already there is unchanged with the id of the RR it has,
+else failed with id False. An
+invalid change also has a note saying what is wrong with its value,
+e.g. an A update written old:new as update.txt has them.
+"""
+
+Change_actions = ("add", "update", "delete")
+Change_types = {
+    "CNAME": "AliasRecord",
+    "HINFO": "HINFORecord",
+    "HOST": "HostRecord",
+    "MX": "MXRecord",
+    "TXT": "TXTRecord",
+}
+
+
+# change types whose values are addresses or names, which can not hold a
+# colon (AAAA aside) and so can be checked before anything is written
+Address_types = {"A": ipaddress.IPv4Address, "HOST": ipaddress.IPv4Address, "HostRecord": ipaddress.IPv4Address}
+Name_types = ("CNAME", "AliasRecord", "MX", "MXRecord", "PTR", "DNAME")
+Host_name = re.compile(r"^(\d+\s+)?[\w*-]+(\.[\w-]+)*\.?$")
+
+
+def _valid_value(rr_type, value):
+    if rr_type in Address_types:
+        try:
+            Address_types[rr_type](value)
+        except ValueError:
+            return False
+        return True
+    if rr_type in Name_types:
+        return Host_name.match(value) is not None
+    return True
+
+
+def value_problem(rr_type, value):
+    """
+    why value can not be a value of rr_type, or None. Values written
+    old:new, as update lines are in update.txt, are named as such:
+    changes here take the new value alone.
+    """
+    if not value or _valid_value(rr_type, value):
+        return None
+    pair = value.split(":")
+    if len(pair) == 2 and all(part.strip() and _valid_value(rr_type, part.strip()) for part in pair):
+        return "old:new is not taken, give the new value alone"
+    return f"not a valid {rr_type} value"
+
+
+def change_type(rr_type):
+    """(BAM type, generic record type or None) for a change's type, or None"""
+    if rr_type in Generic_RR_Types:
+        return ("GenericRecord", rr_type)
+    if rr_type in Change_types:
+        return (Change_types[rr_type], None)
+    if rr_type in RR_Types or rr_type == "MXRecord":
+        return (rr_type, None)
+    return None
+
+
+def rr_key(rr):
+    rr_type = rr.get("recordType") if rr.get("type") == "GenericRecord" else rr.get("type")
+    return ((rr.get("name") or "").lower(), rr_type)
+
+
+def rr_value(rr):
+    """the value of an RR as a change would give it"""
+    rr_type = rr.get("type")
+    if rr_type == "GenericRecord":
+        return rr.get("rdata")
+    if rr_type == "TXTRecord":
+        return rr.get("text")
+    if rr_type == "HINFORecord":
+        return f'{rr.get("os")}~{rr.get("cpu")}'
+    if rr_type == "HostRecord":
+        addrs = rr.get("addresses") or []
+        return addrs[0].get("address") if addrs else None
+    if rr_type in ("AliasRecord", "MXRecord"):
+        return (rr.get("linkedRecord") or {}).get("absoluteName")
+    return None
+
+
+def find_rr(zid, name, rr_type, value):
+    """the id of the RR of zone zid keyed (name, rr_type) as rr_key has it and of value, or False"""
+    for rr in get_zone_rrs(zid, full=True):
+        if rr_key(rr) == (name.lower(), rr_type) and rr_value(rr) == value:
+            return rr["id"]
+    return False
+
+
+def _rr_fields(name, RR_type, record_type, value, ttl, prereqs=None):
+    """the fields of an RR with this value, as kept locally while planning"""
+    if record_type is not None:
+        value_arg = f"{record_type}~{value}"
+    else:
+        value_arg = value
+    fields = rr_payload(name, RR_type, value_arg, TTL if ttl is None else ttl, prereqs)
+    if "linkedRecord" in fields:
+        fields["linkedRecord"] = dict(fields["linkedRecord"], absoluteName=value)
+    if ttl is None:
+        del fields["ttl"]
+    return fields
+
+
+def _plan_zone(zid, rrs, items, results, prereqs=None):
+    index = dict()
+    for rr in rrs:
+        index.setdefault(rr_key(rr), []).append(rr)
+    writes = list()
+
+    def write(method, path, status, rr, idx):
+        pending = rr.get("_write")
+        if pending is None:
+            pending = {"method": method, "path": path, "status": status, "rr": rr, "changes": []}
+            rr["_write"] = pending
+            writes.append(pending)
+        elif method == "DELETE" and pending["method"] == "POST":
+            # created and deleted again within the same changes
+            (pending["method"], pending["status"]) = (None, "unchanged")
+        elif method == "DELETE":
+            (pending["method"], pending["path"], pending["status"]) = (method, path, status)
+        pending["changes"].append(idx)
+
+    for idx, change in items:
+        (action, fqdn, rr_type, value, ttl) = change
+        name = fqdn.split(Dot, 1)[0]
+        (RR_type, record_type) = change_type(rr_type)
+        ttl = int(ttl) if ttl not in (None, "") else None
+        key = (name, record_type or RR_type)
+        same = index.get(key, [])
+        match = [rr for rr in same if rr_value(rr) == value]
+        results[idx] = {"change": change, "status": "unchanged", "id": None}
+        if action == "add" and not match:
+            rr = _rr_fields(name, RR_type, record_type, value, ttl, prereqs)
+            index.setdefault(key, []).append(rr)
+            write("POST", f"/zones/{zid}/resourceRecords", "created", rr, idx)
+        elif action == "add" or (action == "update" and same):
+            rr = (match or same)[0]
+            results[idx]["id"] = rr.get("id")
+            if match and (ttl is None or rr.get("ttl") == ttl):
+                # added earlier in these changes, so given its id once written
+                rr.setdefault("_same", []).append(idx)
+                continue
+            fields = _rr_fields(name, RR_type, record_type, value, ttl, prereqs)
+            for kept in ("name", "comment"):
+                if kept in rr:
+                    del fields[kept]
+            rr.update(fields)
+            status = "created" if rr.get("_write", {}).get("method") == "POST" else "updated"
+            write("PUT", f'/resourceRecords/{rr.get("id")}', status, rr, idx)
+        elif action == "delete" and (match or (same and not value)):
+            for rr in match or list(same):
+                same.remove(rr)
+                write("DELETE", f'/resourceRecords/{rr.get("id")}', "deleted", rr, idx)
+        else:
+            results[idx]["status"] = "missing"
+    return writes
+
+
+def _apply_write(write):
+    if write["method"] is None:
+        return True
+    payload = None
+    if write["method"] != "DELETE":
+        payload = {key: val for key, val in write["rr"].items() if not key.startswith("_")}
+    return _request(write["method"], write["path"], json=payload)
+
+
+def _group_changes(changes, results):
+    """{zone: [index of change]}, normalising changes and marking the invalid ones"""
+    zones = dict()
+    for idx, change in enumerate(changes):
+        (action, fqdn, rr_type, value, ttl) = change
+        fqdn = fqdn.strip(Dot).lower()
+        problem = value_problem(rr_type, value)
+        if (
+            action not in Change_actions
+            or change_type(rr_type) is None
+            or Dot not in fqdn
+            or not (ttl in (None, "") or str(ttl).strip().isdigit())
+            or problem is not None
+        ):
+            results[idx] = {"change": change, "status": "invalid", "id": None, "note": problem or ""}
+            continue
+        changes[idx] = (action, fqdn, rr_type, value, ttl)
+        zones.setdefault(fqdn.split(Dot, 1)[1], []).append(idx)
+    return zones
+
+
+def apply_changes(changes, concurrency=8):
+    changes = list(changes)
+    results = [None] * len(changes)
+    zones = _group_changes(changes, results)
+
+    zids = dict()
+    existing = dict()
+    for zone, idxs in zones.items():
+        zids[zone] = is_zone(zone)
+        if not zids[zone] and any(changes[idx][0] == "add" for idx in idxs):
+            zids[zone] = create_zone(zone)
+            existing[zids[zone]] = []
+    fetch = [zid for zid in zids.values() if zid and zid not in existing]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rrs = pool.map(lambda zid: get_zone_rrs(zid, full=True), fetch)
+        existing.update(zip(fetch, rrs))
+        writes = list()
+        for zone, idxs in zones.items():
+            zid = zids[zone]
+            if not zid:
+                for idx in idxs:
+                    results[idx] = {"change": changes[idx], "status": "missing", "id": None}
+                continue
+            items = [(idx, changes[idx]) for idx in idxs]
+            for write in _plan_zone(zid, existing[zid], items, results):
+                write["zid"] = zid
+                writes.append(write)
+        replies = list(pool.map(_apply_write, writes))
+
+    for zid in {write["zid"] for write in writes}:
+        forget_zone_rrs(zid)
+    for write, resp in zip(writes, replies):
+        rr_id = write["rr"].get("id")
+        status = write["status"] if resp is not None else "failed"
+        if write["method"] == "POST" and resp is not None:
+            rr_id = resp.json()["id"]
+        elif write["method"] == "POST":
+            # refused, as BAM does an RR added since the zone was read
+            rr_id = find_rr(write["zid"], *rr_key(write["rr"]), rr_value(write["rr"]))
+            status = "unchanged" if rr_id else "failed"
+            if not rr_id:
+                print(f'apply_changes: could not add {write["rr"].get("name")} to zone {write["zid"]}')
+        if write["method"] == "DELETE":
+            RR_zone.pop(rr_id, None)
+        elif rr_id:
+            RR_zone[rr_id] = write["zid"]
+        for idx in write["changes"]:
+            if results[idx]["status"] == "failed":
+                continue
+            results[idx]["status"] = status
+            results[idx]["id"] = rr_id
+        for idx in write["rr"].get("_same", []):
+            results[idx]["id"] = rr_id
+    if Debug:
+        counts = Counter(result["status"] for result in results)
+        print(f"apply_changes: {len(writes)} writes to {len(fetch)} zones: {dict(counts)}")
+    return results
+
+
+"""
+Reads a bulk change file in the format qwe.process_bulk_data takes,
+
+    action, fqdn, ttl, type, value
+
+skipping blank lines and lines starting with #. As there, a value
+with commas in it has to be quoted. Returns a list of (line number, change), each change
+as apply_changes and plan_changes take it.
+"""
+
+
+def read_changes(fname):
+    changes = list()
+    with open(fname, newline="") as fd:
+        reader = csv.reader(fd, skipinitialspace=True)
+        for row in reader:
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            row = [field.strip() for field in row] + [""] * (5 - len(row))
+            (action, fqdn, ttl, rr_type, value) = row[:5]
+            changes.append((reader.line_num, (action, fqdn, rr_type, value, ttl or None)))
+    return changes
+
+
+"""
+A dry run of apply_changes. The changes are grouped and planned zone by
+zone just as apply_changes does, from one read of each zone's RRs, but
+nothing is written and no zone, network or external host is created.
+Returns (results, cost). results has one dict per change, with change,
+status, id and note, the status being one of
+
+    create, update, delete   the write apply_changes would make
+    no-op                    the RR is already as asked
+    missing record           an update or delete of an RR that is not there
+    missing zone             the zone does not exist; adds would create it
+    conflict                 another change writes the same RR, the update
+                             picks one of several RRs, or a CNAME would
+                             share its name with other RRs
+    invalid                  not a change apply_changes understands, or
+                             a value its type can not hold (an address
+                             or name written old:new among them)
+
+cost counts the calls apply_changes would make: POST, PUT and DELETE of
+RRs, and the zones, networks and external hosts it would create first,
+with their sum as writes and the zone reads made here as reads.
+labels name the changes in notes; their position from 1 by default.
+"""
+
+Plan_status = {
+    "created": "create",
+    "updated": "update",
+    "deleted": "delete",
+    "unchanged": "no-op",
+    "missing": "missing record",
+}
+
+
+def plan_changes(changes, concurrency=8, labels=None):
+    changes = list(changes)
+    labels = list(labels) if labels is not None else list(range(1, len(changes) + 1))
+    results = [None] * len(changes)
+    zones = _group_changes(changes, results)
+    zids = {zone: is_zone(zone) for zone in zones}
+    fetch = [zid for zid in zids.values() if zid]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rrs = pool.map(lambda zid: get_zone_rrs(zid, full=True), fetch)
+        existing = dict(zip(fetch, rrs))
+
+    cost = Counter()
+    prereqs = set()
+    for zone, idxs in zones.items():
+        zid = zids[zone]
+        # copies, as planning edits the RRs it would write
+        rrs = [dict(rr) for rr in existing.get(zid) or []]
+        before = [(rr_key(rr), rr_value(rr)) for rr in rrs]
+        writes = _plan_zone(zid, rrs, [(idx, changes[idx]) for idx in idxs], results, prereqs)
+        for idx in idxs:
+            results[idx]["status"] = Plan_status[results[idx]["status"]]
+            results[idx]["note"] = ""
+        for write in writes:
+            if write["method"] is not None:
+                cost[write["method"]] += 1
+            if len(write["changes"]) == 1:
+                results[write["changes"][0]]["status"] = Plan_status[write["status"]]
+                continue
+            together = ", ".join(str(labels[idx]) for idx in write["changes"])
+            for idx in write["changes"]:
+                results[idx]["status"] = "conflict"
+                results[idx]["note"] = f"same RR as {together}: {write['method'] or 'no'} write"
+
+        kept = [rr for rr in rrs if rr.get("_write", {}).get("method") != "DELETE"]
+        kept += [write["rr"] for write in writes if write["method"] == "POST"]
+        types = dict()
+        for rr in kept:
+            (name, rr_type) = rr_key(rr)
+            types.setdefault(name, set()).add(rr_type)
+        for idx in idxs:
+            result = results[idx]
+            (action, fqdn, rr_type, value, ttl) = changes[idx]
+            name = fqdn.split(Dot, 1)[0]
+            key = (name, change_type(rr_type)[1] or change_type(rr_type)[0])
+            if not zid:
+                result["status"] = "missing zone"
+                result["note"] = "created first" if action == "add" else ""
+                continue
+            if result["status"] not in ("create", "update"):
+                continue
+            if action == "update" and len((value or "").split(":")) == 2:
+                # free text may hold a colon, so this is only pointed out
+                result["note"] = "value reads like old:new, the whole of it is written"
+            same = [old_value for old_key, old_value in before if old_key == key]
+            if action == "update" and len(same) > 1 and value not in same:
+                result["status"] = "conflict"
+                result["note"] = f"updates the first of {len(same)} {key[1]} RRs"
+            elif "AliasRecord" in types.get(name, ()) and len(types[name]) > 1:
+                result["status"] = "conflict"
+                result["note"] = f"CNAME beside {len(types[name]) - 1} other types at {name}"
+        if not zid and any(changes[idx][0] == "add" for idx in idxs):
+            cost["zones"] += 1
+
+    for kind, _ in prereqs:
+        cost[kind + "s"] += 1
+    for result in results:
+        result.setdefault("note", "")
+    cost["writes"] = sum(cost.values())
+    cost["reads"] = len(fetch)
+    if Debug:
+        counts = Counter(result["status"] for result in results)
+        print(f"plan_changes: {cost['writes']} writes to {len(zones)} zones: {dict(counts)}")
+    return (results, cost)
+
+
 def get_conf_id(cf_name):
     confs = get_confs()
     for conf in confs:
@@ -1961,17 +2966,50 @@ Get all the zones in the given View and Config
 
 def get_all_zones(cid, vid):
     dd = dict()
-    params = {
-        "limit": 5000,
-        "fields": "absoluteName,id",
-        "filter": f"configuration.id:eq({cid}) and view.id:eq({vid}) and type:eq('Zone')",
-    }
-    zones = get_zones(params)
+    zones = paginate(
+        "/zones",
+        params={"orderBy": "asc(id)"},
+        fields="absoluteName,id",
+        filter=f"configuration.id:eq({cid}) and view.id:eq({vid}) and type:eq('Zone')",
+    )
     for zone in zones:
         dd[zone["absoluteName"]] = zone["id"]
     return dd
 
 
+"""
+Fill ViewZones with every zone of the View. A copy saved on disk
+within the last Zone_cache_ttl seconds is used instead of asking BAM,
+unless refresh is set. The copy is keyed by endpoint and View ID.
+It suits interactive lookups; anything attributing names to their
+zones should refresh, or zones made since are taken for their parent.
+"""
+
+
+def load_zone_catalogue(refresh=False):
+    global Zones_changed
+    key = f"{Base}-{ViewID}"
+    zones = None
+    if Zone_cache_ttl and not refresh:
+        zones = cache.load("zones", key, Zone_cache_ttl)
+    if zones is None:
+        zones = get_all_zones(ConfID, ViewID)
+        if Zone_cache_ttl:
+            cache.save("zones", key, zones)
+    ViewZones.load(zones)
+    Zones_changed = False
+    return ViewZones
+
+
+@atexit.register
+def save_zone_catalogue():
+    """write ViewZones back to disk if zones were created or deleted"""
+    global Zones_changed
+    if Zones_changed and Zone_cache_ttl:
+        cache.save("zones", f"{Base}-{ViewID}", ViewZones.to_dict())
+    Zones_changed = False
+
+
 def get_all_leaf_zones():
     zlist = list()
     for zone in ViewZones:
@@ -1991,16 +3029,39 @@ Does not create a Zone rather returns False if not there
 
 
 def is_zone(zone):
-    if zone in ViewZones:
-        return ViewZones[zone]
-    else:
-        return False
+    return ViewZones.id(zone)
 
 
 def get_zone_id(zone):
     return is_zone(zone)
 
 
+"""
+Deepest zone of the View owning fqdn as (zone name, zone ID)
+or None when it is outside every zone
+"""
+
+
+def find_zone(fqdn):
+    return ViewZones.find(fqdn)
+
+
+"""
+absoluteName of the zone zid if it is in the View, otherwise
+(or when it no longer exists) None
+"""
+
+
+def get_view_zone_name(zid):
+    resp = _request("GET", f"/zones/{zid}", params={"fields": "absoluteName,view"})
+    if resp is None:
+        return None
+    data = resp.json()
+    if (data.get("view") or {}).get("id") != ViewID:
+        return None
+    return data.get("absoluteName")
+
+
 def get_subzones(zid):
     dd = dict()
     params = {
@@ -2086,12 +3147,25 @@ def get_system_version():
     return version
 
 
-def _request(method, path, params=None, payload=None):
-    global Sess, Header_Printed
+def _request(
+    method,
+    path,
+    params=None,
+    payload=None,
+    json=None,
+    reauth=True,
+    accept=None,
+    stream=False,
+    session=None,
+):
+    global Header_Printed
 
-    url = f"https://{Base}/api/v2{path}"
+    if payload is None:
+        payload = json
+
+    url = f"{Scheme}://{Base}/api/v2{path}"
     if Debug:
-        if not Header_Printed:
+        if not Header_Printed and session is None:
             print("_request: Session Header")
             [print(f"{key}: {val}") for key, val in Sess.headers.items()]
             print()
@@ -2100,31 +3174,246 @@ def _request(method, path, params=None, payload=None):
             print(f"_request: parameters: {params}")
         if payload is not None:
             print(f"_request: json payload: {payload}")
+    attempt = 0
+    while True:
+        if not Breaker.allow():
+            print(f"_request: {Base} is failing, {method} {path} not sent")
+            return None
+        Bucket.take()
+        retry = attempt < Retries and method in Idempotent
+        wait = None
+        try:
+            auth = (session or Sess).headers.get("Authorization")
+            resp = _send(method, path, url, params, payload, accept, stream, session)
+            if resp.status_code == 401 and reauth and auth is not None:
+                Breaker.release()
+                relogin(auth)
+                return _request(
+                    method, path, params, payload, reauth=False, accept=accept, stream=stream
+                )
+            if resp.status_code in Retry_statuses:
+                if resp.status_code == 429:
+                    Breaker.release()
+                    Bucket.slow_down()
+                    retry = attempt < Retries
+                else:
+                    Breaker.failure()
+                if retry:
+                    wait = retry_after(resp)
+                    if wait is None:
+                        wait = backoff(attempt)
+            elif resp.status_code >= 500:
+                Breaker.failure()
+            elif resp.status_code >= 400:
+                Breaker.release()
+            else:
+                Breaker.success()
+                Bucket.speed_up()
+            if wait is None:
+                resp.raise_for_status()
+        except exceptions.HTTPError as http_err:
+            print(f"HTTP error status: {http_err}")
+            return None
+        except (exceptions.ConnectionError, exceptions.Timeout) as err:
+            Breaker.failure()
+            if not retry:
+                if isinstance(err, exceptions.Timeout):
+                    print(f"Timeout error status: {err}")
+                else:
+                    print(f"Connection error status: {err}")
+                return None
+            wait = backoff(attempt)
+        except LoginError:
+            raise
+        except exceptions.URLRequired as url_err:
+            Breaker.release()
+            print(f"Invalid URL error status: {url_err}")
+            return None
+        except exceptions.RequestException as err:
+            Breaker.release()
+            print(f"An error occurred status: {err}")
+            return None
+        else:
+            if wait is None and stream:
+                return resp
+            if wait is None:
+                return _received(method, path, resp)
+        attempt += 1
+        if Debug:
+            print(f"_request: retry {attempt} of {method} {path} in {wait:.2f}s")
+        time.sleep(wait)
+
+
+"""
+Seconds to wait before retry number attempt + 1: a random share of
+Backoff doubled attempt times, capped at Backoff_max
+"""
+
+
+def backoff(attempt):
+    return random.uniform(0, min(Backoff_max, Backoff * 2**attempt))
+
+
+def retry_after(resp):
+    """the seconds asked for by a Retry-After header, or None"""
+    value = getattr(resp, "headers", {}).get("Retry-After")
+    if value is None:
+        return None
     try:
-        resp = Sess.request(method, url, params=params, json=payload, timeout=(5, 10))
-        resp.raise_for_status()
-    except exceptions.HTTPError as http_err:
-        print(f"HTTP error status: {http_err}")
-    except exceptions.ConnectionError as conn_err:
-        print(f"Connection error status: {conn_err}")
-    except exceptions.ReadTimeout as read_timeout_err:
-        print(f"Read Timeout error status: {read_timeout_err}")
-    except exceptions.Timeout as timeout_err:
-        print(f"Timeout error status: {timeout_err}")
-    except exceptions.URLRequired as url_err:
-        print(f"Invalid URL error status: {url_err}")
-    except exceptions.RequestException as err:
-        print(f"An error occurred status: {err}")
-    else:
-        if resp.ok:
-            return resp
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def template(path):
+    """path with the IDs in it replaced by {id}"""
+    return Path_ids.sub("/{id}", path)
+
+
+"""
+One attempt at a request through Transport or session (Sess unless
+given), timed and counted into Stats whatever comes of it
+"""
+
+
+def _send(method, path, url, params, payload, accept, stream, session=None):
+    start = time.perf_counter()
+    status = "error"
+    received = 0
+    try:
+        if Transport is not None:
+            extra = dict()
+            if accept is not None:
+                extra["accept"] = accept
+            if session is not None:
+                extra["session"] = session
+            if stream:
+                extra["stream"] = True
+            resp = Transport(method, path, params=params, json=payload, **extra)
         else:
-            print(f"_request: return code: {resp.status_code}")
-            print(f"_request: url: {resp.url}")
-            print(f"_request method {resp.request.method}")
-            print(f"_request header {resp.request.headers}")
-            print(f"_request body {resp.request.body}")
-            print(f"_request response: {resp.text}")
+            headers = {"Accept": accept} if accept is not None else None
+            resp = (session or Sess).request(
+                method,
+                url,
+                params=params,
+                json=payload,
+                headers=headers,
+                stream=stream,
+                timeout=(5, 10),
+            )
+        status = resp.status_code
+        if not stream:
+            received = len(getattr(resp, "content", None) or b"")
+        return resp
+    except exceptions.Timeout:
+        status = "timeout"
+        raise
+    except exceptions.ConnectionError:
+        status = "connection"
+        raise
+    finally:
+        Stats.observe(method, template(path), status, time.perf_counter() - start, received)
+
+
+def _drop_links(obj):
+    obj.pop("_links", None)
+    return obj
+
+
+def _received(method, path, resp):
+    """when Lean, decode a reply without _links"""
+    content = getattr(resp, "content", None) or b""
+    if Lean and content[:1] in (b"{", b"["):
+        try:
+            data = json.loads(content, object_hook=_drop_links)
+        except ValueError:
+            return resp
+        resp.json = lambda: data
+    return resp
+
+
+def write_stats():
+    if Stats_file and len(Stats):
+        Stats.write_textfile(Stats_file)
+
+
+@atexit.register
+def report_stats():
+    if (Debug or Stats_report) and len(Stats):
+        print("requests per endpoint:", file=sys.stderr)
+        print(Stats.summary(), file=sys.stderr)
+    write_stats()
+
+
+"""
+params with fields set to the projection of kind in Fields when Lean
+is on and the caller has not chosen any
+"""
+
+
+def project(params, kind):
+    if not Lean or "fields" in params or kind not in Fields:
+        return params
+    return dict(params, fields=Fields[kind])
+
+
+def set_rate_limit(rate, burst=None):
+    """send at most rate requests per second (0 for no limit) from all threads"""
+    Bucket.configure(rate, burst)
+
+
+"""
+Every item of the collection at path as a generator, one page of
+limit (default Page_size) items per request. fields and filter set the
+fields= and filter= parameters over any given in params. While the
+caller works through one page the next is fetched in the background,
+so only two pages are ever held and the caller never waits for a
+round trip it could have overlapped. A page that can not be fetched
+raises PageError instead of ending the collection early.
+"""
+
+
+class PageError(exceptions.RequestException):
+    pass
+
+
+def paginate(path, params=None, fields=None, filter=None, limit=None, prefetch=True):
+    params = dict(params or {})
+    if fields is not None:
+        params["fields"] = fields
+    if filter is not None:
+        params["filter"] = filter
+    offset = int(params.pop("offset", 0))
+    limit = int(params.pop("limit", limit or Page_size))
+
+    def fetch(offset):
+        resp = _request("GET", path, params=dict(params, offset=offset, limit=limit))
+        if resp is None:
+            raise PageError(f"paginate: GET {path} failed at offset {offset}")
+        return resp.json()["data"]
+
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = fetch(offset)
+        while True:
+            more = len(page) >= limit
+            offset += limit
+            if more and pool is not None:
+                following = pool.submit(fetch, offset)
+            yield from page
+            if not more:
+                return
+            page = following.result() if pool is not None else fetch(offset)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
 
 
 def test(nm, z):
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+Reversed label trie of the zones in a View
+
+A name is resolved to the deepest zone that owns it by walking its
+labels from the right, so a lookup costs O(labels) whatever the
+number of zones. E.g. with the zones
+
+    azure.com
+    privatelink.openai.azure.com
+    573.privatelink.openai.azure.com
+
+x.573.privatelink.openai.azure.com belongs to 573.privatelink.openai.azure.com
+and y.openai.azure.com belongs to azure.com
+"""
+
+Dot = "."
+
+# key of the (zone name, zone id) entry in a trie node, never a DNS label
+Zone = None
+
+
+def labels(name):
+    return name.strip(Dot).lower().split(Dot)
+
+
+class ZoneTree:
+    def __init__(self, zones=None):
+        self.root = dict()
+        self.count = 0
+        if zones:
+            for name, zid in zones.items():
+                self.add(name, zid)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, zone):
+        node = self._node(zone)
+        return node is not None and Zone in node
+
+    def _node(self, name):
+        node = self.root
+        for label in reversed(labels(name)):
+            node = node.get(label)
+            if node is None:
+                return None
+        return node
+
+    def add(self, zone, zid):
+        node = self.root
+        for label in reversed(labels(zone)):
+            node = node.setdefault(label, dict())
+        if Zone not in node:
+            self.count += 1
+        node[Zone] = (zone.strip(Dot).lower(), zid)
+
+    def remove(self, zone):
+        """drop a zone, pruning trie nodes that no longer lead anywhere"""
+        path = [self.root]
+        toks = list(reversed(labels(zone)))
+        for label in toks:
+            node = path[-1].get(label)
+            if node is None:
+                return False
+            path.append(node)
+        if Zone not in path[-1]:
+            return False
+        del path[-1][Zone]
+        self.count -= 1
+        for idx in range(len(toks), 0, -1):
+            if path[idx]:
+                break
+            del path[idx - 1][toks[idx - 1]]
+        return True
+
+    def find(self, fqdn):
+        """
+        returns (zone name, zone id) of the deepest zone owning fqdn,
+        which may be fqdn itself, or None when no zone in the tree does
+        """
+        found = None
+        node = self.root
+        for label in reversed(labels(fqdn)):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(Zone, found)
+        return found
@@ -0,0 +1,93 @@
+"""
+Fixtures that point v2api at a freshly seeded stand-in BAM
+
+Every test gets its own StandIn on a free port and a v2api with its
+module state (IDs, caches, breaker, rate limit, metrics) put back as
+it was afterwards, with short back-offs so retries do not hold it up.
+"""
+
+import pytest
+
+from changed_zones import cache, standin, v2api
+from changed_zones.catalogue import ZoneCatalogue
+from changed_zones.metrics import Metrics
+from changed_zones.throttle import CircuitBreaker, TokenBucket
+
+State = (
+    "Debug",
+    "Scheme",
+    "Base",
+    "Conf",
+    "View",
+    "Uname",
+    "Pw",
+    "ConfID",
+    "ViewID",
+    "ExHostZoneID",
+    "BlockID",
+    "Token",
+    "Token_expires",
+    "Sess",
+    "Session_cache",
+    "Zone_cache_ttl",
+    "ViewZones",
+    "Zones_changed",
+    "ExHosts",
+    "ExHosts_changed",
+    "Networks",
+    "Zone_rrs_cache",
+    "ZoneRRs",
+    "RR_zone",
+    "View_mirror",
+    "Embed_operations",
+    "Embed_addresses",
+    "Retries",
+    "Backoff",
+    "Breaker",
+    "Bucket",
+    "Stats",
+    "Stats_file",
+    "Transport",
+)
+
+
+@pytest.fixture
+def fresh_v2api(monkeypatch, tmp_path):
+    for name in State:
+        monkeypatch.setattr(v2api, name, getattr(v2api, name, None), raising=False)
+    monkeypatch.setattr(cache, "Cache_dir", str(tmp_path / "cache"))
+    v2api.Uname = "tester"
+    v2api.Pw = "secret"
+    v2api.ViewZones = ZoneCatalogue()
+    v2api.ExHosts = None
+    v2api.Networks = None
+    v2api.ZoneRRs = dict()
+    v2api.RR_zone = dict()
+    v2api.View_mirror = None
+    v2api.Embed_operations = True
+    v2api.Embed_addresses = True
+    v2api.Retries = 2
+    v2api.Backoff = 0.01
+    v2api.Breaker = CircuitBreaker(threshold=3, cooldown=0.2)
+    v2api.Bucket = TokenBucket()
+    v2api.Stats = Metrics()
+    v2api.Stats_file = None
+    v2api.Transport = None
+    return v2api
+
+
+@pytest.fixture
+def model():
+    return standin.seed(standin.Model(), records=300, zones=10, conf="Test", view="Default")
+
+
+@pytest.fixture
+def bam(fresh_v2api, model):
+    """a StandIn serving model, with v2api logged in to it"""
+    server = standin.StandIn(model, retry_after=0)
+    server.start()
+    try:
+        standin.connect(server)
+        yield server
+    finally:
+        server.stop()
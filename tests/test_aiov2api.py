@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from changed_zones import aiov2api, v2api
+
+pytest.importorskip("aiohttp")
+
+
+def add_txt(model, count):
+    with model.lock:
+        model.user["name"] = v2api.Uname
+        zone = model.zone_path(model.listing("views")[0], "004.privatelink.example.com")
+        for num in range(count):
+            model.record(zone, {"type": "TXTRecord", "name": f"a{num}", "text": f"async {num}"})
+    return list(range(1, count + 1))
+
+
+def run(coro_fn):
+    async def main():
+        async with aiov2api.AsyncClient.from_session(concurrency=4) as bam:
+            return await coro_fn(bam)
+
+    return asyncio.run(main())
+
+
+def test_paginate_collects_every_page(bam):
+    zid = v2api.get_zone_id("005.privatelink.example.com")
+    rrs = run(lambda client: client.collect(f"/zones/{zid}/resourceRecords", {"fields": "id"}, limit=4))
+    assert len(rrs) == len(v2api.get_zone_rrs(zid)) > 4
+
+
+def test_failed_page_raises(bam):
+    add_txt(bam.model, 12)
+    bam.script(None, 503)
+
+    async def transactions(client):
+        return [act async for act in client.paginate("/transactions", limit=5)]
+
+    with pytest.raises(v2api.PageError):
+        run(transactions)
+
+
+def test_failed_operations_fetch_raises(bam):
+    tids = add_txt(bam.model, 3)
+    assert [ops[0]["resourceType"] for ops in run(lambda client: client.get_operations(tids))] == [
+        "TXTRecord"
+    ] * 3
+    bam.script(404)
+    with pytest.raises(v2api.PageError):
+        run(lambda client: client.get_operations(tids))
+
+
+def test_failed_system_version_is_none(bam):
+    assert run(lambda client: client.get_system_version()) == v2api.get_system_version()
+    bam.script(500)
+    assert run(lambda client: client.get_system_version()) is None
@@ -0,0 +1,32 @@
+import time
+from types import SimpleNamespace
+
+from changed_zones import cache, v2api
+
+
+def gets():
+    return sum(point.count for (method, _), point in v2api.Stats.endpoints.items() if method == "GET")
+
+
+def test_entries_are_served_until_older_than_the_ttl(fresh_v2api, monkeypatch):
+    cache.save("zones", "bam-1", {"example.com": 7})
+    assert cache.load("zones", "bam-1", 60) == {"example.com": 7}
+    assert cache.load("zones", "bam-2", 60) is None
+    now = time.time()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: now + 61))
+    assert cache.load("zones", "bam-1", 60) is None
+    cache.clear("zones", "bam-1")
+    monkeypatch.setattr(cache, "time", time)
+    assert cache.load("zones", "bam-1", 60) is None
+
+
+def test_zone_catalogue_is_read_again_once_expired(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Zone_cache_ttl", 60)
+    zones = v2api.load_zone_catalogue(refresh=True).to_dict()
+    sent = gets()
+    assert v2api.load_zone_catalogue().to_dict() == zones
+    assert gets() == sent
+    now = time.time()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: now + 61))
+    assert v2api.load_zone_catalogue().to_dict() == zones
+    assert gets() > sent
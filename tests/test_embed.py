@@ -0,0 +1,81 @@
+import pytest
+
+from changed_zones import v2api
+
+
+def add_txt(model, count):
+    with model.lock:
+        zone = model.zone_path(model.listing("views")[0], "006.privatelink.example.com")
+        for num in range(count):
+            model.record(zone, {"type": "TXTRecord", "name": f"e{num}", "text": f"embed {num}"})
+
+
+def operations_calls():
+    point = v2api.Stats.endpoints.get(("GET", "/transactions/{id}/operations"))
+    return point.count if point else 0
+
+
+def test_transient_failure_keeps_embedded_operations(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 1)
+    add_txt(bam.model, 5)
+    bam.script(*[503] * (v2api.Retries + 1))
+    with pytest.raises(v2api.PageError):
+        v2api.get_rr_transactions_with_operations(since_id=0, everyone=True)
+    assert v2api.Embed_operations
+    acts = v2api.get_rr_transactions_with_operations(since_id=0, everyone=True)
+    assert [ops[0]["resourceType"] for _, ops in acts] == ["TXTRecord"] * 5
+    assert operations_calls() == 0
+
+
+def test_refused_embed_falls_back_to_operations_calls(bam):
+    add_txt(bam.model, 5)
+    bam.embed = False
+    acts = v2api.get_rr_transactions_with_operations(since_id=0, everyone=True)
+    assert [ops[0]["resourceType"] for _, ops in acts] == ["TXTRecord"] * 5
+    assert not v2api.Embed_operations
+    assert operations_calls() == 5
+
+
+def test_failed_operations_call_raises_page_error(bam):
+    add_txt(bam.model, 5)
+    tids = [act["id"] for act in bam.model.transactions[-5:]]
+    bam.script(500)
+    with pytest.raises(v2api.PageError):
+        v2api.get_operations(tids, concurrency=4)
+    assert [ops[0]["resourceType"] for ops in v2api.get_operations(tids)] == ["TXTRecord"] * 5
+
+
+def hosts_zone():
+    zid = v2api.get_zone_id("000.privatelink.example.com")
+    expected = {
+        rr["absoluteName"]: [addr["address"] for addr in rr["addresses"]]
+        for rr in v2api.get_zone_rrs(zid, params={"filter": "type:eq('HostRecord')"}, full=True)
+    }
+    assert expected
+    return (zid, expected)
+
+
+def addresses_calls():
+    point = v2api.Stats.endpoints.get(("GET", "/resourceRecords/{id}/addresses"))
+    return point.count if point else 0
+
+
+def test_transient_failure_keeps_embedded_addresses(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 1)
+    (zid, expected) = hosts_zone()
+    bam.script(503, 503)
+    with pytest.raises(v2api.PageError):
+        v2api.get_zone_hostname_rrs(zid)
+    assert v2api.Embed_addresses
+    found = {rr["absoluteName"]: rr["ipaddr"] for rr in v2api.get_zone_hostname_rrs(zid)}
+    assert found == expected
+    assert addresses_calls() == 0
+
+
+def test_refused_embed_looks_addresses_up(bam):
+    (zid, expected) = hosts_zone()
+    bam.embed = False
+    found = {rr["absoluteName"]: rr["ipaddr"] for rr in v2api.get_zone_hostname_rrs(zid)}
+    assert found == expected
+    assert not v2api.Embed_addresses
+    assert addresses_calls() == len(expected)
@@ -0,0 +1,39 @@
+from changed_zones import export, replay, v2api
+
+
+def add_txt(model, count):
+    with model.lock:
+        zone = model.zone_path(model.listing("views")[0], "007.privatelink.example.com")
+        for num in range(count):
+            model.record(zone, {"type": "TXTRecord", "name": f"x{num}", "text": f"export, {num}"})
+
+
+def test_rrs_stream_every_page(bam, monkeypatch):
+    monkeypatch.setattr(export, "Page_size", 64)
+    rows = list(export.rrs())
+    assert len(rows) == len(bam.model.collections["resourceRecords"])
+    assert len({row["id"] for row in rows}) == len(rows)
+    assert all(isinstance(row["id"], int) for row in rows)
+    assert v2api.Stats.endpoints[("GET", "/resourceRecords")].received > 0
+
+
+def test_export_text_survives_csv(bam):
+    add_txt(bam.model, 3)
+    texts = [row["text"] for row in export.rrs() if row["type"] == "TXTRecord" and row["name"].startswith("x")]
+    assert texts == ["export, 0", "export, 1", "export, 2"]
+
+
+def test_recorded_export_keeps_rows_and_cassette(bam, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "Page_size", 2)
+    add_txt(bam.model, 5)
+    recorder = replay.Recorder(str(tmp_path / "fixture"))
+    replay.install(recorder)
+    acts = list(export.transactions())
+    assert [act["id"] for act in acts] == [1, 2, 3, 4, 5]
+    assert acts[0]["user"]["name"] == bam.model.user["name"]
+    zones = list(export.zones())
+    assert len(zones) == len(v2api.ViewZones)
+    recorder.save()
+    (transactions, _, saved_zones) = replay.load_fixture(str(tmp_path / "fixture"))
+    assert [act["id"] for act in transactions] == [1, 2, 3, 4, 5]
+    assert set(saved_zones) == set(v2api.ViewZones)
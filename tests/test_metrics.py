@@ -0,0 +1,34 @@
+from changed_zones.metrics import Metrics
+
+
+def observed():
+    stats = Metrics()
+    stats.observe("GET", "/zones/{id}/resourceRecords", 200, 0.02, received=2048)
+    stats.observe("GET", "/zones/{id}/resourceRecords", 503, 0.3)
+    stats.observe("POST", '/zones/{id}/"quoted"', "timeout", 20.0)
+    return stats
+
+
+def test_textfile_holds_counts_histogram_and_bytes(tmp_path):
+    path = tmp_path / "bam.prom"
+    observed().write_textfile(str(path))
+    lines = path.read_text().splitlines()
+    labels = 'method="GET",path="/zones/{id}/resourceRecords"'
+    assert f'bam_api_requests_total{{{labels},status="200"}} 1' in lines
+    assert f'bam_api_requests_total{{{labels},status="503"}} 1' in lines
+    assert f'bam_api_request_duration_seconds_bucket{{{labels},le="0.01"}} 0' in lines
+    assert f'bam_api_request_duration_seconds_bucket{{{labels},le="0.025"}} 1' in lines
+    assert f'bam_api_request_duration_seconds_bucket{{{labels},le="0.5"}} 2' in lines
+    assert f'bam_api_request_duration_seconds_count{{{labels}}} 2' in lines
+    assert f'bam_api_response_bytes_total{{{labels}}} 2048' in lines
+    quoted = 'method="POST",path="/zones/{id}/\\"quoted\\""'
+    assert f'bam_api_request_duration_seconds_bucket{{{quoted},le="10.0"}} 0' in lines
+    assert f'bam_api_request_duration_seconds_bucket{{{quoted},le="+Inf"}} 1' in lines
+    assert lines.count("# TYPE bam_api_request_duration_seconds histogram") == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["bam.prom"]
+
+
+def test_summary_puts_the_slowest_endpoint_first():
+    lines = observed().summary().splitlines()
+    assert "POST" in lines[1] and "timeout:1" in lines[1] and ">10000" in lines[1]
+    assert "200:1 503:1" in lines[2]
@@ -0,0 +1,21 @@
+from changed_zones import mirror, v2api
+
+Zone = "008.privatelink.example.com"
+
+
+def test_mirror_loads_then_syncs_changes(bam, tmp_path):
+    view = mirror.attach(str(tmp_path / "mirror.db"), max_age=None)
+    counts = view.counts()
+    assert counts["zones"] >= 10 and counts["rrs"] >= 300 and counts["networks"] > 0
+
+    zid = v2api.get_zone_id(Zone)
+    a = next(rr for rr in v2api.get_zone_rrs(zid, full=True) if rr.get("recordType") == "A")
+    fqdn = f"{a['name']}.{Zone}"
+    assert v2api.is_A_rr(fqdn, a["rdata"]) == a["id"]
+
+    new_id = v2api.create_generic_rr(f"mirrored.{Zone}", "A", "10.7.1.1")
+    v2api.delete_rr_by_id(a["id"])
+    assert v2api.is_A_rr(f"mirrored.{Zone}", "10.7.1.1") == new_id
+    assert v2api.is_A_rr(fqdn, a["rdata"]) is False
+    assert view.sync() == 0
+    mirror.detach()
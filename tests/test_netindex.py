@@ -0,0 +1,35 @@
+from changed_zones.netindex import NetworkIndex
+
+Networks = [
+    {"range": "10.1.1.128/26", "id": 3},
+    {"range": "10.1.0.0/24", "id": 1},
+    {"range": "10.1.1.0/25", "id": 2},
+    {"range": "10.2.0.0/16", "id": 4},
+]
+
+
+def test_containing_at_range_boundaries():
+    index = NetworkIndex(Networks)
+    assert index.containing("10.0.255.255") is None
+    assert index.containing("10.1.0.0") == ("10.1.0.0/24", 1)
+    assert index.containing("10.1.0.255") == ("10.1.0.0/24", 1)
+    assert index.containing("10.1.1.0") == ("10.1.1.0/25", 2)
+    assert index.containing("10.1.1.127") == ("10.1.1.0/25", 2)
+    assert index.containing("10.1.1.128") == ("10.1.1.128/26", 3)
+    assert index.containing("10.1.1.191") == ("10.1.1.128/26", 3)
+    assert index.containing("10.1.1.192") is None
+    assert index.containing("10.2.255.255") == ("10.2.0.0/16", 4)
+    assert index.containing("10.3.0.0") is None
+
+
+def test_changes_keep_the_ranges_in_order():
+    index = NetworkIndex(Networks)
+    assert index.id("10.1.1.5/25") == 2
+    assert index.remove_id(2)
+    assert index.containing("10.1.1.1") is None
+    index.add("10.1.1.0/25", 5)
+    assert index.containing("10.1.1.1") == ("10.1.1.0/25", 5)
+    index.add("10.1.1.0/25", 6)
+    assert len(index) == 4 and index.id("10.1.1.0/25") == 6
+    assert index.starts == sorted(index.starts)
+    assert not index.remove("192.168.0.0/24")
@@ -0,0 +1,14 @@
+from changed_zones import v2api
+
+
+def test_failed_network_delete_keeps_the_index(bam):
+    index = v2api.get_network_index()
+    (cidr, netid) = next((net, nid) for net, nid in index.by_cidr.items())
+    bam.script(409)
+    assert v2api.delete_network_by_id(netid) is False
+    assert v2api.is_ipv4_network(cidr) == netid
+    assert netid in bam.model.objects
+
+    v2api.delete_network_by_id(netid)
+    assert v2api.is_ipv4_network(cidr) is False
+    assert netid not in bam.model.objects
@@ -0,0 +1,112 @@
+from changed_zones import v2api
+
+Zone = "008.privatelink.example.com"
+
+
+def existing():
+    zid = v2api.get_zone_id(Zone)
+    rrs = v2api.get_zone_rrs(zid, full=True)
+    a = next(rr for rr in rrs if rr.get("recordType") == "A")
+    txt = next(rr for rr in rrs if rr["type"] == "TXTRecord")
+    return (a, txt)
+
+
+def writes(bam):
+    return sum(
+        point.count
+        for (method, path), point in v2api.Stats.endpoints.items()
+        if method in ("POST", "PUT", "DELETE") and path != "/sessions"
+    )
+
+
+def test_plan_reports_each_change_and_writes_nothing(bam):
+    (a, txt) = existing()
+    changes = [
+        ("add", f"new.{Zone}", "A", "10.7.0.1", "600"),
+        ("add", f"{a['name']}.{Zone}", "A", a["rdata"], None),
+        ("update", f"{txt['name']}.{Zone}", "TXT", "changed", None),
+        ("delete", f"{a['name']}.{Zone}", "A", a["rdata"], None),
+        ("delete", f"gone.{Zone}", "A", "10.7.0.2", None),
+        ("add", "www.nowhere.example.org", "A", "10.7.0.3", None),
+        ("add", f"host.{Zone}", "HOST", "10.250.0.9", None),
+        ("frob", f"x.{Zone}", "A", "10.7.0.4", None),
+    ]
+    before = len(bam.model.objects)
+    (results, cost) = v2api.plan_changes(changes)
+    assert [result["status"] for result in results] == [
+        "create",
+        "no-op",
+        "update",
+        "delete",
+        "missing record",
+        "missing zone",
+        "create",
+        "invalid",
+    ]
+    assert (cost["POST"], cost["PUT"], cost["DELETE"], cost["zones"], cost["networks"]) == (3, 1, 1, 1, 1)
+    assert cost["writes"] == 7
+    assert len(bam.model.objects) == before
+    assert writes(bam) == 0
+
+
+def test_plan_flags_old_new_values(bam):
+    (a, txt) = existing()
+    changes = [
+        ("update", f"{a['name']}.{Zone}", "A", f"{a['rdata']}:10.7.0.5", "600"),
+        ("update", f"{a['name']}.{Zone}", "A", "10.7.0.5:bogus", "600"),
+        ("update", f"{a['name']}.{Zone}", "CNAME", "www.example.com:www2.example.com", None),
+        ("update", f"{txt['name']}.{Zone}", "TXT", "Old text:New text", None),
+        ("update", f"{a['name']}.{Zone}", "A", "10.7.0.5", "600"),
+    ]
+    (results, cost) = v2api.plan_changes(changes)
+    assert [result["status"] for result in results] == ["invalid", "invalid", "invalid", "update", "update"]
+    assert "old:new" in results[0]["note"] and "old:new" in results[2]["note"]
+    assert results[1]["note"] == "not a valid A value"
+    assert "old:new" in results[3]["note"]
+    assert cost["PUT"] == 2
+
+
+def test_apply_refuses_old_new_values(bam):
+    (a, _) = existing()
+    results = v2api.apply_changes([("update", f"{a['name']}.{Zone}", "A", f"{a['rdata']}:10.7.0.6", None)])
+    assert results[0]["status"] == "invalid"
+    assert writes(bam) == 0
+    assert bam.model.objects[a["id"]]["rdata"] == a["rdata"]
+
+
+def test_adding_an_existing_rr_gives_its_id(bam):
+    (a, _) = existing()
+    assert v2api.create_generic_rr(f"{a['name']}.{Zone}", "A", a["rdata"]) == a["id"]
+    assert v2api.create_alias_rr(f"{a['name']}.{Zone}", "www.example.com") is False
+
+
+def test_apply_gives_ids_to_repeated_and_refused_adds(bam, monkeypatch):
+    apply_write = v2api._apply_write
+
+    def racing(write):
+        # another client adds the same RR after the zone was read
+        if write["method"] == "POST" and write["rr"]["name"] == "raced":
+            v2api.create_generic_rr(f"raced.{Zone}", "A", "10.7.0.9")
+        return apply_write(write)
+
+    monkeypatch.setattr(v2api, "_apply_write", racing)
+    results = v2api.apply_changes(
+        [
+            ("add", f"twice.{Zone}", "A", "10.7.0.8", None),
+            ("add", f"twice.{Zone}", "A", "10.7.0.8", None),
+            ("add", f"raced.{Zone}", "A", "10.7.0.9", None),
+        ]
+    )
+    assert [result["status"] for result in results] == ["created", "unchanged", "unchanged"]
+    assert results[0]["id"] and results[1]["id"] == results[0]["id"]
+    assert results[2]["id"] == v2api.find_rr(v2api.get_zone_id(Zone), "raced", "A", "10.7.0.9")
+    assert results[2]["id"]
+
+
+def test_read_changes_keeps_line_numbers(tmp_path):
+    path = tmp_path / "changes.txt"
+    path.write_text("# header\n\nadd, a.example.com, 600, A, 10.0.0.1\nupdate, b.example.com, , TXT, \"x, y\"\n")
+    assert v2api.read_changes(str(path)) == [
+        (3, ("add", "a.example.com", "A", "10.0.0.1", "600")),
+        (4, ("update", "b.example.com", "TXT", "x, y", None)),
+    ]
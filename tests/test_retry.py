@@ -0,0 +1,82 @@
+import time
+
+from changed_zones import v2api
+
+
+def trip(bam):
+    """open the breaker with as many 503s as its threshold"""
+    bam.script(*[503] * v2api.Breaker.threshold)
+    for _ in range(v2api.Breaker.threshold):
+        assert v2api._request("GET", "/settings") is None
+    assert v2api.Breaker.open
+
+
+def test_retries_until_the_reply_is_good(bam):
+    bam.script(503, 429)
+    resp = v2api._request("GET", "/settings")
+    assert resp.status_code == 200
+    statuses = v2api.Stats.endpoints[("GET", "/settings")].statuses
+    assert statuses["503"] == 1 and statuses["429"] == 1 and statuses["200"] >= 1
+    assert not v2api.Breaker.open
+
+
+def test_posts_are_not_retried_after_5xx(bam):
+    zid = v2api.get_zone_id("002.privatelink.example.com")
+    bam.script(503)
+    payload = {"type": "TXTRecord", "name": "once", "text": "x"}
+    assert v2api._request("POST", f"/zones/{zid}/resourceRecords", payload=payload) is None
+    assert not bam.model.names.get("once.002.privatelink.example.com")
+
+
+def test_repeated_500s_open_the_breaker(bam):
+    bam.script(*[500] * v2api.Breaker.threshold)
+    for _ in range(v2api.Breaker.threshold):
+        assert v2api._request("GET", "/settings") is None
+    assert v2api.Breaker.open
+    assert v2api.Stats.endpoints[("GET", "/settings")].statuses["500"] == v2api.Breaker.threshold
+
+
+def test_refused_requests_leave_the_breaker_alone(bam):
+    bam.script(500, 500, 404, 500)
+    for _ in range(4):
+        assert v2api._request("GET", "/settings") is None
+    assert v2api.Breaker.open
+
+
+def test_open_breaker_fails_fast(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    trip(bam)
+    sent = v2api.Stats.endpoints[("GET", "/settings")].count
+    assert v2api._request("GET", "/settings") is None
+    assert v2api.Stats.endpoints[("GET", "/settings")].count == sent
+
+
+def test_breaker_closes_after_a_throttled_trial(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    trip(bam)
+    time.sleep(v2api.Breaker.cooldown)
+    monkeypatch.setattr(v2api, "Retries", 2)
+    bam.script(429)
+    resp = v2api._request("GET", "/settings")
+    assert resp is not None and resp.status_code == 200
+    assert not v2api.Breaker.open
+
+
+def test_throttled_trial_without_retries_lets_the_next_one_through(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    trip(bam)
+    time.sleep(v2api.Breaker.cooldown)
+    bam.script(429)
+    assert v2api._request("GET", "/settings") is None
+    assert v2api._request("GET", "/settings").status_code == 200
+    assert not v2api.Breaker.open
+
+
+def test_breaker_closes_after_a_trial_that_logs_in_again(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    trip(bam)
+    time.sleep(v2api.Breaker.cooldown)
+    bam.tokens.clear()
+    resp = v2api._request("GET", "/settings")
+    assert resp is not None and resp.status_code == 200
+    assert not v2api.Breaker.open
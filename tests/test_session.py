@@ -0,0 +1,45 @@
+import pytest
+
+from changed_zones import v2api
+
+
+def add_txt(model, count):
+    """count TXT records added through the model, each logged as a transaction"""
+    with model.lock:
+        zone = model.zone_path(model.listing("views")[0], "001.privatelink.example.com")
+        for num in range(count):
+            model.record(zone, {"type": "TXTRecord", "name": f"t{num}", "text": f"text {num}"})
+    return list(range(1, len(model.transactions) + 1))
+
+
+def test_expired_token_logs_in_once_for_many_threads(bam):
+    tids = add_txt(bam.model, 40)
+    bam.tokens.clear()
+    for _ in range(3):
+        ops = v2api.get_operations(tids, concurrency=16)
+        assert [op[0]["resourceType"] for op in ops] == ["TXTRecord"] * len(tids)
+    assert v2api.Stats.endpoints[("POST", "/sessions")].count == 2
+
+
+def test_sess_is_only_replaced_by_a_logged_in_session(bam):
+    seen = list()
+    login = v2api._use_session
+
+    def watch(sess):
+        seen.append(sess.headers.get("Authorization"))
+        login(sess)
+
+    v2api._use_session = watch
+    try:
+        v2api.relogin()
+    finally:
+        v2api._use_session = login
+    assert seen and all(auth and auth.startswith("Basic ") for auth in seen)
+    assert v2api._request("GET", "/settings").status_code == 200
+
+
+def test_failed_relogin_raises(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    bam.script(401, 500)
+    with pytest.raises(v2api.LoginError):
+        v2api._request("GET", "/settings")
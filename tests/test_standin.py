@@ -0,0 +1,43 @@
+import pytest
+
+from changed_zones import standin, v2api
+
+
+def test_filter_expressions():
+    test = standin.compile_filter("(type:eq('TXTRecord') or ttl:gt(60)) and name:startsWith('r1')")
+    assert test({"type": "TXTRecord", "ttl": 5, "name": "r10"})
+    assert test({"type": "GenericRecord", "ttl": 3600, "name": "r1"})
+    assert not test({"type": "TXTRecord", "ttl": 5, "name": "x1"})
+    assert standin.compile_filter("id:in(1, 2,3)")({"id": 3})
+    with pytest.raises(standin.Error):
+        standin.compile_filter("name:like('x')")
+
+
+def test_listing_pages_and_fields(bam):
+    zones = v2api.get_all_zones(v2api.ConfID, v2api.ViewID)
+    assert "000.privatelink.example.com" in zones
+    rrs = list(v2api.paginate("/resourceRecords", fields="id,name", limit=7, filter="name:startsWith('r2')"))
+    assert rrs and all(set(rr) == {"id", "name"} for rr in rrs)
+    assert len(rrs) == len({rr["id"] for rr in rrs})
+
+
+def test_scripted_statuses_come_first(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Retries", 0)
+    bam.script(503, 404)
+    assert v2api._request("GET", "/settings") is None
+    assert v2api._request("GET", "/settings") is None
+    assert v2api._request("GET", "/settings").json()["data"][0]["hostname"] == "standin"
+
+
+def test_writes_are_logged_as_transactions(bam):
+    before = v2api.get_last_transaction_id()
+    zid = v2api.get_zone_id("001.privatelink.example.com")
+    resp = v2api._request(
+        "POST",
+        f"/zones/{zid}/resourceRecords",
+        payload={"type": "TXTRecord", "name": "added", "text": "hello"},
+    )
+    assert resp.status_code == 201
+    assert v2api.get_last_transaction_id() == before + 1
+    ops = bam.model.operations[before + 1]
+    assert ops[0]["operationType"] == "ADD" and ops[0]["resourceType"] == "TXTRecord"
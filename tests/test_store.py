@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from changed_zones import cli, v2api
+from changed_zones.store import ChangeStore
+
+
+def add_a_records(model, count, zone="003.privatelink.example.com"):
+    """count A records added by Uname, each logged as a transaction"""
+    with model.lock:
+        model.user["name"] = v2api.Uname
+        parent = model.zone_path(model.listing("views")[0], zone)
+        for num in range(count):
+            fields = {"type": "GenericRecord", "recordType": "A", "rdata": f"10.9.0.{num}", "name": f"w{num}"}
+            model.record(parent, dict(fields, ttl=60, comment=None))
+
+
+def stored(db):
+    ops = db.con.execute("SELECT count(*), count(DISTINCT act_id) FROM operations").fetchone()
+    return (ops, db.fetch_last_change()[1])
+
+
+def test_failed_poll_resumes_after_what_it_wrote(bam, tmp_path, monkeypatch):
+    add_a_records(bam.model, 25)
+    owning_zone = cli.owning_zone
+
+    def failing(fqdn):
+        if fqdn.startswith("w16."):
+            raise RuntimeError("resolving failed")
+        return owning_zone(fqdn)
+
+    monkeypatch.setattr(cli, "owning_zone", failing)
+    with ChangeStore(str(tmp_path / "changes.db"), batch_size=10) as db:
+        cli.update_last_change(db, 0)
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                cli.poll(db)
+            db.discard()
+            assert stored(db) == ((10, 10), 10)
+        monkeypatch.setattr(cli, "owning_zone", owning_zone)
+        assert cli.poll(db) == 15
+        assert stored(db) == ((25, 25), 25)
+        assert cli.poll(db) == 0
+    assert cli.Changed_zones == set()
+
+
+def test_poll_records_a_cname_added_through_the_standin(bam, tmp_path):
+    bam.model.user["name"] = v2api.Uname
+    zone = "003.privatelink.example.com"
+    assert v2api.create_alias_rr(f"alias.{zone}", "target.example.org")
+    with ChangeStore(str(tmp_path / "changes.db")) as db:
+        cli.update_last_change(db, len(bam.model.transactions) - 2)
+        assert cli.poll(db) == 1
+        rows = db.con.execute("SELECT rr_type, rr_value, zone FROM operations WHERE bc_type = 'AliasRecord'")
+        assert rows.fetchall() == [("CNAME", "target.example.org", zone)]
+    operations = [act["operation"] for act in bam.model.transactions[-2:]]
+    assert operations == ["ADD_EXTERNAL_HOST_RECORD", "ADD_ALIAS_RECORD"]
+
+
+def test_operations_are_stored_once(tmp_path):
+    row = (7, 0, 1001, "ADD", "GenericRecord", None, "a", "a.example.com", "A", "10.0.0.1", 60, "example.com")
+    with ChangeStore(str(tmp_path / "changes.db")) as db:
+        for _ in range(2):
+            db.add_transaction((7, "2025-01-01T00:00:00Z", "Generic Record was added", "ADD_GENERIC_RECORD", "u"))
+            db.add_operations([row, row[:1] + (1,) + row[2:]], 7)
+            db.flush()
+        assert stored(db) == ((2, 1), 7)
+
+
+def test_older_databases_get_op_id(tmp_path):
+    path = str(tmp_path / "old.db")
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE operations (ops_id INTEGER PRIMARY KEY, act_id INTEGER, rr_id INTEGER, op_type TEXT,"
+        " bc_type TEXT, rr_comment TEXT, rr_hname TEXT, rr_fqdn TEXT, rr_type TEXT, rr_value TEXT, rr_ttl INTEGER)"
+    )
+    con.executemany("INSERT INTO operations (act_id, rr_id) VALUES (?, ?)", [(1, 5), (1, 5)])
+    con.commit()
+    con.close()
+    with ChangeStore(path) as db:
+        assert "op_id" in db.columns("operations")
+        assert db.con.execute("SELECT count(*) FROM operations").fetchone()[0] == 2
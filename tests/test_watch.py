@@ -0,0 +1,42 @@
+from click.testing import CliRunner
+
+from changed_zones import cli, v2api
+
+
+class Clock:
+    """stands in for the time module in cli: every reading is a minute on, and the third sleep is ^C"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = 0
+
+    def monotonic(self):
+        self.now += 60
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps += 1
+        if self.sleeps >= 3:
+            raise KeyboardInterrupt
+
+
+def test_watch_outlives_a_failed_zone_refresh(bam, monkeypatch, tmp_path):
+    monkeypatch.setattr(cli, "DB", str(tmp_path / "changes.db"))
+    monkeypatch.setattr(cli, "time", Clock())
+    refreshes = list()
+    load = v2api.load_zone_catalogue
+
+    def flaky(refresh=False):
+        refreshes.append(refresh)
+        if len(refreshes) == 2:
+            raise v2api.PageError("paginate: GET /zones failed at offset 0")
+        return load(refresh)
+
+    monkeypatch.setattr(v2api, "load_zone_catalogue", flaky)
+    result = CliRunner().invoke(cli.run, ["watch", "--zone-refresh", "30"])
+    assert result.exit_code == 0, result.output
+    assert "poll failed" in result.output
+    assert len(refreshes) == 4
@@ -0,0 +1,72 @@
+from click.testing import CliRunner
+
+from changed_zones import cli, v2api
+from changed_zones.store import ChangeStore
+
+New_zone = "new.003.privatelink.example.com"
+
+
+def add_zone_with_record(model):
+    with model.lock:
+        model.user["name"] = v2api.Uname
+        zone = model.zone_path(model.listing("views")[0], New_zone)
+        model.record(zone, {"type": "GenericRecord", "recordType": "A", "rdata": "10.8.0.1", "name": "www", "ttl": 60})
+
+
+def test_saved_catalogue_serves_lookups_until_refreshed(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Zone_cache_ttl", 3600)
+    v2api.load_zone_catalogue(refresh=True)
+    add_zone_with_record(bam.model)
+    v2api.basic_auth()
+    assert not v2api.is_zone(New_zone)
+    v2api.basic_auth(refresh_zones=True)
+    assert v2api.is_zone(New_zone)
+    assert cli.owning_zone(f"www.{New_zone}") == New_zone
+
+
+def test_from_last_change_attributes_changes_to_new_zones(bam, monkeypatch, tmp_path):
+    monkeypatch.setattr(v2api, "Zone_cache_ttl", 3600)
+    monkeypatch.setattr(cli, "DB", str(tmp_path / "changes.db"))
+    v2api.load_zone_catalogue(refresh=True)
+    add_zone_with_record(bam.model)
+    result = CliRunner().invoke(cli.run, ["from-last-change"])
+    assert result.exit_code == 0, result.output
+    with ChangeStore(cli.DB) as db:
+        rows = db.report()
+    assert [row[-1] for row in rows] == [New_zone]
+
+
+def test_stale_catalogue_adds_to_the_zone_bam_has(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Zone_cache_ttl", 3600)
+    v2api.load_zone_catalogue(refresh=True)
+    add_zone_with_record(bam.model)
+    assert not v2api.is_zone(New_zone)
+    rrid = v2api.create_generic_rr(f"mail.{New_zone}", "A", "10.8.0.2")
+    zid = bam.model.objects[rrid]["zone"]["id"]
+    assert bam.model.objects[zid]["absoluteName"] == New_zone
+    assert v2api.ViewZones.id(New_zone) == zid
+
+
+def zone_posts():
+    return sum(
+        point.count
+        for (method, path), point in v2api.Stats.endpoints.items()
+        if method == "POST" and path.endswith("/zones")
+    )
+
+
+def test_ensure_zones_creates_missing_parents_a_level_at_a_time(bam, monkeypatch):
+    monkeypatch.setattr(v2api, "Zone_cache_ttl", 3600)
+    v2api.load_zone_catalogue(refresh=True)
+    with bam.model.lock:
+        made = bam.model.zone_path(bam.model.listing("views")[0], "y.003.privatelink.example.com")
+    wanted = ["x.y.003.privatelink.example.com", "z.y.003.privatelink.example.com", "q.brand.example.net"]
+    zids = v2api.ensure_zones(wanted + ["005.privatelink.example.com"])
+    # net, example.net, brand.example.net, the wanted three and y.003, which BAM had already
+    assert zone_posts() == 7
+    assert zids["005.privatelink.example.com"] == v2api.get_zone_id("005.privatelink.example.com")
+    assert v2api.ViewZones.id("y.003.privatelink.example.com") == made["id"]
+    for zone in wanted:
+        zone_obj = bam.model.objects[zids[zone]]
+        assert zone_obj["absoluteName"] == zone
+        assert v2api.ViewZones.id(zone.split(".", 1)[1]) < zids[zone]